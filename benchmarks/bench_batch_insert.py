@@ -0,0 +1,50 @@
+# benchmarks/bench_batch_insert.py
+# Compara a gravação de muitas NCs: um INSERT por linha (execute_transaction)
+# contra o INSERT multi-linha paginado (database.execute_batch).
+#
+# Uso: python benchmarks/bench_batch_insert.py [1000 10000]
+# TÉCNICO: As NCs de teste (2099NC...) são apagadas depois de cada medição.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+SQL_UMA = """INSERT INTO notas_de_credito
+             (numero_nc, data_recebimento, data_validade_empenho, valor_inicial, ptres, natureza_despesa, fonte, pi, ug_gestora, observacao)
+             VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)"""
+SQL_LOTE = """INSERT INTO notas_de_credito
+              (numero_nc, data_recebimento, data_validade_empenho, valor_inicial, ptres, natureza_despesa, fonte, pi, ug_gestora, observacao)
+              VALUES %s RETURNING id"""
+
+
+def linhas(quantidade):
+    return [(f"2099NC{i:06d}", "2099-01-01", "2099-12-31", 1000, "000000", "339030", "0000000000", "BENCH000000", "000000", "benchmark")
+            for i in range(1, quantidade + 1)]
+
+def limpar():
+    database.execute_query("DELETE FROM notas_de_credito WHERE numero_nc LIKE '2099NC%%'")
+
+def medir(funcao):
+    inicio = time.perf_counter()
+    try:
+        funcao()
+        return time.perf_counter() - inicio
+    finally:
+        limpar()
+
+def main(quantidades):
+    limpar()
+    print(f"{'linhas':>8} | {'1 INSERT/linha':>16} | {'execute_batch':>16} | ganho")
+    for n in quantidades:
+        dados = linhas(n)
+        t_uma = medir(lambda: database.execute_transaction([(SQL_UMA, d) for d in dados]))
+        t_lote = medir(lambda: database.execute_batch(SQL_LOTE, dados, returning=True))
+        print(f"{n:>8} | {n / t_uma:>10.0f} lin/s | {n / t_lote:>10.0f} lin/s | {t_uma / t_lote:.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [1000, 10000])
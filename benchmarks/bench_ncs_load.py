@@ -0,0 +1,85 @@
+# benchmarks/bench_ncs_load.py
+# Compara o carregamento da aba NCs: consulta antiga (1 + N idas ao banco)
+# contra a consulta agregada única (montar_sql_ncs, sem paginação).
+#
+# Uso: python benchmarks/bench_ncs_load.py [100 1000 10000]
+# TÉCNICO: Os dados de teste são inseridos numa transação que é desfeita (ROLLBACK) no fim,
+# por isso o banco local não é alterado.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from views.ncs_view import montar_sql_ncs
+
+SECOES_POR_NC = 3
+REPETICOES = 3
+
+
+def semear(cur, quantidade):
+    """Cria 'quantidade' NCs de teste (ano 2099) com SECOES_POR_NC distribuições cada."""
+    ids_secoes = []
+    for i in range(SECOES_POR_NC):
+        cur.execute("INSERT INTO secoes (nome) VALUES (%s) RETURNING id", (f"BENCH SEÇÃO {i}",))
+        ids_secoes.append(cur.fetchone()['id'])
+
+    cur.execute("""
+        INSERT INTO notas_de_credito
+            (numero_nc, data_recebimento, data_validade_empenho, valor_inicial, ptres, natureza_despesa, fonte, pi, ug_gestora, observacao)
+        SELECT '2099NC' || LPAD(g::text, 6, '0'), DATE '2099-01-01', DATE '2099-12-31', 3000,
+               '000000', '339030', '0000000000', 'BENCH000000', '000000', 'benchmark'
+        FROM generate_series(1, %s) g
+    """, (quantidade,))
+    cur.execute("""
+        INSERT INTO distribuicao_nc_secoes (id_nc, id_secao, valor_alocado)
+        SELECT nc.id, s.id, 1000
+        FROM notas_de_credito nc CROSS JOIN unnest(%s::int[]) AS s(id)
+        WHERE nc.numero_nc LIKE '2099NC%%'
+    """, (ids_secoes,))
+
+
+def carregar_antigo(cur):
+    cur.execute("SELECT DISTINCT ON (TRIM(numero_nc)) * FROM ncs_com_saldos WHERE pi = %s "
+                "ORDER BY TRIM(numero_nc) ASC, data_recebimento DESC", ("BENCH000000",))
+    ncs = cur.fetchall()
+    for nc in ncs:
+        cur.execute("SELECT * FROM distribuicao_nc_secoes WHERE id_nc = %s", (nc['id_nc'],))
+        nc['distribuicao_nc_secoes'] = cur.fetchall()
+    return ncs
+
+
+def carregar_agregado(cur):
+    cur.execute(montar_sql_ncs(" AND pi = %s"), ("BENCH000000",))
+    return cur.fetchall()
+
+
+def cronometrar(funcao, cur):
+    melhor = None
+    for _ in range(REPETICOES):
+        inicio = time.perf_counter()
+        linhas = funcao(cur)
+        duracao = time.perf_counter() - inicio
+        melhor = duracao if melhor is None else min(melhor, duracao)
+    return melhor, len(linhas)
+
+
+def main(tamanhos):
+    print(f"{'NCs':>8} | {'1+N (ms)':>10} | {'agregada (ms)':>13} | ganho")
+    for quantidade in tamanhos:
+        with database.conexao() as conn:
+            try:
+                with conn.cursor() as cur:
+                    semear(cur, quantidade)
+                    t_antigo, n1 = cronometrar(carregar_antigo, cur)
+                    t_novo, n2 = cronometrar(carregar_agregado, cur)
+                    assert n1 == n2 == quantidade, (n1, n2, quantidade)
+            finally:
+                conn.rollback()
+        print(f"{quantidade:>8} | {t_antigo * 1000:>10.1f} | {t_novo * 1000:>13.1f} | {t_antigo / t_novo:.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [100, 1000, 10000])
@@ -0,0 +1,51 @@
+# benchmarks/bench_preparadas.py
+# Compara as consultas de filtros e da lista de NCs enviadas como texto (execute_query)
+# com as mesmas consultas preparadas (database.preparar + execute_preparada).
+#
+# Uso: python benchmarks/bench_preparadas.py [repeticoes]
+# TÉCNICO: Só leituras; corre contra os dados que existirem no banco local.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from views.ncs_view import montar_sql_ncs
+
+CONSULTAS = {
+    "pis": ("SELECT DISTINCT pi FROM ncs_com_saldos ORDER BY pi", ()),
+    "nds_do_pi": ("SELECT DISTINCT natureza_despesa FROM ncs_com_saldos WHERE pi = %s ORDER BY natureza_despesa", ("BENCH000000",)),
+    "lista_ncs": (montar_sql_ncs(" AND status_calculado = %s", limitar=True), ("Ativa", 51)),
+}
+
+
+def medir(funcao, repeticoes):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        funcao()
+    return 1000 * (time.perf_counter() - inicio) / repeticoes
+
+def main(repeticoes):
+    print(f"{'consulta':>10} | {'texto':>10} | {'preparada':>10} | ganho")
+    for nome, (sql, params) in CONSULTAS.items():
+        preparada = database.preparar(sql, f"bench_{nome}")
+        t_texto = medir(lambda: database.execute_query(sql, params), repeticoes)
+        t_prep = medir(lambda: database.execute_preparada(preparada, params), repeticoes)
+        print(f"{nome:>10} | {t_texto:>7.3f} ms | {t_prep:>7.3f} ms | {t_texto / t_prep:.2f}x")
+    print()
+    print("Cliente (tempo de relógio, inclui a rede):")
+    for nome, m in database.metricas_preparadas().items():
+        if nome.startswith("bench_"): print(f"  {nome}: {m}")
+    servidor = database.metricas_preparadas_servidor()
+    if servidor is None:
+        print("Servidor: pg_stat_statements não está instalado (CREATE EXTENSION pg_stat_statements).")
+    else:
+        print("Servidor (pg_stat_statements, todas as conexões):")
+        for nome, m in servidor.items():
+            if nome.startswith("bench_"): print(f"  {nome}: {m}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,62 @@
+# benchmarks/bench_siafi_extracao.py
+# Compara os dois modos de extrair_dados_siafi num conjunto de PDFs do SIAFI:
+#   "pagina"  - texto com layout da página inteira (método original)
+#   "regioes" - só as regiões conhecidas, a partir das palavras (com recurso à página inteira)
+#
+# Uso: python benchmarks/bench_siafi_extracao.py <pasta_com_pdfs> [repeticoes]
+# Mostra o tempo médio por PDF em cada modo e os PDFs em que os dados extraídos diferem.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from siafi_parser import extrair_dados_siafi
+
+MODOS = ("pagina", "regioes")
+
+
+def carregar_corpus(pasta):
+    corpus = []
+    for nome in sorted(os.listdir(pasta)):
+        if nome.lower().endswith(".pdf"):
+            with open(os.path.join(pasta, nome), "rb") as f:
+                corpus.append((nome, f.read()))
+    return corpus
+
+def medir(corpus, modo, repeticoes):
+    """Devolve (segundos por PDF, {nome: dados}) para o modo indicado."""
+    resultados = {}
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        for nome, conteudo in corpus:
+            resultados[nome] = extrair_dados_siafi(conteudo, modo=modo)
+    return (time.perf_counter() - inicio) / (repeticoes * len(corpus)), resultados
+
+def main(pasta, repeticoes):
+    corpus = carregar_corpus(pasta)
+    if not corpus:
+        print(f"Nenhum PDF encontrado em '{pasta}'.")
+        return
+
+    print(f"{len(corpus)} PDF(s), {repeticoes} repetição(ões) por modo\n")
+    tempos, dados = {}, {}
+    for modo in MODOS:
+        tempos[modo], dados[modo] = medir(corpus, modo, repeticoes)
+        print(f"{modo:>8}: {1000 * tempos[modo]:8.1f} ms/PDF  ({1 / tempos[modo]:.1f} PDFs/s)")
+    print(f"\nGanho do modo 'regioes': {tempos['pagina'] / tempos['regioes']:.2f}x")
+
+    diferentes = [nome for nome, _ in corpus if dados["pagina"][nome] != dados["regioes"][nome]]
+    print(f"PDFs com dados diferentes entre os modos: {len(diferentes)}")
+    for nome in diferentes:
+        a, b = dados["pagina"][nome] or {}, dados["regioes"][nome] or {}
+        campos = sorted(c for c in set(a) | set(b) if a.get(c) != b.get(c))
+        print(f"  {nome}: {', '.join(campos)}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python benchmarks/bench_siafi_extracao.py <pasta_com_pdfs> [repeticoes]")
+        sys.exit(1)
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 3)
@@ -0,0 +1,131 @@
+# benchmarks/bench_siafi_parser.py
+# Corpus sintético de NCs do SIAFI (gerado com reportlab) para validar e medir o siafi_parser.
+#
+# Uso: python benchmarks/bench_siafi_parser.py [quantidade] [--guardar pasta]
+#   quantidade      - número de PDFs do corpus (padrão: 50)
+#   --guardar pasta - grava também os PDFs gerados (para usar com bench_siafi_extracao.py)
+#
+# Para cada PDF confere os campos extraídos com os valores usados na geração (termina com
+# código 1 se algum falhar) e mostra o débito, em PDFs/s, dos modos "pagina" e "regioes".
+
+import io
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from siafi_parser import analisar_pdf_siafi, MESES_MAP, VERSAO_PARSER_SIAFI
+
+MESES = list(MESES_MAP)
+REPETICOES = 3
+
+
+def gerar_esperado(i, rnd):
+    """Valores de uma NC fictícia (no formato que o parser deve devolver)."""
+    ano = rnd.choice([2025, 2026])
+    dia, mes = rnd.randint(1, 28), rnd.randint(1, 12)
+    prazo_dia, prazo_mes = rnd.randint(1, 28), MESES[rnd.randint(0, 11)]
+    valor = rnd.randint(100, 5_000_000) + rnd.randint(0, 99) / 100
+    valor_txt = f"{valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return {
+        "numero_nc": f"{ano}NC{i:06d}",
+        "data_recebimento": f"{ano}-{mes:02d}-{dia:02d}",
+        "data_validade": f"{ano}-{MESES_MAP[prazo_mes]}-{prazo_dia:02d}",
+        "ptres": f"{rnd.randint(100000, 999999)}",
+        "fonte": f"{rnd.randint(1000000000, 9999999999)}",
+        "nd": rnd.choice(["339030", "339039", "449052", "339014"]),
+        "ug_gestora": f"{rnd.randint(160000, 169999)}",
+        "pi": rnd.choice(["OCS80006000", "E6SUPLJA5PA", "D4DAFUNADOM"]),
+        "valor_inicial": valor_txt,
+        "_prazo_pdf": f"{prazo_dia} {prazo_mes} {str(ano)[2:]}",
+    }
+
+def gerar_pdf(esperado):
+    """PDF de uma página com o layout do SIAFI: cabeçalho, tabela financeira, descrição e itens."""
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    _, altura = A4
+    y = altura - 50
+
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(40, y, "MINISTÉRIO DA DEFESA - SIAFI - NOTA DE CRÉDITO"); y -= 25
+    c.setFont("Helvetica", 9)
+    ano, num = esperado["numero_nc"][:4], int(esperado["numero_nc"][6:])
+    a, m, d = esperado["data_recebimento"].split("-")
+    c.drawString(40, y, f"Ano: {ano}"); c.drawString(200, y, f"Nota de crédito: {num}"); y -= 15
+    c.drawString(40, y, f"Emissão: {d}/{m}/{a}"); c.drawString(200, y, "UG Emitente: 160001"); y -= 30
+
+    colunas = [40, 80, 150, 250, 310, 370, 470]
+    for x, rotulo in zip(colunas, ["Evento", "PTRES", "Fonte", "ND", "UG", "PI", "Valor"]):
+        c.drawString(x, y, rotulo)
+    y -= 14
+    linha = ["1", esperado["ptres"], esperado["fonte"], esperado["nd"], esperado["ug_gestora"], esperado["pi"], esperado["valor_inicial"]]
+    for x, valor in zip(colunas, linha):
+        c.drawString(x, y, valor)
+    y -= 30
+
+    c.drawString(40, y, "Descrição:"); y -= 14
+    c.drawString(40, y, "DESCENTRALIZAÇÃO DE CRÉDITO PARA ATENDER DESPESAS DE CUSTEIO."); y -= 14
+    c.drawString(40, y, f"PRAZO DE EMPENHO {esperado['_prazo_pdf']}"); y -= 30
+
+    c.drawString(40, y, "Itens de Contabilização"); y -= 14
+    for k in range(15):
+        c.drawString(40, y, f"{k + 1:03d}  EVENTO 300300  CONTA 522110000  {esperado['valor_inicial']}"); y -= 12
+
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+def conferir(esperado, dados):
+    """Lista dos campos que o parser leu de forma diferente do esperado."""
+    if dados is None: return ["<nada extraído>"]
+    obtido = dados.como_dict()
+    return [c for c in esperado if not c.startswith("_") and obtido.get(c) != esperado[c]]
+
+def medir(corpus, modo):
+    inicio = time.perf_counter()
+    resultados = []
+    for _ in range(REPETICOES):
+        resultados = [analisar_pdf_siafi(pdf, modo=modo) for _, pdf in corpus]
+    return REPETICOES * len(corpus) / (time.perf_counter() - inicio), resultados
+
+def main(quantidade, pasta_destino=None):
+    rnd = random.Random(42)
+    print(f"siafi_parser v{VERSAO_PARSER_SIAFI}: a gerar {quantidade} PDFs sintéticos...")
+    corpus = []
+    for i in range(1, quantidade + 1):
+        esperado = gerar_esperado(i, rnd)
+        corpus.append((esperado, gerar_pdf(esperado)))
+
+    if pasta_destino:
+        os.makedirs(pasta_destino, exist_ok=True)
+        for esperado, pdf in corpus:
+            with open(os.path.join(pasta_destino, f"{esperado['numero_nc']}.pdf"), "wb") as f:
+                f.write(pdf)
+        print(f"PDFs gravados em '{pasta_destino}'.")
+
+    falhas = 0
+    for modo in ("pagina", "regioes"):
+        pdfs_por_s, resultados = medir(corpus, modo)
+        erros = [(esp["numero_nc"], conferir(esp, dados)) for (esp, _), dados in zip(corpus, resultados)]
+        erros = [(nc, campos) for nc, campos in erros if campos]
+        falhas += len(erros)
+        print(f"{modo:>8}: {pdfs_por_s:7.1f} PDFs/s  - {len(corpus) - len(erros)}/{len(corpus)} corretos")
+        for nc, campos in erros[:10]:
+            print(f"          {nc}: {', '.join(campos)}")
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    pasta = None
+    if "--guardar" in args:
+        pos = args.index("--guardar")
+        pasta = args[pos + 1]
+        del args[pos:pos + 2]
+    sys.exit(main(int(args[0]) if args else 50, pasta))
@@ -0,0 +1,65 @@
+# benchmarks/bench_views.py
+# Mede o que o utilizador espera entre o login e a primeira aba: o aquecimento dos dados de
+# referência (referencias.aquecer) e a construção + primeiro desenho de cada view.
+#
+# Uso: python benchmarks/bench_views.py [porta]
+# e abrir http://localhost:<porta> no navegador (o Flet só corre o alvo quando há uma sessão).
+# TÉCNICO: Só leituras; corre contra os dados que existirem no banco local. Cada view é
+# construída à parte, como em main.construir_view, e removida antes da seguinte.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import flet as ft
+
+import referencias
+from views.dashboard_view import create_dashboard_view
+from views.ncs_view import create_ncs_view
+from views.nes_view import create_nes_view
+from views.relatorios_view import create_relatorios_view
+from views.admin_view import create_admin_view
+
+VIEWS = [
+    ("Painel", create_dashboard_view),
+    ("NCs", create_ncs_view),
+    ("NEs", create_nes_view),
+    ("Relatórios", create_relatorios_view),
+    ("Admin", create_admin_view),
+]
+
+
+def ms(inicio):
+    return (time.perf_counter() - inicio) * 1000
+
+
+def medir(page: ft.Page):
+    inicio = time.perf_counter()
+    referencias.aquecer()
+    t_frio = ms(inicio)
+    inicio = time.perf_counter()
+    referencias.aquecer()
+    print(f"referencias.aquecer: {t_frio:.0f} ms (1.ª vez), {ms(inicio):.0f} ms (já em memória)")
+
+    print(f"{'view':>12} | {'construção (ms)':>15} | {'1.º desenho (ms)':>16}")
+    for nome, criar in VIEWS:
+        ids_antes = {id(c) for c in page.overlay}
+        inicio = time.perf_counter()
+        view = criar(page)
+        t_construcao = ms(inicio)
+        inicio = time.perf_counter()
+        page.add(view)  # dispara on_view_mount, como ao abrir a aba
+        t_desenho = ms(inicio)
+        print(f"{nome:>12} | {t_construcao:>15.0f} | {t_desenho:>16.0f}")
+        page.controls.remove(view)
+        page.overlay[:] = [c for c in page.overlay if id(c) in ids_antes]
+        page.update()
+
+    page.add(ft.Text("Medição terminada; os tempos estão no terminal."))
+
+
+if __name__ == "__main__":
+    porta = int(sys.argv[1]) if len(sys.argv) > 1 else 8551
+    ft.app(target=medir, view=ft.AppView.WEB_BROWSER, port=porta)
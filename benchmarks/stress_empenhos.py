@@ -0,0 +1,81 @@
+# benchmarks/stress_empenhos.py
+# Teste de carga paralela do empenho atómico (saldos.empenhar).
+# Mistura, contra UMA cota, novos empenhos, edições que aumentam uma NE existente e
+# recolhimentos, todos em paralelo, e confere que Empenhado + Recolhido nunca passa do
+# valor alocado (nenhum empenho a descoberto).
+#
+# Uso: python benchmarks/stress_empenhos.py [pedidos] [threads]
+# TÉCNICO: Reutiliza a cota de teste de stress_recolhimentos.py (apagada no fim).
+
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import saldos
+from stress_recolhimentos import criar_cota, apagar_cota, VALOR_ALOCADO
+
+VALOR_POR_PEDIDO = 25.00
+
+
+def main(pedidos, threads):
+    id_secao, id_nc, id_dist = criar_cota()
+    partida = threading.Barrier(threads)
+    contagem = {"ok": 0, "recusados": 0, "erros": 0}
+    lock = threading.Lock()
+
+    try:
+        # NE que as edições vão aumentando (cada edição soma VALOR_POR_PEDIDO ao valor atual)
+        id_ne_editada, _ = saldos.empenhar(id_dist, "2099NE900000", VALOR_POR_PEDIDO, "2099-06-01", "stress base")
+        valor_editada = [VALOR_POR_PEDIDO]
+
+        def pedido(i):
+            if i < threads: partida.wait()
+            try:
+                tipo = i % 4
+                if tipo == 0:
+                    saldos.recolher_saldo(id_nc, id_dist, VALOR_POR_PEDIDO, "2099-06-01", f"stress {i}")
+                elif tipo == 1:
+                    with lock: novo_valor = valor_editada[0] + VALOR_POR_PEDIDO
+                    saldos.empenhar(id_dist, "2099NE900000", novo_valor, "2099-06-01", "stress base", id_ne=id_ne_editada)
+                    with lock: valor_editada[0] = max(valor_editada[0], novo_valor)
+                else:
+                    saldos.empenhar(id_dist, f"2099NE{i:06d}", VALOR_POR_PEDIDO, "2099-06-01", f"stress {i}")
+                chave = "ok"
+            except saldos.SaldoInsuficienteError:
+                chave = "recusados"
+            except Exception as ex:
+                print(f"pedido {i}: {ex}")
+                chave = "erros"
+            with lock: contagem[chave] += 1
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(pedido, range(pedidos)))
+        duracao = time.perf_counter() - inicio
+
+        res = database.execute_query("""
+            SELECT COALESCE((SELECT SUM(valor_empenhado) FROM notas_de_empenho WHERE id_distribuicao = %(d)s), 0) AS empenhado,
+                   COALESCE((SELECT SUM(valor_recolhido) FROM recolhimentos_de_saldo WHERE id_distribuicao = %(d)s), 0) AS recolhido
+        """, {"d": id_dist})
+        empenhado, recolhido = float(res[0]['empenhado']), float(res[0]['recolhido'])
+
+        print(f"{pedidos} pedidos em {threads} threads ({duracao:.2f}s, {pedidos / duracao:.0f} pedidos/s)")
+        print(f"aceites: {contagem['ok']} | recusados: {contagem['recusados']} | erros: {contagem['erros']}")
+        print(f"empenhado R$ {empenhado:.2f} + recolhido R$ {recolhido:.2f} = R$ {empenhado + recolhido:.2f} de R$ {VALOR_ALOCADO:.2f}")
+        print(f"pool: {database.metricas_pool()}")
+
+        ok = empenhado + recolhido <= VALOR_ALOCADO and contagem['erros'] == 0
+        print("RESULTADO:", "OK - nenhum empenho acima do saldo" if ok else "FALHA")
+        return 0 if ok else 1
+    finally:
+        apagar_cota(id_secao, id_nc, id_dist)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    sys.exit(main(args[0] if args else 200, args[1] if len(args) > 1 else 16))
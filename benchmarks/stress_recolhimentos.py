@@ -0,0 +1,92 @@
+# benchmarks/stress_recolhimentos.py
+# Teste de concorrência do recolhimento atómico (saldos.recolher_saldo).
+# Dispara muitos recolhimentos em paralelo contra UMA cota e confere que o total
+# recolhido nunca passa do valor alocado (nenhum saque duplo).
+#
+# Uso: python benchmarks/stress_recolhimentos.py [pedidos] [threads]
+# TÉCNICO: Os pedidos usam conexões diferentes, por isso os dados de teste (NC 2099NC999999)
+# têm de ser gravados de verdade; são apagados no fim, mesmo em caso de erro.
+
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import saldos
+
+VALOR_ALOCADO = 1000.00
+VALOR_POR_PEDIDO = 30.00
+NUMERO_NC_TESTE = "2099NC999999"
+
+
+def criar_cota():
+    res = database.execute_transaction([
+        ("INSERT INTO secoes (nome) VALUES (%s) RETURNING id", ("STRESS RECOLHIMENTOS",)),
+        ("""INSERT INTO notas_de_credito
+                (numero_nc, data_recebimento, data_validade_empenho, valor_inicial, ptres, natureza_despesa, fonte, pi, ug_gestora, observacao)
+            VALUES (%s, '2099-01-01', '2099-12-31', %s, '000000', '339030', '0000000000', 'STRESS00000', '000000', 'stress')
+            RETURNING id""", (NUMERO_NC_TESTE, VALOR_ALOCADO)),
+    ])
+    id_secao, id_nc = res[0][0]['id'], res[1][0]['id']
+    res = database.execute_query(
+        "INSERT INTO distribuicao_nc_secoes (id_nc, id_secao, valor_alocado) VALUES (%s, %s, %s) RETURNING id",
+        (id_nc, id_secao, VALOR_ALOCADO))
+    return id_secao, id_nc, res[0]['id']
+
+def apagar_cota(id_secao, id_nc, id_distribuicao):
+    database.execute_transaction([
+        ("DELETE FROM recolhimentos_de_saldo WHERE id_distribuicao = %s", (id_distribuicao,)),
+        ("DELETE FROM notas_de_empenho WHERE id_distribuicao = %s", (id_distribuicao,)),
+        ("DELETE FROM distribuicao_nc_secoes WHERE id = %s", (id_distribuicao,)),
+        ("DELETE FROM notas_de_credito WHERE id = %s", (id_nc,)),
+        ("DELETE FROM secoes WHERE id = %s", (id_secao,)),
+    ])
+
+def main(pedidos, threads):
+    id_secao, id_nc, id_dist = criar_cota()
+    partida = threading.Barrier(threads)
+    resultados = {"ok": 0, "recusados": 0, "erros": 0}
+    lock = threading.Lock()
+
+    def recolher(i):
+        if i < threads: partida.wait()  # a primeira leva arranca toda ao mesmo tempo
+        try:
+            saldos.recolher_saldo(id_nc, id_dist, VALOR_POR_PEDIDO, "2099-06-01", f"stress {i}")
+            chave = "ok"
+        except saldos.SaldoInsuficienteError:
+            chave = "recusados"
+        except Exception as ex:
+            print(f"pedido {i}: {ex}")
+            chave = "erros"
+        with lock: resultados[chave] += 1
+
+    try:
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(recolher, range(pedidos)))
+        duracao = time.perf_counter() - inicio
+
+        total = database.execute_query(
+            "SELECT COALESCE(SUM(valor_recolhido), 0) AS total FROM recolhimentos_de_saldo WHERE id_distribuicao = %s", (id_dist,))
+        total = float(total[0]['total'])
+        esperados = int(VALOR_ALOCADO // VALOR_POR_PEDIDO)
+
+        print(f"{pedidos} pedidos de R$ {VALOR_POR_PEDIDO:.2f} em {threads} threads ({duracao:.2f}s, {pedidos / duracao:.0f} pedidos/s)")
+        print(f"aceites: {resultados['ok']} (esperado {min(esperados, pedidos)}) | recusados: {resultados['recusados']} | erros: {resultados['erros']}")
+        print(f"total recolhido: R$ {total:.2f} de R$ {VALOR_ALOCADO:.2f} alocados")
+        print(f"pool: {database.metricas_pool()}")
+
+        ok = total <= VALOR_ALOCADO and resultados['ok'] == min(esperados, pedidos) and resultados['erros'] == 0
+        print("RESULTADO:", "OK - nenhum saque acima do saldo" if ok else "FALHA")
+        return 0 if ok else 1
+    finally:
+        apagar_cota(id_secao, id_nc, id_dist)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    sys.exit(main(args[0] if args else 200, args[1] if len(args) > 1 else 16))
@@ -0,0 +1,82 @@
+# cache_pdfs.py
+# Cache persistente dos dados extraídos dos PDFs do SIAFI, indexada pelo SHA-256 do conteúdo.
+# TÉCNICO: O mesmo PDF chega várias vezes (reenviado por email, reimportado depois de uma
+# correção). Com a cache, um PDF já lido devolve os dados sem voltar a passar pelo pdfplumber.
+# A chave inclui a versão do parser: ao mudar o parser, as entradas antigas deixam de ser usadas.
+
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+import time
+
+CACHE_PDFS_CONFIG = {
+    "caminho": os.environ.get("SIAFI_CACHE_PATH", os.path.join("cache", "siafi_pdfs.sqlite3")),
+}
+
+
+def hash_conteudo(conteudo):
+    """SHA-256 (hex) dos bytes do PDF."""
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+class CachePdfs:
+    """Cache chave/valor em SQLite (ficheiro local), partilhada por todas as sessões do processo."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        pasta = os.path.dirname(caminho)
+        if pasta: os.makedirs(pasta, exist_ok=True)
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pdfs_siafi (
+                sha256 TEXT NOT NULL,
+                versao_parser TEXT NOT NULL,
+                dados TEXT NOT NULL,
+                criado_em REAL NOT NULL,
+                PRIMARY KEY (sha256, versao_parser)
+            )
+        """)
+        self._conn.commit()
+
+    def obter(self, sha256, versao_parser):
+        """Dados guardados para este conteúdo e versão do parser (None se não existir)."""
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT dados FROM pdfs_siafi WHERE sha256 = ? AND versao_parser = ?", (sha256, versao_parser)
+            ).fetchone()
+        return json.loads(linha[0]) if linha else None
+
+    def guardar(self, sha256, versao_parser, dados):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pdfs_siafi (sha256, versao_parser, dados, criado_em) VALUES (?, ?, ?, ?)",
+                (sha256, versao_parser, json.dumps(dados, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+
+    def remover_outras_versoes(self, versao_parser):
+        """Apaga as entradas de versões antigas do parser (nunca mais serão lidas). Chamado no arranque (main.py)."""
+        with self._lock:
+            apagadas = self._conn.execute("DELETE FROM pdfs_siafi WHERE versao_parser <> ?", (versao_parser,)).rowcount
+            self._conn.commit()
+        if apagadas: print(f"cache_pdfs: {apagadas} entrada(s) de versões antigas do parser removida(s).")
+        return apagadas
+
+    def fechar(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CachePdfs(**CACHE_PDFS_CONFIG)
+    return _cache
@@ -1,48 +1,934 @@
 # database.py - Versão Completa e Funcional
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import itertools
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.errors
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import PoolError
 
 DB_CONFIG = {
     "host": "localhost", "port": "5432", "database": "controlenc_db",
     "user": "postgres", "password": "Luca$8575" # Sua senha
 }
 
+# TÉCNICO: Parâmetros do pool partilhado por todas as sessões Flet do processo.
+# Podem ser ajustados por variáveis de ambiente sem alterar o código.
+POOL_CONFIG = {
+    "min_conexoes": int(os.environ.get("DB_POOL_MIN", 2)),   # abertas no arranque; as outras abrem-se quando são precisas
+    "max_conexoes": int(os.environ.get("DB_POOL_MAX", 20)),
+    "timeout_espera": float(os.environ.get("DB_POOL_TIMEOUT", 30)),      # segundos à espera de uma conexão livre
+    "verificar_apos_ocioso": float(os.environ.get("DB_POOL_PING", 30)),  # segundos parada antes de um 'SELECT 1'
+}
+
+# Leitura em fluxo (execute_stream): linhas trazidas do servidor por cada ida ao banco.
+STREAM_CONFIG = {
+    "linhas_por_lote": int(os.environ.get("DB_STREAM_LOTE", 2000)),
+}
+
+# Cache de leituras (execute_query(..., cache=True)).
+CACHE_CONSULTAS_CONFIG = {
+    "max_entradas": int(os.environ.get("DB_CACHE_MAX", 1000)),
+    "ttl": float(os.environ.get("DB_CACHE_TTL", 60)),  # segundos; limita o atraso face a escritas feitas fora deste processo
+}
+
+# Consultas preparadas (execute_preparada): no máximo este número de consultas preparadas em
+# cada conexão; a menos usada recentemente é libertada (DEALLOCATE) para dar lugar a outra.
+PREPARADAS_CONFIG = {
+    "max_por_conexao": int(os.environ.get("DB_PREPARADAS_MAX", 32)),
+}
+
+# Canal LISTEN/NOTIFY dos gatilhos de alteração (notificacoes.SQL_INSTALAR_GATILHOS).
+CANAL_ALTERACOES = os.environ.get("DB_CANAL_ALTERACOES", "controlenc_alteracoes")
+
+# Tabelas de que cada view depende: uma escrita numa delas invalida as leituras da view.
+DEPENDENCIAS_VIEWS = {
+    "ncs_com_saldos": {"notas_de_credito", "distribuicao_nc_secoes", "notas_de_empenho", "recolhimentos_de_saldo", "secoes"},
+}
+
+# TÉCNICO: Sem os gatilhos de notificação (notificacoes.instalar_gatilhos falhou ou não correu)
+# o processo não sabe que tabelas mudaram. Enquanto for assim, cada transação que escreveu
+# (tem um txid atribuído no COMMIT) invalida tudo o que é local: referencias.py, versao_dados
+# e a cache de consultas (que nesse modo nem está ligada). Ver ativar_notificacoes.
+_invalidacao_local = True
+
+class _ConexaoPool(psycopg2.extensions.connection):
+    """Conexão do pool; em invalidação local, o COMMIT regista se a transação escreveu."""
+    escreveu = False
+
+    def commit(self):
+        if _invalidacao_local and self.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INTRANS:
+            with self.cursor() as cur:
+                cur.execute("SELECT txid_current_if_assigned() IS NOT NULL AS escreveu")
+                if cur.fetchone()["escreveu"]: self.escreveu = True
+        super().commit()
+
 def get_db_connection():
     return psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
 
-def execute_query(query, params=None):
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute(query, params)
+
+class PoolDeConexoes:
+    """
+    Pool thread-safe de conexões PostgreSQL.
+    - Quem pede primeiro é atendido primeiro (fila FIFO), para nenhuma sessão ficar à espera indefinidamente.
+    - As conexões devolvidas ficam abertas (até max_conexoes) e são reutilizadas: não se paga
+      de novo a ligação, o LISTEN nem as consultas preparadas de cada conexão.
+    - Conexões paradas há muito tempo são testadas antes de serem entregues.
+    - Guarda métricas de espera, uso e checkouts por segundo.
+    """
+
+    def __init__(self, min_conexoes, max_conexoes, timeout_espera=30, verificar_apos_ocioso=30):
+        self.max_conexoes = max_conexoes
+        self.timeout_espera = timeout_espera
+        self.verificar_apos_ocioso = verificar_apos_ocioso
+        self._cond = threading.Condition()
+        # TÉCNICO: Lista própria de conexões ociosas em vez do ThreadedConnectionPool, que fecha
+        # as devolvidas acima de minconn. Nunca há mais de max_conexoes abertas: só se abre
+        # uma nova quando não há nenhuma ociosa e a vaga (_livres) já foi reservada.
+        self._ociosas = []  # a última devolvida é a primeira entregue (fica "quente")
+        self._fila = deque()
+        self._livres = max_conexoes
+        self._ultimo_uso = {}
+        self._pids = {}  # id(conn) -> pid do processo servidor (as conexões novas ainda não estão cá)
+        self._ao_descartar = []  # callback(conn) chamados quando uma conexão é fechada pelo pool
+
+        # Métricas
+        self._checkouts = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._timeouts = 0
+        self._descartadas = 0
+        self._instantes_checkout = deque(maxlen=10000)
+
+        for _ in range(min(min_conexoes, max_conexoes)):
+            self._ociosas.append(self._abrir())
+
+    def _abrir(self):
+        return psycopg2.connect(**DB_CONFIG, connection_factory=_ConexaoPool, cursor_factory=RealDictCursor)
+
+    def obter(self):
+        """Entrega uma conexão saudável, respeitando a ordem de chegada."""
+        inicio = time.monotonic()
+        limite = inicio + self.timeout_espera
+        senha = object()
+
+        with self._cond:
+            self._fila.append(senha)
+            try:
+                while self._fila[0] is not senha or self._livres == 0:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        self._timeouts += 1
+                        raise PoolError(f"Tempo esgotado ({self.timeout_espera}s) à espera de uma conexão livre.")
+                    self._cond.wait(restante)
+                self._livres -= 1
+            finally:
+                self._fila.remove(senha)
+                self._cond.notify_all()
+
+        try:
+            conn = self._checkout_saudavel()
+        except Exception:
+            self._liberar_vaga()
+            raise
+
+        espera = time.monotonic() - inicio
+        with self._cond:
+            self._checkouts += 1
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+            self._instantes_checkout.append(time.monotonic())
+        return conn
+
+    def _checkout_saudavel(self):
+        """Retira uma conexão ociosa (ou abre uma nova); se estiver quebrada, descarta e tenta outra."""
+        for _ in range(self.max_conexoes + 1):
+            with self._cond: conn = self._ociosas.pop() if self._ociosas else None
+            if conn is None:
+                try: conn = self._abrir()
+                except psycopg2.OperationalError as ex:
+                    raise PoolError(f"Não foi possível abrir uma conexão com o banco de dados ({ex}).")
+            if self._esta_saudavel(conn):
+                with self._cond: nova = id(conn) not in self._pids
+                try:
+                    if nova: self._escutar_alteracoes(conn)
+                    with self._cond: self._pids[id(conn)] = conn.get_backend_pid()
+                    return conn
+                except psycopg2.Error:
+                    pass
+            self._descartar(conn)
+        raise PoolError("Não foi possível obter uma conexão saudável com o banco de dados.")
+
+    def _escutar_alteracoes(self, conn):
+        """Conexão nova: LISTEN no canal de alterações, para receber no COMMIT as tabelas que mudaram."""
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN "{CANAL_ALTERACOES}"')
         conn.commit()
-        if cur.description: return cur.fetchall()
-        return None
-    except Exception as e:
-        if conn: conn.rollback()
-        raise e
+
+    def _esta_saudavel(self, conn):
+        if conn.closed:
+            return False
+        ultimo_uso = self._ultimo_uso.get(id(conn))
+        if ultimo_uso is None or time.monotonic() - ultimo_uso < self.verificar_apos_ocioso:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def ao_descartar(self, callback):
+        """Regista callback(conn) para quem guarda estado por conexão (ex.: consultas preparadas)."""
+        self._ao_descartar.append(callback)
+
+    def _fechada(self, conn):
+        """A conexão saiu do pool fechada: esquece tudo o que estava associado ao seu id()."""
+        self._ultimo_uso.pop(id(conn), None)
+        with self._cond: self._pids.pop(id(conn), None)
+        for callback in self._ao_descartar:
+            try: callback(conn)
+            except Exception as ex: print(f"database: callback de conexão descartada falhou ({ex}).")
+
+    def _descartar(self, conn):
+        self._descartadas += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._fechada(conn)
+
+    def devolver(self, conn):
+        """Devolve a conexão ao pool (limpa qualquer transação pendente)."""
+        try:
+            if conn.closed:
+                self._descartar(conn)
+                return
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            self._ultimo_uso[id(conn)] = time.monotonic()
+            with self._cond: self._ociosas.append(conn)
+        except psycopg2.Error:
+            self._descartar(conn)
+        finally:
+            self._liberar_vaga()
+
+    def _liberar_vaga(self):
+        with self._cond:
+            self._livres += 1
+            self._cond.notify_all()
+
+    def metricas(self):
+        """Resumo do estado do pool (para diagnóstico/logs)."""
+        with self._cond:
+            agora = time.monotonic()
+            ultimos_60s = sum(1 for t in self._instantes_checkout if agora - t <= 60)
+            return {
+                "em_uso": self.max_conexoes - self._livres,
+                "ociosas": len(self._ociosas),
+                "max_conexoes": self.max_conexoes,
+                "aguardando": len(self._fila),
+                "checkouts": self._checkouts,
+                "checkouts_por_s": round(ultimos_60s / 60.0, 2),
+                "espera_media_ms": round(1000 * self._espera_total / self._checkouts, 2) if self._checkouts else 0.0,
+                "espera_max_ms": round(1000 * self._espera_max, 2),
+                "timeouts": self._timeouts,
+                "descartadas": self._descartadas,
+            }
+
+    def fechar(self):
+        with self._cond:
+            ociosas, self._ociosas = self._ociosas, []
+        for conn in ociosas:
+            if not conn.closed: conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Cria o pool na primeira utilização (o banco pode não estar disponível no import)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PoolDeConexoes(**POOL_CONFIG)
+                _pool.ao_descartar(_preparadas.esquecer_conexao)
+    return _pool
+
+# --- ORIGEM DAS ESCRITAS ---
+# TÉCNICO: Quem escreve (ex.: uma sessão Flet) pode identificar-se com 'with origem(...)'.
+# As notificações das suas transações ficam associadas a essa origem, para notificacoes.py
+# não avisar a própria sessão que fez a alteração (ela já recarregou o que mostra).
+_origem = threading.local()
+_lock_origens = threading.Lock()
+_origem_por_pid = {}                   # pid de uma conexão emprestada -> origem de quem a usa
+_origem_por_transacao = OrderedDict()  # (pid, tx) -> origem, das últimas transações confirmadas
+MAX_ORIGENS_TRANSACOES = 1000
+
+@contextmanager
+def origem(valor):
+    """As escritas feitas dentro do bloco (nesta thread) ficam marcadas com 'valor'."""
+    anterior = getattr(_origem, "valor", None)
+    _origem.valor = valor
+    try:
+        yield
     finally:
-        if cur: cur.close()
-        if conn: conn.close()
+        _origem.valor = anterior
 
-def execute_transaction(queries_with_params):
-    """Executa várias operações em uma transação única (resolve o erro de atributo)."""
-    conn = get_db_connection()
+def origem_da_transacao(pid, tx):
+    """Origem da transação (pid, tx) feita por este processo; None se for de outro processo ou não tiver origem."""
+    with _lock_origens:
+        valor = _origem_por_transacao.get((pid, tx))
+        # A notificação pode chegar ao ouvinte antes de quem escreveu a ter registado: nesse
+        # intervalo a conexão ainda está emprestada a essa origem.
+        return valor if valor is not None else _origem_por_pid.get(pid)
+
+def _registar_origem(pid, tx, valor):
+    with _lock_origens:
+        _origem_por_transacao[(pid, tx)] = valor
+        _origem_por_transacao.move_to_end((pid, tx))
+        while len(_origem_por_transacao) > MAX_ORIGENS_TRANSACOES:
+            _origem_por_transacao.popitem(last=False)
+
+@contextmanager
+def conexao():
+    """Empresta uma conexão do pool e devolve-a sempre, mesmo em caso de erro."""
+    pool = get_pool()
+    conn = pool.obter()
+    valor_origem = getattr(_origem, "valor", None)
+    pid = conn.get_backend_pid() if valor_origem is not None else None
+    if pid is not None:
+        with _lock_origens: _origem_por_pid[pid] = valor_origem
     try:
-        cur = conn.cursor()
-        results = []
-        for query, params in queries_with_params:
-            cur.execute(query, params)
-            results.append(cur.fetchall() if cur.description else None)
-        conn.commit()
-        return results
-    except Exception as e:
-        if conn: conn.rollback()
-        raise e
+        yield conn
     finally:
-        cur.close(); conn.close()
+        _aplicar_notificacoes(conn, valor_origem)
+        if conn.escreveu:
+            conn.escreveu = False
+            limpar_cache()
+        if pid is not None:
+            with _lock_origens: _origem_por_pid.pop(pid, None)
+        pool.devolver(conn)
+
+def metricas_pool():
+    return get_pool().metricas() if _pool is not None else {}
+
+# Erro levantado pelo psycopg2 quando o servidor cancela a instrução em curso.
+ConsultaCancelada = psycopg2.extensions.QueryCanceledError
+
+class Cancelamento:
+    """
+    Permite cancelar, a partir de outra thread, a consulta associada a este objeto.
+    O cancelamento é feito no servidor (pg_cancel_backend via conn.cancel()).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self.cancelado = False
+
+    def cancelar(self):
+        with self._lock:
+            self.cancelado = True
+            if self._conn is not None:
+                try: self._conn.cancel()
+                except psycopg2.Error: pass
+
+    def _associar(self, conn):
+        with self._lock:
+            if self.cancelado:
+                raise ConsultaCancelada("Consulta cancelada antes de ser enviada.")
+            self._conn = conn
+
+    def _desassociar(self):
+        # TÉCNICO: Tem de acontecer antes da conexão voltar ao pool, senão um cancelamento
+        # tardio poderia interromper a consulta de outra sessão.
+        with self._lock:
+            self._conn = None
+
+# --- CACHE DE CONSULTAS ---
+# TÉCNICO: Leituras repetidas (listas de filtros, seções, ncs_com_saldos com os mesmos filtros)
+# podem ser servidas da memória. Quem pede cache=True declara as tabelas que a consulta lê
+# (tabelas=...; uma view do banco conta com as suas tabelas, DEPENDENCIAS_VIEWS).
+# A invalidação não depende do texto do SQL: os gatilhos de notificacoes.py fazem NOTIFY com
+# o nome de cada tabela alterada (também as apagadas em cascata pelas FKs) e todas as conexões
+# do pool fazem LISTEN no canal. No COMMIT a conexão que escreveu recebe as suas próprias
+# notificações e as tabelas são invalidadas antes de ela voltar ao pool (_aplicar_notificacoes).
+# Sem os gatilhos instalados a cache fica desligada (notificacoes.instalar_gatilhos liga-a).
+# As linhas devolvidas pela cache são partilhadas entre sessões: não as alterar.
+
+def _expandir_tabelas(nomes):
+    tabelas = set()
+    for nome in nomes:
+        nome = nome.lower().rsplit(".", 1)[-1]  # ignora o esquema (public.)
+        tabelas.add(nome)
+        tabelas |= DEPENDENCIAS_VIEWS.get(nome, set())
+    return frozenset(tabelas)
+
+def _tabelas_da_cache(tabelas):
+    if not tabelas:
+        raise ValueError("cache=True exige tabelas=... (as tabelas que a consulta lê).")
+    return _expandir_tabelas(tabelas)
+
+def _congelar(valor):
+    """Parâmetros em forma imutável, para servirem de chave."""
+    if isinstance(valor, dict):
+        return tuple(sorted((k, _congelar(v)) for k, v in valor.items()))
+    if isinstance(valor, (list, tuple)):
+        return tuple(_congelar(v) for v in valor)
+    return valor
+
+
+class CacheConsultas:
+    """LRU thread-safe {(sql, params): resultado} com validade (TTL) e índice tabela -> chaves."""
+
+    def __init__(self, max_entradas, ttl):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.ativa = False  # ver ativar_notificacoes
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # chave -> (resultado, expira_em, tabelas)
+        self._por_tabela = {}
+        # Aumenta a cada invalidação: um resultado lido antes de uma escrita não é guardado depois dela.
+        self.geracao = 0
+        self._acertos = self._falhas = self._invalidadas = self._expiradas = self._descartadas = 0
+
+    def obter_ou_executar(self, sql, params, executar, tabelas, ttl=None):
+        tabelas = _tabelas_da_cache(tabelas)
+        if not self.ativa: return executar()
+        chave = (sql, _congelar(params))
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                if entrada[1] > agora:
+                    self._entradas.move_to_end(chave)
+                    self._acertos += 1
+                    return entrada[0]
+                self._remover(chave)
+                self._expiradas += 1
+            self._falhas += 1
+            geracao = self.geracao
+
+        resultado = executar()
+
+        with self._lock:
+            if geracao != self.geracao:
+                self._descartadas += 1
+                return resultado
+            self._remover(chave)
+            self._entradas[chave] = (resultado, time.monotonic() + (ttl or self.ttl), tabelas)
+            for tabela in tabelas:
+                self._por_tabela.setdefault(tabela, set()).add(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._remover(next(iter(self._entradas)))
+        return resultado
+
+    def _remover(self, chave):
+        entrada = self._entradas.pop(chave, None)
+        if entrada is None: return
+        for tabela in entrada[2]:
+            chaves = self._por_tabela.get(tabela)
+            if chaves is not None:
+                chaves.discard(chave)
+                if not chaves: del self._por_tabela[tabela]
+
+    def invalidar(self, tabelas):
+        with self._lock:
+            self.geracao += 1
+            for tabela in tabelas:
+                for chave in list(self._por_tabela.get(tabela, ())):
+                    self._remover(chave)
+                    self._invalidadas += 1
+
+    def limpar(self):
+        with self._lock:
+            self.geracao += 1
+            self._entradas.clear()
+            self._por_tabela.clear()
+
+    def metricas(self):
+        with self._lock:
+            pedidos = self._acertos + self._falhas
+            return {
+                "entradas": len(self._entradas),
+                "acertos": self._acertos,
+                "falhas": self._falhas,
+                "taxa_acerto": round(self._acertos / pedidos, 3) if pedidos else 0.0,
+                "invalidadas": self._invalidadas,
+                "expiradas": self._expiradas,
+                "descartadas": self._descartadas,  # lidas durante uma escrita, não guardadas
+            }
+
+
+_cache_consultas = CacheConsultas(**CACHE_CONSULTAS_CONFIG)
+
+# Funções chamadas com as tabelas alteradas (ou None = tudo) depois de cada escrita/invalidação.
+_observadores_escrita = []
+
+def ao_escrever(callback):
+    """Regista callback(tabelas) para outras caches do processo (ex.: referencias.py)."""
+    _observadores_escrita.append(callback)
+
+# Versão dos dados de cada tabela neste processo (ver versao_dados).
+_lock_versoes = threading.Lock()
+_versoes_tabelas = {}
+_versao_limpezas = 0
+
+def _avisar_observadores(tabelas):
+    global _versao_limpezas
+    with _lock_versoes:
+        if tabelas is None:
+            _versao_limpezas += 1
+        else:
+            for tabela in tabelas: _versoes_tabelas[tabela] = _versoes_tabelas.get(tabela, 0) + 1
+    for callback in list(_observadores_escrita):
+        try: callback(tabelas)
+        except Exception as ex: print(f"database: observador de escritas falhou ({ex}).")
+
+def _aplicar_notificacoes(conn, valor_origem=None):
+    """
+    Invalida as tabelas anunciadas nos NOTIFY que esta conexão recebeu (as do seu próprio COMMIT
+    e as de outras sessões que tenham chegado entretanto) e regista a origem das suas próprias
+    transações. Chamar antes de a devolver ao pool.
+    """
+    if conn.closed or not conn.notifies: return
+    pid = conn.get_backend_pid()
+    tabelas = set()
+    for aviso in conn.notifies:
+        if aviso.channel != CANAL_ALTERACOES: continue
+        try:
+            dados = json.loads(aviso.payload)
+            tabelas.add(dados["tabela"])
+        except (ValueError, KeyError, TypeError):
+            continue
+        if valor_origem is not None and aviso.pid == pid:
+            _registar_origem(pid, dados.get("tx"), valor_origem)
+    del conn.notifies[:]
+    if tabelas:
+        tabelas = frozenset(tabelas)
+        _cache_consultas.invalidar(tabelas)
+        _avisar_observadores(tabelas)
+
+def ativar_notificacoes():
+    """
+    Os gatilhos de notificação estão instalados: a invalidação passa a vir só dos NOTIFY
+    (exatos, por tabela) e a cache de consultas é ligada. Até lá vale a invalidação local.
+    """
+    global _invalidacao_local
+    _invalidacao_local = False
+    _cache_consultas.ativa = True
+
+def invalidar_cache(*tabelas):
+    """Para escritas que não passam pelo pool deste processo (ex.: outro processo)."""
+    tabelas = _expandir_tabelas(tabelas)
+    _cache_consultas.invalidar(tabelas)
+    _avisar_observadores(tabelas)
+
+def limpar_cache():
+    _cache_consultas.limpar()
+    _avisar_observadores(None)
+
+def versao_dados(tabelas):
+    """
+    Carimbo dos dados destas tabelas: muda sempre que uma delas é escrita ou invalidada
+    (também pelas alterações de outros processos, via notificacoes.py). Só serve para comparar.
+    """
+    tabelas = _expandir_tabelas(tabelas)
+    with _lock_versoes:
+        return _versao_limpezas + sum(_versoes_tabelas.get(tabela, 0) for tabela in tabelas)
+
+def metricas_cache():
+    return _cache_consultas.metricas()
+
+def execute_query(query, params=None, cancelamento=None, cache=False, tabelas=None):
+    """
+    Executa uma instrução e devolve as linhas (dicionários) ou None.
+    Com cache=True (só para leituras) o resultado pode vir da cache de consultas; 'tabelas'
+    são as tabelas (ou views do banco) que a consulta lê.
+    """
+    if cache:
+        return _cache_consultas.obter_ou_executar(query, params, lambda: execute_query(query, params, cancelamento), tabelas)
+    with conexao() as conn:
+        try:
+            if cancelamento: cancelamento._associar(conn)
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                resultado = cur.fetchall() if cur.description else None
+            conn.commit()
+            return resultado
+        except Exception as e:
+            if not conn.closed: conn.rollback()
+            raise e
+        finally:
+            if cancelamento: cancelamento._desassociar()
+
+class Tabela:
+    """
+    Resultado compacto para leituras grandes: um só cabeçalho (colunas) partilhado por
+    todas as linhas, que são tuplas simples em vez de um dicionário por linha.
+    """
+    __slots__ = ("colunas", "linhas")
+
+    def __init__(self, colunas, linhas):
+        self.colunas = colunas
+        self.linhas = linhas
+
+    def __len__(self):
+        return len(self.linhas)
+
+    def __iter__(self):
+        return iter(self.linhas)
+
+    def indice(self):
+        """{nome_da_coluna: posição na tupla}."""
+        return {nome: i for i, nome in enumerate(self.colunas)}
+
+    def coluna(self, nome):
+        i = self.colunas.index(nome)
+        return [linha[i] for linha in self.linhas]
+
+    def como_colunas(self):
+        """{nome_da_coluna: [valores]} (formato colunar)."""
+        valores = zip(*self.linhas) if self.linhas else ([] for _ in self.colunas)
+        return {nome: list(v) for nome, v in zip(self.colunas, valores)}
+
+    def como_dataframe(self):
+        # TÉCNICO: pandas só é importado por quem precisa de um DataFrame.
+        import pandas as pd
+        return pd.DataFrame.from_records(self.linhas, columns=list(self.colunas))
+
+def _colunas(cur):
+    return tuple(c[0] for c in cur.description)
+
+def execute_query_tabela(query, params=None, cancelamento=None, cache=False, tabelas=None):
+    """Como execute_query, mas devolve uma Tabela (tuplas + cabeçalho) em vez de dicionários."""
+    if cache:
+        return _cache_consultas.obter_ou_executar(
+            query, (True, params), lambda: execute_query_tabela(query, params, cancelamento), tabelas)
+    with conexao() as conn:
+        try:
+            if cancelamento: cancelamento._associar(conn)
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute(query, params)
+                resultado = Tabela(_colunas(cur), cur.fetchall()) if cur.description else None
+            conn.commit()
+            return resultado
+        except Exception as e:
+            if not conn.closed: conn.rollback()
+            raise e
+        finally:
+            if cancelamento: cancelamento._desassociar()
+
+def execute_dataframe(query, params=None, cancelamento=None):
+    """Resultado da consulta diretamente num DataFrame do pandas (sem dicionários pelo meio)."""
+    return execute_query_tabela(query, params, cancelamento).como_dataframe()
+
+_seq_cursores = itertools.count(1)
+
+def execute_stream(query, params=None, tamanho_lote=None, cancelamento=None, tuplas=False):
+    """
+    Gerador para consultas grandes: devolve as linhas em listas de até 'tamanho_lote'.
+    TÉCNICO: Usa um cursor com nome (server-side), por isso o resultado fica no PostgreSQL e
+    só um lote de cada vez está na memória do Python, seja qual for o número de linhas.
+    A conexão fica emprestada enquanto o gerador estiver aberto; consumir até ao fim ou
+    chamar close() devolve-a ao pool.
+    Com tuplas=True cada lote é uma Tabela (todas partilham o mesmo tuplo de colunas).
+    """
+    tamanho_lote = tamanho_lote or STREAM_CONFIG["linhas_por_lote"]
+    with conexao() as conn:
+        try:
+            if cancelamento: cancelamento._associar(conn)
+            fabrica = psycopg2.extensions.cursor if tuplas else None
+            with conn.cursor(name=f"stream_{next(_seq_cursores)}", cursor_factory=fabrica) as cur:
+                cur.itersize = tamanho_lote
+                cur.execute(query, params)
+                colunas = None
+                while True:
+                    lote = cur.fetchmany(tamanho_lote)
+                    if not lote: break
+                    if tuplas:
+                        colunas = colunas or _colunas(cur)
+                        lote = Tabela(colunas, lote)
+                    yield lote
+            conn.commit()
+        except Exception as e:
+            if not conn.closed: conn.rollback()
+            raise e
+        finally:
+            if cancelamento: cancelamento._desassociar()
+
+def execute_transaction(queries_with_params):
+    """Executa várias operações em uma transação única (resolve o erro de atributo)."""
+    with conexao() as conn:
+        try:
+            results = []
+            with conn.cursor() as cur:
+                for query, params in queries_with_params:
+                    cur.execute(query, params)
+                    results.append(cur.fetchall() if cur.description else None)
+            conn.commit()
+            return results
+        except Exception as e:
+            if not conn.closed: conn.rollback()
+            raise e
+
+@contextmanager
+def transacao():
+    """
+    Cursor para várias instruções numa única transação: COMMIT no fim do bloco, ROLLBACK se
+    o bloco levantar exceção. Para quando o código tem de decidir entre instruções (ex.: com
+    base em linhas lidas com FOR UPDATE) ou verificar cur.rowcount de cada uma.
+    """
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                yield cur
+            conn.commit()
+        except Exception as e:
+            if not conn.closed: conn.rollback()
+            raise e
+
+def execute_batch(query, params_list, page_size=1000, template=None, returning=False):
+    """
+    Executa uma instrução 'INSERT ... VALUES %s' (ou UPDATE ... FROM (VALUES %s)) para muitas linhas.
+    TÉCNICO: Usa execute_values: as linhas são enviadas em VALUES multi-linha, em páginas de
+    'page_size' (uma ida ao banco por página), tudo numa única transação.
+    Com returning=True a instrução deve ter RETURNING; devolve as linhas de todas as páginas.
+    """
+    params_list = list(params_list)
+    if not params_list: return [] if returning else None
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                resultado = execute_values(cur, query, params_list, template=template, page_size=page_size, fetch=returning)
+            conn.commit()
+            return resultado if returning else None
+        except Exception as e:
+            if not conn.closed: conn.rollback()
+            raise e
+
+# --- CONSULTAS PREPARADAS ---
+# TÉCNICO: As consultas mais frequentes são preparadas (PREPARE) uma vez em cada conexão do
+# pool e depois só executadas pelo nome (EXECUTE): o PostgreSQL deixa de as analisar a cada
+# chamada e pode reaproveitar o plano. O SQL é escrito como para execute_query (%s ou %(nome)s).
+# Uma consulta com várias instruções é passada como lista (o texto nunca é partido em ';'):
+# cada uma é preparada à parte e todas são executadas na mesma ida ao banco.
+# Só para consultas de forma fixa (constantes do código): SQL montado a partir de filtros
+# usa execute_query. Listar as colunas em vez de '*': um plano preparado não pode mudar de
+# colunas ("cached plan must not change result type") se uma view do banco for alterada.
+
+_RE_PARAMETRO = re.compile(r"%\((\w+)\)s|%s|%%")
+_RE_NOME_CONSULTA = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+class ConsultaPreparada:
+    """Uma consulta registada: instruções já com $1..$n e a ordem dos parâmetros de cada uma."""
+
+    def __init__(self, nome, sql, tabelas=None):
+        self.nome = nome
+        self.sql = sql          # tuplo de instruções (ver _instrucoes_sql)
+        self.tabelas = tabelas  # lidas pela consulta (para cache=True)
+        self.instrucoes = []   # [(nome_da_instrucao, sql_com_$n, chaves_dos_parametros)]
+        posicional = itertools.count()
+        for i, parte in enumerate(sql):
+            chaves = []
+            def trocar(m):
+                if m.group(0) == "%%": return "%"
+                if m.group(1):  # %(nome)s: o mesmo nome usa sempre o mesmo $n
+                    if m.group(1) not in chaves: chaves.append(m.group(1))
+                    return f"${chaves.index(m.group(1)) + 1}"
+                chaves.append(next(posicional))  # %s: a posição seguinte do tuplo de parâmetros
+                return f"${len(chaves)}"
+            self.instrucoes.append((f"{nome}_{i}", _RE_PARAMETRO.sub(trocar, parte), chaves))
+        self.sql_execute = "; ".join(
+            f"EXECUTE {nome_instr}" + (f" ({', '.join(['%s'] * len(chaves))})" if chaves else "")
+            for nome_instr, _, chaves in self.instrucoes
+        )
+        # Métricas (tempo medido no cliente: inclui rede e espera no pool, ver metricas)
+        self.chamadas = 0
+        self.preparacoes = 0
+        self.tempo_preparacao = 0.0
+        self.tempo_execucao = 0.0
+
+    def valores(self, params):
+        return [params[chave] for _, _, chaves in self.instrucoes for chave in chaves]
+
+
+class RegistoConsultasPreparadas:
+    """
+    Registo {nome: ConsultaPreparada} e, por conexão, quais delas já foram preparadas (LRU de
+    até 'max_por_conexao'). As entradas de uma conexão são apagadas quando o pool a fecha
+    (PoolDeConexoes.ao_descartar), antes de o seu id() poder ser reaproveitado.
+    """
+
+    def __init__(self, max_por_conexao):
+        self.max_por_conexao = max_por_conexao
+        self._lock = threading.Lock()
+        self._consultas = {}
+        self._por_conexao = {}  # id(conn) -> OrderedDict {nome: None} (ordem de uso)
+
+    def esquecer_conexao(self, conn):
+        with self._lock:
+            self._por_conexao.pop(id(conn), None)
+
+    def _preparar_na_conexao(self, cur, consulta, preparadas):
+        """PREPARE das instruções da consulta, libertando antes a menos usada se a conexão estiver cheia."""
+        while len(preparadas) >= self.max_por_conexao:
+            antiga = self._consultas[next(iter(preparadas))]
+            for nome_instr, _, _ in antiga.instrucoes:
+                cur.execute(f"DEALLOCATE {nome_instr}")
+            del preparadas[antiga.nome]
+        for nome_instr, sql_pg, _ in consulta.instrucoes:
+            cur.execute(f"PREPARE {nome_instr} AS {sql_pg}")
+
+    def preparar(self, sql, nome=None, tabelas=None):
+        """Regista a consulta (não vai ao banco) e devolve o nome para execute_preparada."""
+        sql = _instrucoes_sql(sql)
+        nome = nome or "q_" + hashlib.md5("\0".join(sql).encode()).hexdigest()[:16]
+        if not _RE_NOME_CONSULTA.match(nome):
+            raise ValueError(f"Nome de consulta preparada inválido: {nome!r}")
+        with self._lock:
+            existente = self._consultas.get(nome)
+            if existente is None:
+                self._consultas[nome] = ConsultaPreparada(nome, sql, tabelas)
+            elif existente.sql != sql:
+                raise ValueError(f"A consulta preparada '{nome}' já está registada com outro SQL.")
+        return nome
+
+    def executar(self, nome, params=None, cancelamento=None, tabela=False, cache=False):
+        consulta = self._consultas[nome]
+        if cache:
+            return _cache_consultas.obter_ou_executar(
+                consulta.sql, (tabela, params), lambda: self.executar(nome, params, cancelamento, tabela), consulta.tabelas)
+        valores = consulta.valores(params or ())
+        with conexao() as conn:
+            for tentativa in (1, 2):
+                try:
+                    if cancelamento: cancelamento._associar(conn)
+                    with self._lock:
+                        preparadas = self._por_conexao.setdefault(id(conn), OrderedDict())
+                    with conn.cursor(cursor_factory=psycopg2.extensions.cursor if tabela else None) as cur:
+                        if nome in preparadas:
+                            preparadas.move_to_end(nome)
+                        else:
+                            inicio = time.perf_counter()
+                            self._preparar_na_conexao(cur, consulta, preparadas)
+                            conn.commit()  # a preparação fica na sessão, aconteça o que acontecer à execução
+                            preparadas[nome] = None
+                            with self._lock:
+                                consulta.preparacoes += 1
+                                consulta.tempo_preparacao += time.perf_counter() - inicio
+                        inicio = time.perf_counter()
+                        cur.execute(consulta.sql_execute, valores)
+                        resultado = cur.fetchall() if cur.description else None
+                        if tabela and resultado is not None: resultado = Tabela(_colunas(cur), resultado)
+                    conn.commit()
+                    with self._lock:
+                        consulta.chamadas += 1
+                        consulta.tempo_execucao += time.perf_counter() - inicio
+                    return resultado
+                except psycopg2.errors.InvalidSqlStatementName:
+                    # A sessão perdeu as preparações (ex.: DISCARD ALL): prepara de novo, uma vez.
+                    if not conn.closed: conn.rollback()
+                    preparadas.clear()
+                    if tentativa == 2: raise
+                except Exception as e:
+                    if not conn.closed: conn.rollback()
+                    raise e
+                finally:
+                    if cancelamento: cancelamento._desassociar()
+
+    def metricas(self):
+        """
+        {nome: chamadas, preparações e tempos médios (ms) de preparação e de execução}.
+        Os tempos são de relógio, medidos no cliente (incluem a rede); os do servidor estão em
+        metricas_servidor.
+        """
+        with self._lock:
+            return {
+                c.nome: {
+                    "chamadas": c.chamadas,
+                    "preparacoes": c.preparacoes,
+                    "preparacao_media_ms_cliente": round(1000 * c.tempo_preparacao / c.preparacoes, 3) if c.preparacoes else 0.0,
+                    "execucao_media_ms_cliente": round(1000 * c.tempo_execucao / c.chamadas, 3) if c.chamadas else 0.0,
+                }
+                for c in self._consultas.values()
+            }
+
+    def metricas_servidor(self):
+        """
+        {nome: chamadas e tempo médio de execução (ms) no servidor}, somados de todas as conexões,
+        lidos de pg_stat_statements (o PostgreSQL guarda cada preparada com o texto do PREPARE).
+        None se a extensão não estiver instalada.
+        """
+        with self._lock:
+            por_instrucao = {nome_instr: c.nome for c in self._consultas.values() for nome_instr, _, _ in c.instrucoes}
+        try:
+            linhas = execute_query(SQL_METRICAS_SERVIDOR, (list(por_instrucao),))
+        except (psycopg2.errors.UndefinedTable, psycopg2.errors.ObjectNotInPrerequisiteState):
+            return None
+        resultado = {}
+        for linha in linhas or []:
+            m = resultado.setdefault(por_instrucao[linha['instrucao']], {"chamadas": 0, "tempo_total_ms": 0.0})
+            m["chamadas"] = max(m["chamadas"], linha['chamadas'])  # as instruções de uma consulta correm juntas
+            m["tempo_total_ms"] += float(linha['tempo_total_ms'])
+        for m in resultado.values():
+            m["execucao_media_ms_servidor"] = round(m.pop("tempo_total_ms") / m["chamadas"], 3) if m["chamadas"] else 0.0
+        return resultado
+
+
+def _instrucoes_sql(sql):
+    """Uma instrução (str) ou uma lista delas -> tuplo de instruções, sem partir o texto."""
+    instrucoes = (sql,) if isinstance(sql, str) else tuple(sql)
+    if not instrucoes or not all(isinstance(i, str) and i.strip() for i in instrucoes):
+        raise ValueError("Uma consulta preparada precisa de uma ou mais instruções SQL não vazias.")
+    return instrucoes
+
+# Instruções preparadas com 'PREPARE <nome> AS ...' (o nome é a primeira palavra depois de PREPARE).
+SQL_METRICAS_SERVIDOR = r"""
+    SELECT lower(substring(query FROM '^\s*PREPARE\s+(\w+)')) AS instrucao,
+           SUM(calls) AS chamadas, SUM(total_exec_time) AS tempo_total_ms
+    FROM pg_stat_statements
+    WHERE lower(substring(query FROM '^\s*PREPARE\s+(\w+)')) = ANY(%s)
+    GROUP BY 1
+"""
+
+_preparadas = RegistoConsultasPreparadas(**PREPARADAS_CONFIG)
+
+def preparar(sql, nome=None, tabelas=None):
+    """
+    Regista uma consulta para execute_preparada e devolve o seu nome.
+    'sql' é uma instrução ou uma lista de instruções (executadas por ordem, na mesma ida ao banco).
+    Sem nome, o nome é derivado do SQL (o mesmo texto dá sempre o mesmo nome).
+    'tabelas' (as que a consulta lê) é obrigatório para a usar com cache=True.
+    """
+    return _preparadas.preparar(sql, nome, tabelas)
+
+def execute_preparada(nome, params=None, cancelamento=None, tabela=False, cache=False):
+    """
+    Como execute_query, mas executa pelo nome uma consulta registada com preparar().
+    Com tabela=True devolve uma Tabela (como execute_query_tabela); com cache=True usa a cache de consultas.
+    """
+    return _preparadas.executar(nome, params, cancelamento, tabela, cache)
+
+def metricas_preparadas():
+    """Tempos medidos no cliente, por consulta preparada (ver metricas_preparadas_servidor)."""
+    return _preparadas.metricas()
+
+def metricas_preparadas_servidor():
+    """Tempos de execução no servidor (pg_stat_statements); None se a extensão não existir."""
+    return _preparadas.metricas_servidor()
 
 def registrar_log(user_id, acao, tabela, registro_id, detalhes):
     sql = "INSERT INTO audit_logs (user_id, action, target_table, record_id, detalhes) VALUES (%s,%s,%s,%s,%s)"
     try: execute_query(sql, (user_id, acao, tabela, registro_id, detalhes))
-    except: pass
\ No newline at end of file
+    except: pass
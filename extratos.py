@@ -0,0 +1,214 @@
+# extratos.py
+# Extrato de uma NC (saldos por seção, NEs e recolhimentos) numa única ida ao banco,
+# com cache LRU por NC partilhada por todas as sessões do processo.
+# TÉCNICO: O Quick View fazia três consultas (uma delas com duas subconsultas por seção)
+# a cada clique. As entradas da cache são invalidadas sempre que uma NE, um recolhimento
+# ou uma distribuição da NC muda, por isso reabrir a mesma NC não vai ao banco.
+
+import os
+import threading
+from collections import OrderedDict, deque
+
+import database
+
+EXTRATOS_CONFIG = {
+    "max_ncs": int(os.environ.get("EXTRATOS_CACHE_MAX", 500)),
+}
+
+# Tabelas que o extrato lê (_SQL_EXTRATO). Uma alteração feita noutro processo (ou sem origem
+# conhecida) a uma delas limpa a cache toda: o NOTIFY não diz que NC mudou.
+TABELAS_EXTRATO = frozenset({"notas_de_credito", "distribuicao_nc_secoes", "notas_de_empenho",
+                             "recolhimentos_de_saldo", "secoes"})
+
+# Pré-carga em segundo plano dos extratos das NCs visíveis na tabela.
+PRE_CARGA_CONFIG = {
+    "ncs_por_consulta": 10,     # extratos lidos por ida ao banco
+    "max_pendentes": 100,       # nunca mais do que isto na fila
+    "uso_max_pool": 0.5,        # só pré-carrega com menos de metade das conexões do pool em uso
+}
+
+# Datas já formatadas pelo PostgreSQL (to_char) para o modal não ter de as tratar.
+# '{id_nc}' é o parâmetro da NC (uma NC) ou a coluna do unnest (várias NCs de uma vez).
+_SQL_EXTRATO = """
+    SELECT
+        (SELECT COALESCE(json_agg(f ORDER BY f.id), '[]'::json) FROM (
+            SELECT d.id, s.nome, d.valor_alocado,
+                   d.valor_alocado - COALESCE(emp.total, 0) - COALESCE(rec.total, 0) AS saldo_real
+            FROM distribuicao_nc_secoes d
+            JOIN secoes s ON s.id = d.id_secao
+            LEFT JOIN LATERAL (SELECT SUM(valor_empenhado) AS total FROM notas_de_empenho WHERE id_distribuicao = d.id) emp ON TRUE
+            LEFT JOIN LATERAL (SELECT SUM(valor_recolhido) AS total FROM recolhimentos_de_saldo WHERE id_distribuicao = d.id) rec ON TRUE
+            WHERE d.id_nc = {id_nc}
+        ) f) AS fatias,
+        (SELECT COALESCE(json_agg(n ORDER BY n.data_empenho DESC), '[]'::json) FROM (
+            SELECT ne.numero_ne, ne.valor_empenhado, ne.data_empenho, to_char(ne.data_empenho, 'DD/MM/YYYY') AS data_fmt
+            FROM notas_de_empenho ne
+            JOIN distribuicao_nc_secoes d ON ne.id_distribuicao = d.id
+            WHERE d.id_nc = {id_nc}
+        ) n) AS nes,
+        (SELECT COALESCE(json_agg(r ORDER BY r.data_recolhimento DESC), '[]'::json) FROM (
+            SELECT valor_recolhido, data_recolhimento, to_char(data_recolhimento, 'DD/MM/YYYY') AS data_fmt, descricao
+            FROM recolhimentos_de_saldo
+            WHERE id_nc = {id_nc}
+        ) r) AS recolhimentos
+"""
+
+
+SQL_EXTRATO_NC = _SQL_EXTRATO.format(id_nc="%(id_nc)s")
+SQL_EXTRATOS_NCS = (
+    "SELECT ids.id_nc, x.* FROM unnest(%(ids_nc)s::int[]) AS ids(id_nc) CROSS JOIN LATERAL ("
+    + _SQL_EXTRATO.format(id_nc="ids.id_nc") + ") x"
+)
+
+
+class CacheExtratos:
+    """LRU thread-safe {id_nc: extrato}, com índice id_distribuicao -> id_nc para a invalidação."""
+
+    def __init__(self, max_ncs):
+        self.max_ncs = max_ncs
+        self._lock = threading.Lock()
+        self._extratos = OrderedDict()
+        self._nc_por_distribuicao = {}
+        # Aumenta a cada invalidação: um extrato lido antes de uma escrita não é guardado depois dela.
+        self.geracao = 0
+
+    def contem(self, id_nc):
+        """Como obter, mas sem mexer na ordem LRU (usado pela pré-carga)."""
+        with self._lock:
+            return id_nc in self._extratos
+
+    def obter(self, id_nc):
+        with self._lock:
+            extrato = self._extratos.get(id_nc)
+            if extrato is not None:
+                self._extratos.move_to_end(id_nc)
+            return extrato
+
+    def guardar(self, id_nc, extrato, geracao):
+        with self._lock:
+            if geracao != self.geracao: return
+            self._extratos[id_nc] = extrato
+            self._extratos.move_to_end(id_nc)
+            for fatia in extrato["fatias"]:
+                self._nc_por_distribuicao[fatia["id"]] = id_nc
+            while len(self._extratos) > self.max_ncs:
+                antigo, _ = self._extratos.popitem(last=False)
+                self._remover_indice(antigo)
+
+    def _remover_indice(self, id_nc):
+        for id_dist in [d for d, n in self._nc_por_distribuicao.items() if n == id_nc]:
+            del self._nc_por_distribuicao[id_dist]
+
+    def invalidar(self, *ids_nc):
+        with self._lock:
+            self.geracao += 1
+            for id_nc in ids_nc:
+                if self._extratos.pop(id_nc, None) is not None:
+                    self._remover_indice(id_nc)
+
+    def invalidar_distribuicoes(self, *ids_distribuicao):
+        with self._lock:
+            ids_nc = {self._nc_por_distribuicao.get(d) for d in ids_distribuicao} - {None}
+        self.invalidar(*ids_nc)  # mesmo vazio: aumenta a geração
+
+    def limpar(self):
+        with self._lock:
+            self.geracao += 1
+            self._extratos.clear()
+            self._nc_por_distribuicao.clear()
+
+
+_cache = CacheExtratos(**EXTRATOS_CONFIG)
+
+def obter_extrato(id_nc):
+    """
+    Devolve {"fatias": [...], "nes": [...], "recolhimentos": [...]} da NC.
+    fatias: id, nome, valor_alocado, saldo_real | nes: numero_ne, valor_empenhado, data_fmt
+    recolhimentos: valor_recolhido, data_fmt, descricao
+    """
+    extrato = _cache.obter(id_nc)
+    if extrato is None:
+        geracao = _cache.geracao
+        res = database.execute_query(SQL_EXTRATO_NC, {"id_nc": id_nc})
+        extrato = dict(res[0])
+        _cache.guardar(id_nc, extrato, geracao)
+    return extrato
+
+def invalidar_nc(*ids_nc):
+    """Chamar depois de alterar a NC, as suas distribuições ou os seus recolhimentos."""
+    _cache.invalidar(*ids_nc)
+
+def invalidar_distribuicoes(*ids_distribuicao):
+    """Chamar depois de alterar NEs (que só conhecem a distribuição/cota)."""
+    _cache.invalidar_distribuicoes(*ids_distribuicao)
+
+def invalidar_tudo():
+    _cache.limpar()
+
+
+class PreCarga:
+    """
+    Thread única que aquece a cache com os extratos das NCs visíveis (ou sob o rato).
+    TÉCNICO: Só trabalha quando há pedidos (nada corre com a tabela parada) e só enquanto
+    o pool de conexões está folgado; com o banco ocupado, a fila é simplesmente descartada.
+    """
+
+    def __init__(self, ncs_por_consulta, max_pendentes, uso_max_pool):
+        self.ncs_por_consulta = ncs_por_consulta
+        self.max_pendentes = max_pendentes
+        self.uso_max_pool = uso_max_pool
+        self._cond = threading.Condition()
+        self._pendentes = deque()
+        self._thread = None
+
+    def pedir(self, ids_nc, prioridade=False):
+        """
+        Enfileira NCs para pré-carga. Uma nova página substitui a fila anterior;
+        com prioridade (rato por cima da NC) passa para a frente sem descartar o resto.
+        """
+        ids = [i for i in dict.fromkeys(ids_nc) if i is not None and not _cache.contem(i)]
+        if not ids: return
+        with self._cond:
+            if prioridade:
+                for id_nc in reversed(ids):
+                    self._pendentes.appendleft(id_nc)
+            else:
+                self._pendentes = deque(ids)
+            while len(self._pendentes) > self.max_pendentes:
+                self._pendentes.pop()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name="pre-carga-extratos", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _banco_folgado(self):
+        m = database.metricas_pool()
+        return bool(m) and m["aguardando"] == 0 and m["em_uso"] < self.uso_max_pool * m["max_conexoes"]
+
+    def _executar(self):
+        while True:
+            with self._cond:
+                while not self._pendentes:
+                    self._cond.wait()
+                lote = []
+                while self._pendentes and len(lote) < self.ncs_por_consulta:
+                    id_nc = self._pendentes.popleft()
+                    if not _cache.contem(id_nc): lote.append(id_nc)
+            if not lote: continue
+            if not self._banco_folgado():
+                with self._cond: self._pendentes.clear()
+                continue
+            try:
+                geracao = _cache.geracao
+                for linha in database.execute_query(SQL_EXTRATOS_NCS, {"ids_nc": lote}) or []:
+                    extrato = dict(linha)
+                    _cache.guardar(extrato.pop("id_nc"), extrato, geracao)
+            except Exception as ex:
+                print(f"extratos: falha na pré-carga ({ex}).")
+
+
+_pre_carga = PreCarga(**PRE_CARGA_CONFIG)
+
+def pre_carregar(ids_nc, prioridade=False):
+    """Pede a pré-carga (em segundo plano) dos extratos destas NCs."""
+    _pre_carga.pedir(ids_nc, prioridade=prioridade)
@@ -5,11 +5,29 @@ import flet as ft
 import os 
 import traceback 
 import hashlib
+import threading
+import time
 import database # Seu arquivo database.py local
+import retencao
+import notificacoes
+import referencias
+import cache_pdfs
+from siafi_parser import VERSAO_PARSER_SIAFI
 
 # Define a chave secreta para a sessão local
 os.environ["FLET_SECRET_KEY"] = os.environ.get("FLET_SECRET_KEY", "chave_secreta_local_padrao_12345!")
 
+# TÉCNICO: As views são construídas na primeira vez que se abre o separador. Uma view que não
+# é aberta há mais de 'minutos_ociosa' é descartada (e reconstruída se voltar a ser aberta);
+# 0 mantém todas até ao logout.
+# Ao voltar a um separador, a view aparece como ficou e só recarrega (em segundo plano) se os
+# dados das suas tabelas mudaram desde a última carga (database.versao_dados) ou se a carga
+# tem mais de 'minutos_validade' (0 = sem limite; cobre, por ex., prazos que mudam com a data).
+VIEWS_CONFIG = {
+    "minutos_ociosa": float(os.environ.get("VIEWS_MINUTOS_OCIOSA", 0)),
+    "minutos_validade": float(os.environ.get("VIEWS_MINUTOS_VALIDADE", 10)),
+}
+
 # Importação das Views
 from views.dashboard_view import create_dashboard_view
 from views.ncs_view import create_ncs_view
@@ -79,32 +97,6 @@ def create_sidebar_item(icon, label, selected=False, on_click=None):
     item.on_hover = handle_hover
     return item
 
-def _load_global_caches(page: ft.Page):
-    """Busca dados de filtro comuns no PostgreSQL local e armazena na sessão."""
-    print("A carregar caches globais do banco local...")
-    try:
-        # 1. Buscar PIs (Usando consulta SQL local)
-        pis_data = database.execute_query("SELECT DISTINCT pi FROM notas_de_credito ORDER BY pi")
-        page.session.set("cache_pis", [p['pi'] for p in pis_data] if pis_data else [])
-
-        # 2. Buscar NDs
-        nds_data = database.execute_query("SELECT DISTINCT natureza_despesa FROM notas_de_credito ORDER BY natureza_despesa")
-        page.session.set("cache_nds", [n['natureza_despesa'] for n in nds_data] if nds_data else [])
-
-        # 3. Buscar Seções
-        secoes_resp = database.execute_query("SELECT id, nome FROM secoes")
-        secoes_map = {s['id']: s['nome'] for s in secoes_resp} if secoes_resp else {}
-        page.session.set("cache_secoes_map", secoes_map)
-
-        # 4. Buscar Lista de NCs
-        ncs_resp = database.execute_query("SELECT id, numero_nc FROM notas_de_credito ORDER BY numero_nc")
-        page.session.set("cache_ncs_lista", ncs_resp or [])
-        
-        return True
-    except Exception as e:
-        print(f"ERRO AO CARREGAR CACHES LOCAIS: {e}")
-        return e 
-
 def main(page: ft.Page):
     page.title = "SISTEMA DE CONTROLE DE NOTAS DE CRÉDITO - SALC" 
     page.theme = ft.Theme(
@@ -117,12 +109,32 @@ def main(page: ft.Page):
         )
     )
     error_modal_global = ErrorModal(page)
+    # Limpeza de uploads/relatórios antigos (no máximo uma vez a cada 'intervalo_minutos').
+    retencao.varrer_em_segundo_plano()
+    # Ouvinte LISTEN/NOTIFY do processo (criado pela primeira sessão).
+    notificacoes.iniciar()
 
     # DEFINIÇÃO DOS CAMPOS (Fora de funções para evitar NameError)
     username_field = ft.TextField(label="Utilizador", prefix_icon="PERSON", autofocus=True)
     password_field = ft.TextField(label="Senha", prefix_icon="LOCK", password=True, can_reveal_password=True)
 
+    # Views construídas na sessão atual (ver show_main_layout)
+    views_sessao = []
+
+    def descartar_view(item):
+        """Retira a view e os controlos que ela juntou ao overlay (modais, pickers)."""
+        ids = {id(c) for c in item["overlay"]}
+        page.overlay[:] = [c for c in page.overlay if id(c) not in ids]
+        item["view"], item["overlay"], item["versao_dados"] = None, [], None
+
+    def descartar_views():
+        for item in views_sessao:
+            if item["view"] is not None:
+                descartar_view(item)
+        views_sessao.clear()
+
     def show_main_layout(e=None):
+        descartar_views()
         page.clean()
         page.bgcolor = "#F0F2F0" 
         
@@ -135,10 +147,6 @@ def main(page: ft.Page):
         sidebar_column = ft.Column(spacing=5, tight=True)
         view_content = ft.Column(expand=True, scroll=ft.ScrollMode.AUTO, spacing=20)
 
-        def on_data_changed_master(e=None):
-            print("Atualizando caches globais pós-alteração...")
-            _load_global_caches(page)
-
         # 3. BARRA SUPERIOR (AppBar)
         page.appbar = ft.AppBar(
             leading=ft.Container(
@@ -158,15 +166,23 @@ def main(page: ft.Page):
         )
 
         # 4. DEFINIÇÃO DAS VIEWS
+        # TÉCNICO: Só a fábrica de cada view; a view (DataTables, modais, pickers) é criada
+        # por construir_view na primeira vez que o separador é aberto.
         all_views = [
-            {"label": "Painel", "icon": ft.icons.DASHBOARD_ROUNDED, "view": create_dashboard_view(page, error_modal=error_modal_global)},
-            {"label": "NCs", "icon": ft.icons.PAYMENT_ROUNDED, "view": create_ncs_view(page, on_data_changed=on_data_changed_master, error_modal=error_modal_global)},
-            {"label": "NEs", "icon": ft.icons.RECEIPT_LONG_ROUNDED, "view": create_nes_view(page, on_data_changed=on_data_changed_master, error_modal=error_modal_global)},
-            {"label": "Relatórios", "icon": ft.icons.ANALYTICS_ROUNDED, "view": create_relatorios_view(page, error_modal=error_modal_global)},
+            {"label": "Painel", "icon": ft.icons.DASHBOARD_ROUNDED, "criar": create_dashboard_view},
+            {"label": "NCs", "icon": ft.icons.PAYMENT_ROUNDED, "criar": create_ncs_view},
+            {"label": "NEs", "icon": ft.icons.RECEIPT_LONG_ROUNDED, "criar": create_nes_view},
+            {"label": "Relatórios", "icon": ft.icons.ANALYTICS_ROUNDED, "criar": create_relatorios_view},
         ]
         
         if user.get("is_admin"):
-            all_views.append({"label": "Admin", "icon": ft.icons.ADMIN_PANEL_SETTINGS_ROUNDED, "view": create_admin_view(page, error_modal=error_modal_global)})
+            all_views.append({"label": "Admin", "icon": ft.icons.ADMIN_PANEL_SETTINGS_ROUNDED, "criar": create_admin_view})
+
+        for item in all_views:
+            item.update(view=None, overlay=[], ultimo_uso=0.0,
+                        versao_dados=None, carregada_em=0.0, a_recarregar=threading.Lock(), recarga_pendente=False)
+        views_sessao.extend(all_views)
+        indice_visivel = [None]
 
         # 5. LÓGICA DE NAVEGAÇÃO DA SIDEBAR
         def update_menu(index):
@@ -183,16 +199,80 @@ def main(page: ft.Page):
             if sidebar_column.page:
                 sidebar_column.update()
 
+        def construir_view(item):
+            # Os controlos que a view junta ao overlay ficam registados para saírem com ela.
+            ids_antes = {id(c) for c in page.overlay}
+            item["view"] = item["criar"](page, error_modal=error_modal_global)
+            item["overlay"] = [c for c in page.overlay if id(c) not in ids_antes]
+
+        def descartar_ociosas(agora):
+            limite = VIEWS_CONFIG["minutos_ociosa"] * 60
+            if limite <= 0: return
+            for i, item in enumerate(all_views):
+                if i == indice_visivel[0] or item["view"] is None or agora - item["ultimo_uso"] < limite:
+                    continue
+                # Não descarta uma view com um diálogo aberto ou trabalho a decorrer (ex.: importação em lote).
+                if any(getattr(c, "open", False) for c in item["overlay"]): continue
+                if not getattr(item["view"], "pode_descartar", lambda: True)(): continue
+                print(f"View '{item['label']}' descartada (sem uso há {(agora - item['ultimo_uso']) / 60:.0f} min).")
+                descartar_view(item)
+
+        def recarregar_view(item):
+            """
+            Corre o on_view_mount da view e carimba-a com a versão dos dados lidos.
+            Um pedido que chegue durante uma carga não se perde: fica pendente e quem está a
+            carregar volta a carregar no fim (uma só vez, por muitos pedidos que cheguem).
+            """
+            view = item["view"]
+            if not hasattr(view, "on_view_mount"): return
+            item["recarga_pendente"] = True
+            while item["recarga_pendente"]:
+                if not item["a_recarregar"].acquire(blocking=False): return  # quem está a recarregar trata dele
+                try:
+                    while item["recarga_pendente"]:
+                        item["recarga_pendente"] = False
+                        try:
+                            # Versão tirada ANTES da carga: uma escrita durante a carga deixa a view desatualizada.
+                            item["versao_dados"] = database.versao_dados(getattr(view, "tabelas_dependentes", ()))
+                            item["carregada_em"] = time.monotonic()
+                            view.on_view_mount(None)
+                        except Exception as ex:
+                            item["versao_dados"] = None
+                            print(f"ERRO AO CARREGAR A VIEW '{item['label']}': {ex}")
+                finally:
+                    item["a_recarregar"].release()
+                # Um pedido pode ter chegado entre a última verificação e o release(): volta ao início.
+
+        def desatualizada(item):
+            if item["versao_dados"] is None: return True
+            validade = VIEWS_CONFIG["minutos_validade"] * 60
+            if validade and time.monotonic() - item["carregada_em"] > validade: return True
+            return database.versao_dados(getattr(item["view"], "tabelas_dependentes", ())) != item["versao_dados"]
+
         def select_view(index):
-            view_selecionada = all_views[index]["view"]
-            view_content.controls = [view_selecionada]
+            agora = time.monotonic()
+            if indice_visivel[0] is not None:
+                all_views[indice_visivel[0]]["ultimo_uso"] = agora
+            item = all_views[index]
+            item["ultimo_uso"] = agora
+            indice_visivel[0] = index
+            descartar_ociosas(agora)
+
+            nova = item["view"] is None
+            if nova:
+                construir_view(item)
+            view_content.controls = [item["view"]]
             
             # TÉCNICO: Forçamos a atualização da página antes de montar os dados
             page.update() 
 
-            if hasattr(view_selecionada, "on_view_mount"):
-                # Garante que os componentes Flet já existem na tela antes de carregar o SQL
-                view_selecionada.on_view_mount(None)
+            # Garante que os componentes Flet já existem na tela antes de carregar o SQL.
+            # Uma view já carregada é mostrada logo com os dados que tinha; se estiverem
+            # desatualizados, recarrega em segundo plano.
+            if nova:
+                recarregar_view(item)
+            elif desatualizada(item):
+                threading.Thread(target=recarregar_view, args=(item,), daemon=True).start()
             
             update_menu(index)
         
@@ -231,6 +311,28 @@ def main(page: ft.Page):
         select_view(0)
         page.update()
 
+        # 7. ALTERAÇÕES FEITAS POR OUTROS UTILIZADORES (notificacoes.py)
+        # TÉCNICO: Chamado pela thread do ouvinte. Só a view que está à vista e depende das tabelas
+        # alteradas é recarregada (as outras ficam com a versão desatualizada e recarregam ao abrir);
+        # os dados de referência (referencias.py) já foram invalidados pelo próprio database.
+        def on_alteracao_banco(tabelas):
+            if page.session.get("user") is None: raise RuntimeError("sessão terminada")
+            if indice_visivel[0] is None: return
+            item = all_views[indice_visivel[0]]
+            if item["view"] is not None and tabelas & getattr(item["view"], "tabelas_dependentes", frozenset()):
+                threading.Thread(target=recarregar_view, args=(item,), daemon=True).start()
+
+        _cancelar_assinatura()
+        page.session.set("assinatura_alteracoes", notificacoes.assinar(notificacoes.TABELAS_NOTIFICADAS, on_alteracao_banco,
+                                                                     origem=page.session_id))
+        page.on_close = lambda e: _cancelar_assinatura()
+
+    def _cancelar_assinatura():
+        id_assinatura = page.session.get("assinatura_alteracoes")
+        if id_assinatura is not None:
+            notificacoes.cancelar(id_assinatura)
+            page.session.remove("assinatura_alteracoes")
+
     def handle_login(e):
         # Captura o valor e remove espaços
         utilizador_raw = username_field.value.strip().lower()
@@ -252,7 +354,10 @@ def main(page: ft.Page):
             if user:
                 page.session.set("user", user[0])
                 page.session.set("user_email", email) # Para exibir no AppBar
-                _load_global_caches(page)
+                # TÉCNICO: PIs, NDs, seções e NCs são partilhados pelo processo (referencias.py);
+                # só o primeiro login (ou o primeiro depois de uma alteração) vai ao banco.
+                try: referencias.aquecer()
+                except Exception as ex_ref: print(f"ERRO AO CARREGAR DADOS DE REFERÊNCIA: {ex_ref}")
                 show_main_layout()
             else:
                 error_modal_global.show("Utilizador ou senha incorretos.")
@@ -262,6 +367,8 @@ def main(page: ft.Page):
             error_modal_global.show(f"Erro no banco local: {ex}")
 
     def handle_logout():
+        _cancelar_assinatura()
+        descartar_views()
         page.session.clear()
         page.clean()
         page.add(build_login_view())
@@ -348,7 +455,7 @@ def main(page: ft.Page):
     #}
     
     #page.session.set("user", mock_user)
-    #_load_global_caches(page) # Carrega os PIs e NDs do banco local
+    #referencias.aquecer() # Carrega os PIs e NDs do banco local
     #show_main_layout()        # Pula direto para a tela principal
     
    
@@ -361,6 +468,18 @@ if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8550))
     
     print(f"A iniciar servidor web na porta: {port}")
+    retencao.varrer(forcar=True)
+    try:
+        # Entradas de versões antigas do parser nunca mais são lidas (a chave inclui a versão).
+        cache_pdfs.get_cache().remover_outras_versoes(VERSAO_PARSER_SIAFI)
+    except Exception as ex:
+        print(f"AVISO: não foi possível limpar a cache de PDFs ({ex}).")
+    try:
+        notificacoes.instalar_gatilhos()
+    except Exception as ex:
+        # Sem gatilhos, database invalida tudo o que é local a cada escrita deste processo (invalidação local).
+        print(f"AVISO: gatilhos de notificação não instalados ({ex}). Cache de consultas desligada; cada gravação "
+              f"deste processo invalida os dados de referência; alterações de outros processos só aparecem ao recarregar.")
     
     ft.app(
         upload_dir="uploads",
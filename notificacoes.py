@@ -0,0 +1,199 @@
+# notificacoes.py
+# Feed de alterações do banco (LISTEN/NOTIFY) partilhado por todas as sessões do processo.
+# TÉCNICO: Gatilhos nas tabelas de negócio fazem pg_notify a cada instrução que as altera.
+# Uma única thread por processo servidor escuta o canal (sem polling: fica bloqueada no
+# socket da conexão até chegar uma notificação), invalida as caches partilhadas e avisa
+# as sessões abertas que dependem das tabelas alteradas, incluindo as de outros processos
+# e as alterações feitas por outros utilizadores. A sessão que fez a alteração não é avisada
+# (as escritas dos handlers marcados com @da_sessao levam a origem, database.origem).
+
+import functools
+import json
+import os
+import select
+import threading
+import time
+
+import psycopg2
+
+import database
+import extratos
+
+NOTIFICACOES_CONFIG = {
+    "canal": database.CANAL_ALTERACOES,
+    "espera_reconexao_max": 30,  # segundos entre tentativas de reconexão (cresce até este valor)
+}
+
+# Todas as tabelas que a aplicação lê: os NOTIFY são também a fonte da invalidação da cache de
+# consultas (database._aplicar_notificacoes), incluindo as linhas apagadas em cascata.
+TABELAS_NOTIFICADAS = ("notas_de_credito", "distribuicao_nc_secoes", "notas_de_empenho", "recolhimentos_de_saldo", "secoes",
+                       "usuarios", "perfis_usuarios", "audit_logs")
+
+# Um NOTIFY por instrução (FOR EACH STATEMENT), não por linha: uma importação em lote é uma só
+# notificação. O PostgreSQL entrega as notificações só no COMMIT e junta as repetidas.
+SQL_INSTALAR_GATILHOS = """
+    CREATE OR REPLACE FUNCTION notificar_alteracao() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify(TG_ARGV[0], json_build_object('tabela', TG_TABLE_NAME, 'pid', pg_backend_pid(), 'tx', txid_current())::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+""" + "".join(f"""
+    CREATE OR REPLACE TRIGGER notificar_{tabela}
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {tabela}
+        FOR EACH STATEMENT EXECUTE FUNCTION notificar_alteracao('{NOTIFICACOES_CONFIG["canal"]}');
+""" for tabela in TABELAS_NOTIFICADAS)
+
+
+def instalar_gatilhos():
+    """
+    Cria (ou atualiza) a função e os gatilhos de notificação. Idempotente. Liga a cache de
+    consultas e troca a invalidação local (database._invalidacao_local) pela dos NOTIFY.
+    """
+    database.execute_query(SQL_INSTALAR_GATILHOS)
+    database.ativar_notificacoes()
+
+
+def da_sessao(metodo):
+    """
+    Decorador para os handlers das views que escrevem no banco: as escritas ficam marcadas com
+    a sessão Flet (page.session_id), que assim não é avisada das suas próprias alterações.
+    """
+    @functools.wraps(metodo)
+    def handler(self, *args, **kwargs):
+        with database.origem(getattr(self.page, "session_id", None)):
+            return metodo(self, *args, **kwargs)
+    return handler
+
+
+class Assinaturas:
+    """Callbacks das sessões abertas, cada um com as tabelas de que depende e a origem da sessão."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = {}  # id -> (tabelas, callback, origem)
+        self._seq = 0
+
+    def assinar(self, tabelas, callback, origem=None):
+        with self._lock:
+            self._seq += 1
+            self._callbacks[self._seq] = (frozenset(tabelas), callback, origem)
+            return self._seq
+
+    def cancelar(self, *ids):
+        with self._lock:
+            for id_assinatura in ids:
+                self._callbacks.pop(id_assinatura, None)
+
+    def avisar(self, alteracoes):
+        """alteracoes: {tabela: origens das transações que a alteraram (None = desconhecida)}."""
+        with self._lock:
+            alvos = []
+            for i, (dep, cb, origem) in self._callbacks.items():
+                # Só conta o que não foi feito exclusivamente pela própria sessão.
+                tabelas = frozenset(t for t, origens in alteracoes.items()
+                                    if t in dep and (origem is None or origens != {origem}))
+                if tabelas: alvos.append((i, cb, tabelas))
+        for id_assinatura, callback, tabelas in alvos:
+            try:
+                callback(tabelas)
+            except Exception as ex:
+                # Sessão fechada (página já não existe): a assinatura deixa de ser avisada.
+                print(f"notificacoes: assinatura {id_assinatura} removida ({ex}).")
+                self.cancelar(id_assinatura)
+
+
+class Ouvinte:
+    """
+    Thread única que faz LISTEN numa conexão própria (fora do pool, em autocommit).
+    Se a conexão cair, volta a ligar-se e invalida tudo: podem ter-se perdido notificações.
+    """
+
+    def __init__(self, canal, espera_reconexao_max):
+        self.canal = canal
+        self.espera_reconexao_max = espera_reconexao_max
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def iniciar(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name="ouvinte-alteracoes", daemon=True)
+                self._thread.start()
+
+    def _executar(self):
+        espera, ja_ligado = 1, False
+        while True:
+            try:
+                conn = psycopg2.connect(**database.DB_CONFIG)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.canal}"')
+                print(f"notificacoes: a escutar o canal '{self.canal}'.")
+                if ja_ligado:
+                    database.limpar_cache()
+                    extratos.invalidar_tudo()
+                    _assinaturas.avisar({tabela: {None} for tabela in TABELAS_NOTIFICADAS})
+                ja_ligado, espera = True, 1
+                self._escutar(conn)
+            except Exception as ex:
+                print(f"notificacoes: ligação perdida ({ex}); nova tentativa em {espera}s.")
+                time.sleep(espera)
+                espera = min(espera * 2, self.espera_reconexao_max)
+
+    def _escutar(self, conn):
+        try:
+            while True:
+                # Bloqueia até haver dados no socket; o tempo limite só serve para detetar conexões mortas.
+                if select.select([conn], [], [], 300) == ([], [], []):
+                    with conn.cursor() as cur: cur.execute("SELECT 1")
+                    continue
+                conn.poll()
+                alteracoes = {}
+                while conn.notifies:
+                    payload = conn.notifies.pop(0).payload
+                    try:
+                        aviso = json.loads(payload)
+                        tabela = aviso["tabela"]
+                        origem = database.origem_da_transacao(aviso.get("pid"), aviso.get("tx"))
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        # Um aviso mal formado é ignorado sozinho (não derruba a ligação nem limpa as caches).
+                        print(f"notificacoes: aviso ignorado, payload inválido: {payload!r}")
+                        continue
+                    alteracoes.setdefault(tabela, set()).add(origem)
+                if alteracoes:
+                    _aplicar_alteracoes(alteracoes)
+        finally:
+            conn.close()
+
+
+def _aplicar_alteracoes(alteracoes):
+    """
+    Invalida tudo o que as tabelas alteradas afetam, seja qual for o processo que as alterou:
+    a invalidação feita no momento da escrita pode não ter visto tudo (ex.: gatilhos, cascatas).
+    Os extratos são a exceção: as escritas com origem (@da_sessao) já invalidaram as NCs que
+    alteraram; só as de origem desconhecida (outro processo, sem origem) limpam a cache toda.
+    """
+    database.invalidar_cache(*alteracoes)
+    if any(None in origens for tabela, origens in alteracoes.items() if tabela in extratos.TABELAS_EXTRATO):
+        extratos.invalidar_tudo()  # o NOTIFY não diz que NC mudou
+    _assinaturas.avisar(alteracoes)
+
+
+_assinaturas = Assinaturas()
+_ouvinte = Ouvinte(**NOTIFICACOES_CONFIG)
+
+def iniciar():
+    """Arranca o ouvinte do processo (só o primeiro pedido cria a thread)."""
+    _ouvinte.iniciar()
+
+def assinar(tabelas, callback, origem=None):
+    """
+    Chama callback(tabelas_alteradas) a partir da thread do ouvinte sempre que uma das 'tabelas'
+    mudar, exceto pelas escritas feitas com esta 'origem' (database.origem / @da_sessao).
+    Devolve o id para cancelar(). Um callback que levante exceção é removido.
+    """
+    return _assinaturas.assinar(tabelas, callback, origem)
+
+def cancelar(*ids):
+    _assinaturas.cancelar(*ids)
@@ -0,0 +1,229 @@
+# pdf_pool.py
+# Pool de processos para o trabalho pesado de CPU (leitura de PDFs do SIAFI com pdfplumber).
+# TÉCNICO: Correr o pdfplumber dentro do evento Flet bloqueava a sessão e roubava tempo de GIL
+# a todas as outras sessões do mesmo servidor. Aqui cada PDF é lido num processo separado.
+# Os processos são criados com 'spawn' (configurável): o servidor Flet tem várias threads e um
+# fork copiaria locks que podem estar presos noutras threads no momento do fork.
+
+import os
+import threading
+import itertools
+import multiprocessing
+from collections import deque
+
+POOL_PDF_CONFIG = {
+    "max_processos": int(os.environ.get("PDF_POOL_PROCESSOS", min(4, os.cpu_count() or 1))),
+    "max_pendentes": int(os.environ.get("PDF_POOL_PENDENTES", 32)),   # trabalhos na fila + em curso
+    "timeout": float(os.environ.get("PDF_POOL_TIMEOUT", 60)),         # segundos por PDF, contados desde que um processo o pega
+    "metodo_inicio": os.environ.get("PDF_POOL_INICIO", "spawn"),      # 'spawn' ou 'forkserver'
+}
+
+# Estados possíveis de um trabalho
+NA_FILA = "na_fila"
+A_PROCESSAR = "a_processar"
+CONCLUIDO = "concluido"
+ERRO = "erro"
+EXPIRADO = "expirado"
+
+
+class TrabalhoPdf:
+    """Handle de um PDF submetido ao pool: estado, progresso, resultado e aviso de conclusão."""
+
+    def __init__(self, id_trabalho, nome, funcao, args, timeout):
+        self.id = id_trabalho
+        self.nome = nome
+        self.timeout = timeout
+        self.funcao = funcao
+        self.args = args
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._terminado = threading.Event()
+        self.estado = NA_FILA
+        self.dados = None
+        self.erro = None
+
+    @property
+    def progresso(self):
+        """0.0 na fila, 0.5 em processamento, 1.0 terminado (com ou sem sucesso)."""
+        if self._terminado.is_set(): return 1.0
+        return 0.5 if self.estado == A_PROCESSAR else 0.0
+
+    def resultado(self, timeout=None):
+        """Bloqueia até o trabalho terminar e devolve os dados (ou levanta o erro)."""
+        self._terminado.wait(timeout)
+        if self.erro: raise self.erro
+        return self.dados
+
+    def ao_terminar(self, callback):
+        """Regista callback(trabalho), chamado numa thread de apoio quando o trabalho termina."""
+        with self._lock:
+            if not self._terminado.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _concluir(self, estado, dados=None, erro=None):
+        with self._lock:
+            if self._terminado.is_set(): return
+            self.estado, self.dados, self.erro = estado, dados, erro
+            self._terminado.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as ex:
+                print(f"pdf_pool: erro no callback do trabalho {self.id}: {ex}")
+
+
+def _ciclo_trabalhador(conn):
+    """Corre num processo do pool: recebe (funcao, args) pela pipe e devolve (ok, resultado)."""
+    while True:
+        try:
+            pedido = conn.recv()
+        except EOFError:
+            return
+        if pedido is None: return
+        funcao, args = pedido
+        try:
+            resposta = (True, funcao(*args))
+        except Exception as ex:
+            resposta = (False, ex)
+        try:
+            conn.send(resposta)
+        except Exception as ex:  # resultado ou exceção que não se consegue serializar
+            conn.send((False, RuntimeError(f"{type(ex).__name__}: {ex}")))
+
+
+class Trabalhador:
+    """
+    Um processo do pool e a thread que o alimenta, um trabalho de cada vez.
+    TÉCNICO: Cada trabalho tem o seu processo durante a execução, por isso o timeout conta a
+    partir do envio para o processo (não da submissão: a espera na fila não conta) e, se for
+    excedido, só esse processo é morto; os outros trabalhos em curso não são afetados.
+    """
+
+    def __init__(self, pool, numero):
+        self.pool = pool
+        self.numero = numero
+        self._processo = None
+        self._conn = None
+        self._thread = threading.Thread(target=self._executar, name=f"pdf-trabalhador-{numero}", daemon=True)
+        self._thread.start()
+
+    def _arrancar(self):
+        conn_pai, conn_filho = self.pool.contexto.Pipe()
+        self._processo = self.pool.contexto.Process(target=_ciclo_trabalhador, args=(conn_filho,), daemon=True,
+                                                    name=f"pdf-processo-{self.numero}")
+        self._processo.start()
+        conn_filho.close()
+        self._conn = conn_pai
+
+    def _terminar(self):
+        if self._processo is not None:
+            self._processo.terminate()
+            self._processo.join(5)
+        if self._conn is not None:
+            self._conn.close()
+        self._processo = self._conn = None
+
+    def _executar(self):
+        while True:
+            trabalho = self.pool._proximo()
+            if trabalho is None:  # pool fechado
+                self._terminar()
+                return
+            try:
+                if self._processo is None or not self._processo.is_alive():
+                    self._terminar()
+                    self._arrancar()
+                trabalho.estado = A_PROCESSAR
+                self._conn.send((trabalho.funcao, trabalho.args))
+                if self._conn.poll(trabalho.timeout):
+                    ok, valor = self._conn.recv()
+                    if ok: trabalho._concluir(CONCLUIDO, dados=valor)
+                    else: trabalho._concluir(ERRO, erro=valor)
+                else:
+                    print(f"pdf_pool: '{trabalho.nome}' excedeu {trabalho.timeout:.0f}s; o processo {self.numero} vai ser reiniciado.")
+                    self._terminar()
+                    trabalho._concluir(EXPIRADO, erro=TimeoutError(f"A leitura de '{trabalho.nome}' excedeu {trabalho.timeout:.0f}s."))
+            except (EOFError, OSError) as ex:
+                # O processo morreu a meio (ex.: falta de memória com este PDF): só este trabalho falha.
+                self._terminar()
+                trabalho._concluir(ERRO, erro=RuntimeError(f"O processo de leitura de '{trabalho.nome}' terminou inesperadamente ({ex})."))
+            except Exception as ex:
+                self._terminar()
+                trabalho._concluir(ERRO, erro=ex)
+
+
+class PoolPdf:
+    def __init__(self, max_processos, max_pendentes, timeout, metodo_inicio="spawn"):
+        self.max_processos = max_processos
+        self.timeout = timeout
+        self.contexto = multiprocessing.get_context(metodo_inicio)
+        self._vagas = threading.BoundedSemaphore(max_pendentes)
+        self._cond = threading.Condition()
+        self._fila = deque()
+        self._trabalhadores = []
+        self._fechado = False
+        self._ids = itertools.count(1)
+
+    def _proximo(self):
+        """Chamado pelos trabalhadores: bloqueia até haver um trabalho (None se o pool fechar)."""
+        with self._cond:
+            while not self._fila and not self._fechado:
+                self._cond.wait()
+            return self._fila.popleft() if self._fila else None
+
+    def submeter(self, funcao, *args, nome="", timeout=None, aguardar_vaga=False):
+        """
+        Envia funcao(*args) para um processo do pool e devolve logo um TrabalhoPdf.
+        'funcao' tem de ser uma função de nível de módulo (serializável com pickle).
+        Com aguardar_vaga=True (importação em lote, fora da thread da UI) espera por uma vaga
+        em vez de recusar o trabalho quando a fila está cheia.
+        """
+        vaga = self._vagas.acquire(timeout=self.timeout) if aguardar_vaga else self._vagas.acquire(blocking=False)
+        if not vaga:
+            raise RuntimeError("Muitos PDFs em processamento. Aguarde alguns segundos e tente novamente.")
+
+        trabalho = TrabalhoPdf(next(self._ids), nome, funcao, args, timeout or self.timeout)
+        trabalho.ao_terminar(lambda t: self._vagas.release())
+        with self._cond:
+            if self._fechado:
+                trabalho._concluir(ERRO, erro=RuntimeError("O pool de PDFs foi fechado."))
+                return trabalho
+            self._fila.append(trabalho)
+            # Os processos só são criados quando há trabalho para eles.
+            if len(self._trabalhadores) < self.max_processos:
+                self._trabalhadores.append(Trabalhador(self, len(self._trabalhadores) + 1))
+            self._cond.notify()
+        return trabalho
+
+    def fechar(self):
+        with self._cond:
+            self._fechado = True
+            pendentes, self._fila = list(self._fila), deque()
+            self._cond.notify_all()
+        for trabalho in pendentes:
+            trabalho._concluir(ERRO, erro=RuntimeError("O pool de PDFs foi fechado."))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """O pool de processos só é criado no primeiro PDF recebido."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PoolPdf(**POOL_PDF_CONFIG)
+    return _pool
+
+def submeter(funcao, *args, nome="", timeout=None, aguardar_vaga=False):
+    return get_pool().submeter(funcao, *args, nome=nome, timeout=timeout, aguardar_vaga=aguardar_vaga)
+
+def trabalho_concluido(dados, nome=""):
+    """TrabalhoPdf já terminado (ex.: dados vindos da cache), com a mesma interface dos submetidos."""
+    trabalho = TrabalhoPdf(0, nome, None, (), 0)
+    trabalho._concluir(CONCLUIDO, dados=dados)
+    return trabalho
@@ -0,0 +1,90 @@
+# referencias.py
+# Dados de referência (PIs, NDs, mapa de seções, lista de NCs) partilhados por todo o processo.
+# TÉCNICO: Antes, cada login corria quatro consultas e guardava uma cópia em page.session, e
+# cada gravação repetia as quatro. Aqui há uma só cópia por processo, lida por referência
+# pelas sessões (não alterar os valores devolvidos). Cada coleção tem uma versão que aumenta
+# quando uma das suas tabelas de origem é escrita (database.ao_escrever, que também recebe as
+# alterações de outros processos via notificacoes.py); só essa coleção é relida, na leitura seguinte.
+
+import threading
+from types import MappingProxyType
+
+import database
+
+# nome: (SQL, tabelas de origem, conversão da database.Tabela para o valor guardado)
+COLECOES = {
+    "pis": ("SELECT DISTINCT pi FROM notas_de_credito ORDER BY pi",
+            {"notas_de_credito"}, lambda t: tuple(pi for (pi,) in t)),
+    "nds": ("SELECT DISTINCT natureza_despesa FROM notas_de_credito ORDER BY natureza_despesa",
+            {"notas_de_credito"}, lambda t: tuple(nd for (nd,) in t)),
+    "secoes": ("SELECT id, nome FROM secoes ORDER BY nome",
+               {"secoes"}, lambda t: MappingProxyType(dict(t.linhas))),
+    "ncs": ("SELECT id, numero_nc FROM notas_de_credito ORDER BY numero_nc",
+            {"notas_de_credito"}, lambda t: tuple(t.linhas)),
+}
+
+
+class Colecao:
+    """Valor imutável de uma coleção + versão. Recarrega (uma thread só) quando fica desatualizado."""
+
+    def __init__(self, nome, sql, tabelas, converter):
+        self.nome = nome
+        self.sql = sql
+        self.tabelas = frozenset(tabelas)
+        self.converter = converter
+        self._lock_carga = threading.Lock()
+        self._lock_versao = threading.Lock()
+        self._valor = None
+        self.versao = 1
+        self._versao_carregada = 0
+
+    def obter(self):
+        if self._versao_carregada == self.versao:
+            return self._valor
+        with self._lock_carga:
+            # Repete se houve uma escrita durante a leitura (a versão mudou entretanto).
+            while self._versao_carregada != self.versao:
+                versao = self.versao
+                self._valor = self.converter(database.execute_query_tabela(self.sql))
+                self._versao_carregada = versao
+            return self._valor
+
+    def invalidar(self):
+        with self._lock_versao:
+            self.versao += 1
+
+
+_colecoes = {nome: Colecao(nome, *config) for nome, config in COLECOES.items()}
+
+def _ao_escrever(tabelas):
+    for colecao in _colecoes.values():
+        if tabelas is None or colecao.tabelas & tabelas:
+            colecao.invalidar()
+
+database.ao_escrever(_ao_escrever)
+
+
+def pis():
+    """Tuplo com os PIs distintos das NCs (pode incluir None)."""
+    return _colecoes["pis"].obter()
+
+def nds():
+    """Tuplo com as NDs distintas das NCs (pode incluir None)."""
+    return _colecoes["nds"].obter()
+
+def secoes():
+    """{id_secao: nome}, só de leitura, por ordem de nome."""
+    return _colecoes["secoes"].obter()
+
+def ncs():
+    """Tuplo de (id, numero_nc) por ordem de número."""
+    return _colecoes["ncs"].obter()
+
+def versao(nome):
+    """Versão atual da coleção (muda a cada escrita nas suas tabelas, antes mesmo de ser relida)."""
+    return _colecoes[nome].versao
+
+def aquecer():
+    """Carrega as coleções que estiverem desatualizadas (ex.: no login)."""
+    for colecao in _colecoes.values():
+        colecao.obter()
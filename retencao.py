@@ -0,0 +1,70 @@
+# retencao.py
+# Limpeza dos ficheiros temporários que o servidor escreve em disco.
+# TÉCNICO: O Flet grava cada upload em 'uploads/' e os relatórios gerados ficam em 'assets/'
+# para download. Nada disso era apagado; aqui os uploads são lidos para memória e apagados
+# logo, e uma varredura periódica remove o que ficar para trás além do prazo de retenção.
+
+import os
+import re
+import time
+import threading
+
+RETENCAO_CONFIG = {
+    "pasta_uploads": "uploads",
+    "pasta_relatorios": "assets",
+    "horas_uploads": float(os.environ.get("RETENCAO_UPLOADS_HORAS", 1)),       # uploads que não foram lidos (ex.: sessão caiu)
+    "horas_relatorios": float(os.environ.get("RETENCAO_RELATORIOS_HORAS", 24)), # tempo para o utilizador baixar o relatório
+    "intervalo_minutos": float(os.environ.get("RETENCAO_INTERVALO_MIN", 10)),   # mínimo entre duas varreduras
+}
+
+# Só os ficheiros gerados pelos relatórios ('<nome>_<uuid4>.xlsx|pdf'); o resto de 'assets/' (logo...) nunca é tocado.
+RE_RELATORIO_GERADO = re.compile(r'^.+_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.(xlsx|pdf)$')
+
+_lock = threading.Lock()
+_ultima_varredura = 0.0
+
+
+def ler_e_apagar(caminho):
+    """Lê o ficheiro enviado para memória e apaga-o do disco (mesmo que a leitura falhe)."""
+    try:
+        with open(caminho, "rb") as f:
+            return f.read()
+    finally:
+        try: os.remove(caminho)
+        except OSError: pass
+
+def _apagar_antigos(pasta, idade_max_s, filtro=None):
+    if not os.path.isdir(pasta): return 0
+    limite = time.time() - idade_max_s
+    apagados = 0
+    for entrada in os.scandir(pasta):
+        if not entrada.is_file() or (filtro and not filtro.match(entrada.name)):
+            continue
+        try:
+            if entrada.stat().st_mtime < limite:
+                os.remove(entrada.path)
+                apagados += 1
+        except OSError:
+            pass  # ficheiro em uso ou já removido por outra sessão
+    return apagados
+
+def varrer(forcar=False):
+    """
+    Remove uploads e relatórios gerados mais antigos do que o prazo de retenção.
+    Sem 'forcar', não faz nada se a última varredura foi há menos de 'intervalo_minutos'.
+    """
+    global _ultima_varredura
+    cfg = RETENCAO_CONFIG
+    with _lock:
+        agora = time.monotonic()
+        if not forcar and _ultima_varredura and agora - _ultima_varredura < cfg["intervalo_minutos"] * 60:
+            return 0
+        _ultima_varredura = agora
+
+    apagados = _apagar_antigos(cfg["pasta_uploads"], cfg["horas_uploads"] * 3600)
+    apagados += _apagar_antigos(cfg["pasta_relatorios"], cfg["horas_relatorios"] * 3600, RE_RELATORIO_GERADO)
+    if apagados: print(f"retencao: {apagados} ficheiro(s) temporário(s) removido(s).")
+    return apagados
+
+def varrer_em_segundo_plano(forcar=False):
+    threading.Thread(target=varrer, kwargs={"forcar": forcar}, name="retencao", daemon=True).start()
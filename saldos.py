@@ -0,0 +1,152 @@
+# saldos.py
+# Operações que consomem o saldo de uma cota (distribuicao_nc_secoes) de forma atómica.
+# TÉCNICO: Antes, o saldo era lido numa ida ao banco e o movimento gravado noutra; dois
+# utilizadores podiam ambos ver o mesmo saldo e ambos gravar (saque duplo). Aqui a linha
+# da cota é bloqueada (SELECT ... FOR UPDATE) e a validação + gravação acontecem na mesma
+# transação e na mesma ida ao banco. Todas as operações sobre uma cota bloqueiam a mesma
+# linha, por isso ficam em fila umas atrás das outras (recolhimentos e empenhos).
+#
+# O bloqueio tem de ser uma instrução separada da que calcula o saldo: em READ COMMITTED
+# cada instrução usa um snapshot tirado no seu início, e só a instrução seguinte ao
+# bloqueio vê os movimentos que a transação concorrente acabou de gravar.
+#
+# As três operações são consultas preparadas (database.preparar, uma lista de instruções):
+# correm a cada gravação.
+# Os parâmetros que só aparecem em listas SELECT levam o tipo explícito (::date, ::text...)
+# para o PREPARE conseguir deduzi-lo.
+
+import database
+
+
+class SaldoInsuficienteError(Exception):
+    """O movimento pedido é maior do que o saldo disponível na cota."""
+
+    def __init__(self, saldo_disponivel, valor_pedido):
+        self.saldo_disponivel = saldo_disponivel
+        self.valor_pedido = valor_pedido
+        super().__init__(f"Saldo insuficiente: disponível {saldo_disponivel:.2f}, pedido {valor_pedido:.2f}.")
+
+
+class CotaNaoEncontradaError(Exception):
+    """A cota indicada não existe (ou não pertence à NC indicada)."""
+
+
+class NeNaoEncontradaError(Exception):
+    """A NE a alterar já não existe (foi excluída entretanto)."""
+
+
+# Saldo real da cota já bloqueada 'c': Alocado - Empenhado - Recolhido
+_SQL_SALDO_COTA = """
+    SELECT c.id, c.id_nc,
+           c.valor_alocado
+           - COALESCE((SELECT SUM(valor_empenhado) FROM notas_de_empenho WHERE id_distribuicao = c.id), 0)
+           - COALESCE((SELECT SUM(valor_recolhido) FROM recolhimentos_de_saldo WHERE id_distribuicao = c.id), 0) AS saldo
+    FROM distribuicao_nc_secoes c
+    WHERE c.id = %(id_distribuicao)s
+"""
+
+SQL_RECOLHER_SALDO = [
+    "SELECT 1 FROM distribuicao_nc_secoes WHERE id = %(id_distribuicao)s FOR UPDATE",
+    """
+    WITH saldo AS (""" + _SQL_SALDO_COTA + """ AND c.id_nc = %(id_nc)s
+    ), novo AS (
+        INSERT INTO recolhimentos_de_saldo (id_nc, id_distribuicao, data_recolhimento, valor_recolhido, descricao)
+        SELECT s.id_nc, s.id, %(data)s::date, %(valor)s::numeric, %(descricao)s::text
+        FROM saldo s
+        WHERE s.saldo >= %(valor)s::numeric
+        RETURNING id
+    )
+    SELECT s.saldo AS saldo_anterior, (SELECT id FROM novo) AS id_recolhimento
+    FROM saldo s
+    """,
+]
+CONSULTA_RECOLHER_SALDO = database.preparar(SQL_RECOLHER_SALDO, "recolher_saldo")
+
+
+def recolher_saldo(id_nc, id_distribuicao, valor, data_recolhimento, descricao=None):
+    """
+    Grava um recolhimento só se a cota tiver saldo para ele, de forma atómica.
+    Devolve (id_recolhimento, novo_saldo). Levanta SaldoInsuficienteError ou CotaNaoEncontradaError.
+    """
+    res = database.execute_preparada(CONSULTA_RECOLHER_SALDO, {
+        "id_nc": id_nc, "id_distribuicao": id_distribuicao, "valor": round(valor, 2),
+        "data": data_recolhimento, "descricao": descricao,
+    })
+    if not res:
+        raise CotaNaoEncontradaError(f"A cota {id_distribuicao} não pertence à NC {id_nc}.")
+    saldo_anterior = float(res[0]['saldo_anterior'])
+    if res[0]['id_recolhimento'] is None:
+        raise SaldoInsuficienteError(saldo_anterior, valor)
+    return res[0]['id_recolhimento'], round(saldo_anterior - valor, 2)
+
+
+SQL_EMPENHAR = [
+    "SELECT 1 FROM distribuicao_nc_secoes WHERE id = %(id_distribuicao)s FOR UPDATE",
+    """
+    WITH saldo AS (""" + _SQL_SALDO_COTA + """
+    ), nova AS (
+        INSERT INTO notas_de_empenho (numero_ne, valor_empenhado, id_distribuicao, data_empenho, descricao)
+        SELECT %(numero_ne)s::text, %(valor)s::numeric, s.id, %(data)s::date, %(descricao)s::text
+        FROM saldo s
+        WHERE s.saldo >= %(valor)s::numeric
+        RETURNING id
+    )
+    SELECT s.saldo AS saldo_anterior, (SELECT id FROM nova) AS id_ne
+    FROM saldo s
+    """,
+]
+CONSULTA_EMPENHAR = database.preparar(SQL_EMPENHAR, "empenhar")
+
+# Na edição a NE pode mudar de cota: bloqueia a cota nova e a antiga (sempre pela ordem do id,
+# para duas edições cruzadas não ficarem em deadlock). O valor atual da própria NE volta ao
+# saldo antes de validar o novo valor, se ela já estiver nesta cota. A própria NE também é
+# bloqueada, para 'ne_existe' e o UPDATE concordarem mesmo com uma exclusão simultânea.
+SQL_ATUALIZAR_EMPENHO = [
+    """
+    SELECT 1 FROM distribuicao_nc_secoes
+    WHERE id = %(id_distribuicao)s
+       OR id = (SELECT id_distribuicao FROM notas_de_empenho WHERE id = %(id_ne)s)
+    ORDER BY id
+    FOR UPDATE
+    """,
+    "SELECT 1 FROM notas_de_empenho WHERE id = %(id_ne)s FOR UPDATE",
+    """
+    WITH saldo AS (
+        SELECT b.id, b.saldo + COALESCE((
+            SELECT valor_empenhado FROM notas_de_empenho WHERE id = %(id_ne)s AND id_distribuicao = b.id
+        ), 0) AS saldo
+        FROM (""" + _SQL_SALDO_COTA + """) b
+    ), alterada AS (
+        UPDATE notas_de_empenho ne
+        SET numero_ne = %(numero_ne)s, valor_empenhado = %(valor)s, id_distribuicao = s.id,
+            data_empenho = %(data)s, descricao = %(descricao)s
+        FROM saldo s
+        WHERE ne.id = %(id_ne)s AND s.saldo >= %(valor)s::numeric
+        RETURNING ne.id
+    )
+    SELECT s.saldo AS saldo_anterior, (SELECT id FROM alterada) AS id_ne,
+           EXISTS (SELECT 1 FROM notas_de_empenho WHERE id = %(id_ne)s) AS ne_existe
+    FROM saldo s
+    """,
+]
+CONSULTA_ATUALIZAR_EMPENHO = database.preparar(SQL_ATUALIZAR_EMPENHO, "atualizar_empenho")
+
+
+def empenhar(id_distribuicao, numero_ne, valor, data_empenho, descricao=None, id_ne=None):
+    """
+    Grava (id_ne=None) ou altera uma NE só se a cota tiver saldo para o valor, de forma atómica.
+    Devolve (id_ne, novo_saldo_da_cota). Levanta SaldoInsuficienteError, CotaNaoEncontradaError
+    ou (na alteração) NeNaoEncontradaError.
+    """
+    res = database.execute_preparada(CONSULTA_ATUALIZAR_EMPENHO if id_ne else CONSULTA_EMPENHAR, {
+        "id_distribuicao": id_distribuicao, "id_ne": id_ne, "numero_ne": numero_ne,
+        "valor": round(valor, 2), "data": data_empenho, "descricao": descricao,
+    })
+    if not res:
+        raise CotaNaoEncontradaError(f"A cota {id_distribuicao} não existe.")
+    if id_ne and not res[0]['ne_existe']:
+        raise NeNaoEncontradaError(f"A NE {id_ne} já não existe.")
+    saldo_anterior = float(res[0]['saldo_anterior'])
+    if res[0]['id_ne'] is None:
+        raise SaldoInsuficienteError(saldo_anterior, valor)
+    return res[0]['id_ne'], round(saldo_anterior - valor, 2)
@@ -0,0 +1,162 @@
+# siafi_parser.py
+# Leitura das Notas de Crédito em PDF emitidas pelo SIAFI (layout "Rótulos Empilhados").
+# TÉCNICO: Módulo independente da interface (não importa o Flet): pode ser usado pelos
+# processos do pdf_pool, pela importação em lote e pelos benchmarks. As expressões
+# regulares e a tabela de meses são compiladas/criadas uma única vez, no import.
+
+import io
+import re
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+import pdfplumber
+
+# Versão do parser SIAFI: faz parte da chave da cache_pdfs. Aumentar sempre que
+# extrair_dados_siafi passar a devolver dados diferentes para o mesmo PDF.
+VERSAO_PARSER_SIAFI = "2.1"
+
+# Sem estes campos a leitura por regiões é dada como falhada e repete-se com a página inteira.
+CAMPOS_OBRIGATORIOS_SIAFI = ('numero_nc', 'data_recebimento', 'ptres', 'fonte', 'nd', 'ug_gestora', 'pi', 'valor_inicial')
+
+MESES_MAP = {'JAN': '01', 'FEV': '02', 'MAR': '03', 'ABR': '04', 'MAI': '05', 'JUN': '06',
+             'JUL': '07', 'AGO': '08', 'SET': '09', 'OUT': '10', 'NOV': '11', 'DEZ': '12'}
+
+RE_ESPACOS = re.compile(r'\s+')
+RE_DATA_BR = re.compile(r'(\d{2})/(\d{2})/(\d{4})')
+RE_ANO = re.compile(r'Ano:\s+(\d{4})')
+RE_NUMERO = re.compile(r'crédito:\s+(\d+)')
+RE_EMISSAO = re.compile(r'Emissão:\s+(\d{2}/\d{2}/\d{4})')
+# Tabela financeira (ORIGEM/DESTINO) - Padrão: Index PTRES(6) Fonte(10) ND(6) UG(6) PI(S+) Valor
+RE_TABELA_FINANCEIRA = re.compile(r'(\d+)\s+(\d{6})\s+(\d{10})\s+(\d{6})\s+(\d{6}|\d{3}\*{3})\s+(\S+)\s+([\d.,]+)')
+RE_DESCRICAO = re.compile(r'Descrição:(.*?)(?:Itens de Contabilização|$)', re.DOTALL | re.IGNORECASE)
+# Prazo no formato: 27 FEV 26
+RE_PRAZO_EMPENHO = re.compile(r'PRAZO DE EMPENHO\s+(\d{1,2})\s+([A-Z]{3})\s+(\d{2,4})', re.IGNORECASE)
+
+TOLERANCIA_Y = 3  # pontos: palavras com 'top' tão próximo estão na mesma linha
+
+
+@dataclass
+class DadosNcSiafi:
+    """Campos lidos de uma NC do SIAFI (None = não encontrado no PDF)."""
+    numero_nc: Optional[str] = None
+    data_recebimento: Optional[str] = None   # AAAA-MM-DD (data de emissão)
+    data_validade: Optional[str] = None      # AAAA-MM-DD (prazo de empenho)
+    ptres: Optional[str] = None
+    fonte: Optional[str] = None
+    nd: Optional[str] = None
+    ug_gestora: Optional[str] = None
+    pi: Optional[str] = None
+    valor_inicial: Optional[str] = None      # texto do PDF, ex.: '1.500,00'
+    observacao: Optional[str] = None
+
+    def campos_em_falta(self):
+        return [c for c in CAMPOS_OBRIGATORIOS_SIAFI if not getattr(self, c)]
+
+    def como_dict(self):
+        """Dicionário só com os campos encontrados (formato usado pela tela e pela cache)."""
+        return {c: v for c, v in asdict(self).items() if v is not None}
+
+
+def _data_br_para_iso(data_str):
+    # Tenta 04/02/2026 -> 2026-02-04
+    match = RE_DATA_BR.search(data_str or "")
+    return f"{match.group(3)}-{match.group(2)}-{match.group(1)}" if match else None
+
+def interpretar_texto_siafi(texto_completo):
+    """Aplica as regras de captura do SIAFI ao texto extraído (de qualquer um dos modos)."""
+    dados = DadosNcSiafi()
+
+    # --- 1. NÚMERO DA NC (ANO + NÚMERO) ---
+    ano = RE_ANO.search(texto_completo)
+    num = RE_NUMERO.search(texto_completo)
+    if ano and num:
+        dados.numero_nc = f"{ano.group(1)}NC{num.group(1).zfill(6)}"
+
+    # --- 2. DATA DE EMISSÃO ---
+    data_emissao = RE_EMISSAO.search(texto_completo)
+    if data_emissao:
+        dados.data_recebimento = _data_br_para_iso(data_emissao.group(1))
+
+    # --- 3. TABELA FINANCEIRA ---
+    match_fin = RE_TABELA_FINANCEIRA.search(texto_completo)
+    if match_fin:
+        dados.ptres = match_fin.group(2)
+        dados.fonte = match_fin.group(3)
+        dados.nd = match_fin.group(4)
+        dados.ug_gestora = match_fin.group(5).replace('*', '0')  # Ajuste para UGs censuradas
+        dados.pi = match_fin.group(6)
+        dados.valor_inicial = match_fin.group(7)
+
+    # --- 4. OBSERVAÇÃO E PRAZO DE EMPENHO ---
+    obs_match = RE_DESCRICAO.search(texto_completo)
+    if obs_match:
+        dados.observacao = RE_ESPACOS.sub(' ', obs_match.group(1).strip())
+        m_prazo = RE_PRAZO_EMPENHO.search(dados.observacao)
+        if m_prazo:
+            mes = MESES_MAP.get(m_prazo.group(2).upper())
+            ano_p = m_prazo.group(3)
+            if mes:
+                ano_full = f"20{ano_p}" if len(ano_p) == 2 else ano_p
+                dados.data_validade = f"{ano_full}-{mes}-{m_prazo.group(1).zfill(2)}"
+
+    return dados
+
+def _juntar_linhas(palavras):
+    """Reconstrói o texto (linha a linha, da esquerda para a direita) a partir das palavras."""
+    linhas = []
+    for p in sorted(palavras, key=lambda p: (p['top'], p['x0'])):
+        if linhas and abs(p['top'] - linhas[-1][0]) <= TOLERANCIA_Y:
+            linhas[-1][1].append(p)
+        else:
+            linhas.append((p['top'], [p]))
+    return "\n".join(" ".join(p['text'] for p in sorted(ps, key=lambda p: p['x0'])) for _, ps in linhas)
+
+def _texto_regioes_siafi(pagina):
+    """
+    Leitura rápida: localiza os rótulos 'Descrição:' e 'Itens de Contabilização' pelas posições
+    das palavras e devolve só o texto do cabeçalho (número, emissão, tabela financeira) e da descrição.
+    TÉCNICO: Evita o extract_text(layout=True), que preenche a página inteira com espaços
+    para simular o layout, e ignora os itens de contabilização, que não são usados.
+    """
+    palavras = pagina.extract_words(x_tolerance=5)
+    topo_descricao = next((p['top'] for p in palavras if p['text'].startswith("Descrição")), None)
+    if topo_descricao is None: return None
+    topo_itens = next((p['top'] for p in palavras if p['text'] == "Itens" and p['top'] > topo_descricao), pagina.height)
+
+    cabecalho = [p for p in palavras if p['top'] < topo_descricao - TOLERANCIA_Y]
+    descricao = [p for p in palavras if topo_descricao - TOLERANCIA_Y <= p['top'] < topo_itens - TOLERANCIA_Y]
+    return _juntar_linhas(cabecalho) + "\n" + _juntar_linhas(descricao) + "\nItens de Contabilização"
+
+def analisar_pdf_siafi(origem, modo="regioes"):
+    """
+    Lê a primeira página do PDF ('origem' = caminho, bytes ou ficheiro aberto) e devolve DadosNcSiafi.
+    modo="regioes": usa só as palavras das regiões conhecidas do SIAFI; se faltar algum
+    campo obrigatório, recorre ao modo="pagina" (texto com layout da página inteira).
+    Devolve None se o PDF não puder ser lido ou não tiver texto.
+    """
+    if isinstance(origem, (bytes, bytearray)):
+        origem = io.BytesIO(origem)
+    try:
+        with pdfplumber.open(origem) as pdf:
+            pagina = pdf.pages[0]
+            if modo == "regioes":
+                texto = _texto_regioes_siafi(pagina)
+                if texto:
+                    dados = interpretar_texto_siafi(texto)
+                    if not dados.campos_em_falta():
+                        return dados
+            # x_tolerance=5 ajuda a manter palavras de colunas diferentes separadas
+            texto_completo = pagina.extract_text(layout=True, x_tolerance=5)
+    except Exception as e:
+        print(f"Erro na leitura física do PDF: {e}")
+        return None
+
+    return interpretar_texto_siafi(texto_completo) if texto_completo else None
+
+def extrair_dados_siafi(origem, modo="regioes"):
+    """
+    Como analisar_pdf_siafi, mas devolve um dicionário (só com os campos encontrados) ou None.
+    TÉCNICO: Função de nível de módulo para poder correr num processo do pdf_pool.
+    """
+    dados = analisar_pdf_siafi(origem, modo=modo)
+    return dados.como_dict() if dados else None
@@ -6,8 +6,14 @@ import flet as ft
 import traceback
 from datetime import datetime
 import database # TÉCNICO: Motor de conexão PostgreSQL 17 local
+import extratos
+import referencias
+import notificacoes
 
 class AdminView(ft.Row): 
+    # Tabelas cujas alterações recarregam esta view quando está à vista (notificacoes.py) ou ao voltar a ela (main.py).
+    tabelas_dependentes = frozenset({"secoes", "usuarios", "perfis_usuarios", "audit_logs"})
+
     def __init__(self, page, error_modal=None):
         super().__init__()
         self.page = page
@@ -232,6 +238,7 @@ class AdminView(ft.Row):
         except Exception as ex:
             self.show_error(f"Erro ao carregar dados: {ex}")
 
+    @notificacoes.da_sessao
     def save_edit_user(self, e):
         """Persiste a edição e grava o log de auditoria."""
         data = self.modal_edit_user.data
@@ -260,20 +267,20 @@ class AdminView(ft.Row):
         if self.page: self.update()
         
         try:
-            resposta = database.execute_query("SELECT id, nome FROM secoes ORDER BY nome")
+            resposta = referencias.secoes()
             
             self.lista_secoes_view.controls.clear()
             if resposta:
-                for secao in resposta:
+                for id_secao, nome in resposta.items():
                     self.lista_secoes_view.controls.append(
                         ft.Row(
                             [
-                                ft.Text(secao['nome'], expand=True),
+                                ft.Text(nome, expand=True),
                                 ft.IconButton(
                                     icon="DELETE_OUTLINE", 
                                     icon_color="red700",
                                     tooltip="Excluir Seção",
-                                    data=secao['id'], 
+                                    data=id_secao, 
                                     on_click=self.delete_secao
                                 )
                             ]
@@ -287,6 +294,7 @@ class AdminView(ft.Row):
             self.progress_ring_secoes.visible = False
             if self.page: self.update()
 
+    @notificacoes.da_sessao
     def add_secao(self, e):
         nome = self.txt_nova_secao.value.strip()
         if not nome:
@@ -315,6 +323,7 @@ class AdminView(ft.Row):
         except Exception as ex:
             self.show_error(f"Negação: Não foi possível salvar a seção. Erro: {ex}")
 
+    @notificacoes.da_sessao
     def delete_secao(self, e):
         secao_id = e.control.data
         admin = self.page.session.get("user")
@@ -324,6 +333,7 @@ class AdminView(ft.Row):
             nome_secao = nome_res[0]['nome'] if nome_res else "Desconhecida"
             
             database.execute_query("DELETE FROM secoes WHERE id = %s", (secao_id,))
+            extratos.invalidar_tudo()  # os extratos em cache mostram o nome das seções
             
             # Registro de auditoria
             database.registrar_log(admin.get('id'), "EXCLUIR", "secoes", secao_id, f"Removeu a seção: {nome_secao}")
@@ -415,6 +425,7 @@ class AdminView(ft.Row):
         self.modal_add_user.open = False
         self.page.update()
 
+    @notificacoes.da_sessao
     def save_new_user(self, e):
         login = self.modal_add_login.value.strip()
         senha = self.modal_add_senha.value
@@ -476,6 +487,7 @@ class AdminView(ft.Row):
         self.confirm_delete_user_dialog.open = False
         self.page.update()
 
+    @notificacoes.da_sessao
     def confirm_delete_user(self, e):
         user_data = self.confirm_delete_user_dialog.data
         if not user_data: return
@@ -5,6 +5,13 @@ import flet as ft
 import traceback 
 from datetime import datetime, timedelta
 import database
+import referencias
+
+# TÉCNICO: Consultas de filtros repetidas a cada carga, preparadas uma vez por conexão.
+CONSULTA_PIS = database.preparar("SELECT DISTINCT pi FROM ncs_com_saldos ORDER BY pi", "pis_ncs_com_saldos", tabelas={"ncs_com_saldos"})
+CONSULTA_NDS = database.preparar("SELECT DISTINCT natureza_despesa FROM ncs_com_saldos ORDER BY natureza_despesa", "nds_ncs_com_saldos", tabelas={"ncs_com_saldos"})
+CONSULTA_NDS_DO_PI = database.preparar("SELECT DISTINCT natureza_despesa FROM ncs_com_saldos WHERE pi = %s ORDER BY natureza_despesa", "nds_do_pi_ncs_com_saldos",
+                                       tabelas={"ncs_com_saldos"})
 
 class DashboardView(ft.Column):
     """
@@ -13,6 +20,9 @@ class DashboardView(ft.Column):
     Utilizado = Alocado - Saldo.
     """
     
+    # Tabelas cujas alterações recarregam esta view quando está à vista (notificacoes.py) ou ao voltar a ela (main.py).
+    tabelas_dependentes = frozenset(database.DEPENDENCIAS_VIEWS["ncs_com_saldos"])
+
     def __init__(self, page, error_modal=None):
         super().__init__()
         self.page = page
@@ -225,10 +235,10 @@ class DashboardView(ft.Column):
         self.load_dashboard_data(None)
         
     def carregar_filtros_secao(self):
-        """Carrega seções do cache (definido no main)."""
+        """Carrega seções dos dados de referência partilhados (referencias.py)."""
         try:
             self.filtro_secao.options = [ft.dropdown.Option(text="Todas as Seções", key="Todas")]
-            secoes_cache = self.page.session.get("cache_secoes_map") or {}
+            secoes_cache = referencias.secoes()
             for sid, nome in secoes_cache.items():
                 self.filtro_secao.options.append(ft.dropdown.Option(key=str(sid), text=nome))
             self.filtro_secao.update()
@@ -238,17 +248,17 @@ class DashboardView(ft.Column):
         """Carrega PIs e NDs do banco."""
         try:
             if pi_selecionado is None:
-                pis = database.execute_query("SELECT DISTINCT pi FROM ncs_com_saldos ORDER BY pi")
+                pis = database.execute_preparada(CONSULTA_PIS, cache=True)
                 self.filtro_pi.options = [ft.dropdown.Option(text="Todos os PIs", key=None)]
                 for row in pis:
                     if row['pi']: self.filtro_pi.options.append(ft.dropdown.Option(text=row['pi'], key=row['pi']))
                 
-                nds = database.execute_query("SELECT DISTINCT natureza_despesa FROM ncs_com_saldos ORDER BY natureza_despesa")
+                nds = database.execute_preparada(CONSULTA_NDS, cache=True)
                 self.filtro_nd.options = [ft.dropdown.Option(text="Todas as NDs", key=None)]
                 for row in nds:
                     if row['natureza_despesa']: self.filtro_nd.options.append(ft.dropdown.Option(text=row['natureza_despesa'], key=row['natureza_despesa']))
             else:
-                nds = database.execute_query("SELECT DISTINCT natureza_despesa FROM ncs_com_saldos WHERE pi = %s ORDER BY natureza_despesa", (pi_selecionado,))
+                nds = database.execute_preparada(CONSULTA_NDS_DO_PI, (pi_selecionado,), cache=True)
                 self.filtro_nd.options = [ft.dropdown.Option(text="Todas as NDs", key=None)]
                 for row in nds:
                     self.filtro_nd.options.append(ft.dropdown.Option(text=row['natureza_despesa'], key=row['natureza_despesa']))
@@ -272,7 +282,10 @@ class DashboardView(ft.Column):
 
         try:
             # 1. Busca Dados na View
-            sql = "SELECT * FROM ncs_com_saldos WHERE 1=1"
+            # TÉCNICO: Só as colunas usadas, em tuplas (database.Tabela) e não um dicionário por linha.
+            sql = """SELECT numero_nc, nome_secao, pi, natureza_despesa, valor_inicial, saldo_disponivel,
+                            status_calculado, data_validade_empenho
+                     FROM ncs_com_saldos WHERE 1=1"""
             params = []
 
             if self.filtro_pi.value and "Todos" not in self.filtro_pi.value:
@@ -282,23 +295,22 @@ class DashboardView(ft.Column):
             if self.filtro_secao.value and "Todas" not in self.filtro_secao.value:
                 sql += " AND id_secao = %s"; params.append(int(self.filtro_secao.value))
 
-            dados_brutos = database.execute_query(sql, tuple(params))
+            tabela = database.execute_query_tabela(sql, tuple(params), cache=True, tabelas={"ncs_com_saldos"})
+            dados_brutos = tabela.linhas
+            (I_NC, I_SECAO, I_PI, I_ND, I_VALOR, I_SALDO, I_STATUS, I_PRAZO) = range(len(tabela.colunas))
             
             # 2. Cálculos Matemáticos (KPIS)
-            # Total Alocado = Soma de valor_inicial
-            total_alocado = sum(float(item['valor_inicial'] or 0) for item in dados_brutos) if dados_brutos else 0.0
-            
             # Filtragem de Status para o Saldo e Utilizado
             status_alvo = self.filtro_status.value
-            dados_filtrados = [d for d in dados_brutos if d['status_calculado'] == status_alvo] if status_alvo and "Todas" not in status_alvo else (dados_brutos or [])
+            dados_filtrados = [d for d in dados_brutos if d[I_STATUS] == status_alvo] if status_alvo and "Todas" not in status_alvo else dados_brutos
             
             # Saldo Total = Soma de saldo_disponivel
-            saldo_total = sum(float(item['saldo_disponivel'] or 0) for item in dados_filtrados)
+            saldo_total = sum(float(item[I_SALDO] or 0) for item in dados_filtrados)
             
             # Total Utilizado (Empenhado + Recolhido) = Alocado - Saldo
             # Nota: Usamos os dados filtrados para consistência visual se o usuário filtrar por status.
             # Se ele ver "Ativas", ele verá Alocado das Ativas - Saldo das Ativas = Utilizado das Ativas.
-            total_alocado_filtrado = sum(float(item['valor_inicial'] or 0) for item in dados_filtrados)
+            total_alocado_filtrado = sum(float(item[I_VALOR] or 0) for item in dados_filtrados)
             total_utilizado = total_alocado_filtrado - saldo_total
             
             self.txt_total_alocado.value = self.formatar_moeda(total_alocado_filtrado)
@@ -308,8 +320,8 @@ class DashboardView(ft.Column):
             # 3. Atualização do Gráfico (Saldos por Seção)
             saldos_por_secao = {}
             for item in dados_filtrados:
-                nome = item.get('nome_secao', 'N/A')
-                valor = float(item.get('saldo_disponivel', 0))
+                nome = item[I_SECAO] or 'N/A'
+                valor = float(item[I_SALDO] or 0)
                 if valor > 0: # Só mostra seções com saldo no gráfico
                     saldos_por_secao[nome] = saldos_por_secao.get(nome, 0) + valor
 
@@ -341,26 +353,26 @@ class DashboardView(ft.Column):
             # Filtra na memória para aproveitar a query já feita e evitar ir ao banco de novo
             dados_vencendo = [
                 d for d in dados_brutos 
-                if d['status_calculado'] == 'Ativa' 
-                and d.get('data_validade_empenho') 
-                and hoje <= (d['data_validade_empenho'] if isinstance(d['data_validade_empenho'], datetime) else datetime.fromisoformat(str(d['data_validade_empenho'])).date()) <= em_7_dias
+                if d[I_STATUS] == 'Ativa' 
+                and d[I_PRAZO] 
+                and hoje <= (d[I_PRAZO] if isinstance(d[I_PRAZO], datetime) else datetime.fromisoformat(str(d[I_PRAZO])).date()) <= em_7_dias
             ]
 
             self.tabela_vencendo.rows.clear()
             if dados_vencendo:
                 for nc in dados_vencendo:
-                    d_raw = nc.get('data_validade_empenho')
+                    d_raw = nc[I_PRAZO]
                     if hasattr(d_raw, 'strftime'): data_fmt = d_raw.strftime('%d/%m/%Y')
                     else: data_fmt = datetime.fromisoformat(str(d_raw)).strftime('%d/%m/%Y')
                     
                     self.tabela_vencendo.rows.append(ft.DataRow(cells=[
-                        ft.DataCell(ft.Text(nc.get('numero_nc', '-'))), 
-                        ft.DataCell(ft.Text(nc.get('nome_secao', '-'))),
+                        ft.DataCell(ft.Text(nc[I_NC])), 
+                        ft.DataCell(ft.Text(nc[I_SECAO])),
                         ft.DataCell(ft.Text(data_fmt)), 
-                        ft.DataCell(ft.Text(nc.get('pi', '-'))),
-                        ft.DataCell(ft.Text(nc.get('natureza_despesa', '-'))),
-                        ft.DataCell(ft.Text(self.formatar_moeda(nc.get('valor_inicial', 0)))),
-                        ft.DataCell(ft.Text(self.formatar_moeda(nc.get('saldo_disponivel', 0))))
+                        ft.DataCell(ft.Text(nc[I_PI])),
+                        ft.DataCell(ft.Text(nc[I_ND])),
+                        ft.DataCell(ft.Text(self.formatar_moeda(nc[I_VALOR]))),
+                        ft.DataCell(ft.Text(self.formatar_moeda(nc[I_SALDO])))
                     ]))
             else:
                 self.tabela_vencendo.rows.append(ft.DataRow(cells=[ft.DataCell(ft.Text("Nenhuma cota vencendo em breve.", italic=True)), *[ft.DataCell(ft.Text(""))]*6]))
@@ -12,38 +12,338 @@ import database # Importa o motor do PostgreSQL 17 local
 import io       
 import httpx    
 import os       
+import threading
+import zipfile
 
 # --- IMPORTAÇÕES PARA PDF ---
-import pdfplumber
 import re
+import pdf_pool
+from siafi_parser import extrair_dados_siafi, VERSAO_PARSER_SIAFI
+import cache_pdfs
+import retencao
+import extratos
+import saldos
+import referencias
+import notificacoes
 # ----------------------------
 
+# TÉCNICO: Consultas de filtros repetidas a cada carga, preparadas uma vez por conexão.
+CONSULTA_NDS_DO_PI = database.preparar("SELECT DISTINCT natureza_despesa FROM notas_de_credito WHERE pi = %s ORDER BY natureza_despesa",
+                                       "nds_do_pi_notas_de_credito", tabelas={"notas_de_credito"})
+
+# TÉCNICO: Lista de NCs (uma linha por TRIM(numero_nc)) com as distribuições por seção
+# agregadas num array JSON. '{filtros}' recebe as cláusulas AND montadas a partir da tela.
+# A paginação é por keyset em TRIM(numero_nc), que o DISTINCT ON torna única: '{inicio_pagina}'
+# e '{posicao}' posicionam a página depois da última chave vista e '{limite}' corta o tamanho.
+# O LATERAL com as distribuições só corre para as linhas da página.
+COLUNAS_LISTA_NCS = """id_nc, numero_nc, data_recebimento, data_validade_empenho, valor_inicial, ptres,
+    natureza_despesa, fonte, pi, ug_gestora, observacao, status_calculado, valor_total_nc,
+    saldo_disponivel_nc, saldo_disponivel"""
+
+SQL_NCS_COM_DISTRIBUICOES = """
+    SELECT v.*, dist.distribuicao_nc_secoes
+    FROM (
+        SELECT * FROM (
+            SELECT DISTINCT ON (TRIM(numero_nc)) """ + COLUNAS_LISTA_NCS + """, TRIM(numero_nc) AS chave_nc
+            FROM ncs_com_saldos
+            WHERE 1=1 {filtros} {inicio_pagina}
+            ORDER BY TRIM(numero_nc) ASC, data_recebimento DESC
+        ) u
+        WHERE 1=1 {posicao}
+        ORDER BY u.chave_nc ASC, u.data_recebimento DESC
+        {limite}
+    ) v
+    LEFT JOIN LATERAL (
+        SELECT COALESCE(json_agg(d ORDER BY d.id), '[]'::json) AS distribuicao_nc_secoes
+        FROM distribuicao_nc_secoes d
+        WHERE d.id_nc = v.id_nc
+    ) dist ON TRUE
+    ORDER BY v.chave_nc ASC, v.data_recebimento DESC
+"""
+
+SQL_TOTAL_NCS = "SELECT COUNT(DISTINCT TRIM(numero_nc)) AS total FROM ncs_com_saldos WHERE 1=1 {filtros}"
+
+# TÉCNICO: Edição de NC numa única transação (atualizar_nc). A NC e as suas distribuições são
+# bloqueadas (FOR UPDATE) e relidas; a diferença é calculada contra essas linhas, não contra as
+# que o formulário recebeu (podem vir da cache ou de uma lista aberta há muito tempo). Se
+# outra sessão as alterou entretanto, a gravação é recusada em vez de sobrepor a alteração.
+# As distribuições que ficam mantêm o id, por isso as NEs (id_distribuicao) continuam ligadas a elas.
+SQL_BLOQUEAR_NC = "SELECT id FROM notas_de_credito WHERE id = %(id_nc)s FOR UPDATE"
+
+SQL_DISTRIBUICOES_BLOQUEADAS = """
+    SELECT id, id_secao, valor_alocado
+    FROM distribuicao_nc_secoes
+    WHERE id_nc = %(id_nc)s
+    ORDER BY id
+    FOR UPDATE
+"""
+
+SQL_ATUALIZAR_NC = """
+    UPDATE notas_de_credito
+    SET numero_nc=%(numero_nc)s, data_recebimento=%(data_recebimento)s, data_validade_empenho=%(data_validade)s,
+        valor_inicial=%(valor_inicial)s, ptres=%(ptres)s, natureza_despesa=%(nd)s, fonte=%(fonte)s, pi=%(pi)s,
+        ug_gestora=%(ug_gestora)s, observacao=%(observacao)s
+    WHERE id = %(id_nc)s
+"""
+
+SQL_REMOVER_DISTRIBUICOES = """
+    DELETE FROM distribuicao_nc_secoes
+    WHERE id_nc = %(id_nc)s AND id = ANY(%(remover_ids)s::int[])
+"""
+
+SQL_ALTERAR_DISTRIBUICOES = """
+    UPDATE distribuicao_nc_secoes d
+    SET id_secao = u.id_secao, valor_alocado = u.valor
+    FROM unnest(%(alterar_ids)s::int[], %(alterar_secoes)s::int[], %(alterar_valores)s::numeric[]) AS u(id, id_secao, valor)
+    WHERE d.id = u.id AND d.id_nc = %(id_nc)s
+"""
+
+SQL_INSERIR_DISTRIBUICOES = """
+    INSERT INTO distribuicao_nc_secoes (id_nc, id_secao, valor_alocado)
+    SELECT %(id_nc)s, u.id_secao, u.valor
+    FROM unnest(%(inserir_secoes)s::int[], %(inserir_valores)s::numeric[]) AS u(id_secao, valor)
+"""
+
+# Nova NC numa única instrução: cabeçalho + todas as distribuições (insert multi-linha via unnest).
+# Ou fica tudo gravado, ou nada; nunca uma NC sem as suas distribuições.
+SQL_INSERIR_NC_DISTRIBUICOES = """
+    WITH nc AS (
+        INSERT INTO notas_de_credito
+            (numero_nc, data_recebimento, data_validade_empenho, valor_inicial, ptres, natureza_despesa, fonte, pi, ug_gestora, observacao)
+        VALUES (%(numero_nc)s, %(data_recebimento)s, %(data_validade)s, %(valor_inicial)s, %(ptres)s, %(nd)s,
+                %(fonte)s, %(pi)s, %(ug_gestora)s, %(observacao)s)
+        RETURNING id
+    ), novas AS (
+        INSERT INTO distribuicao_nc_secoes (id_nc, id_secao, valor_alocado)
+        SELECT nc.id, u.id_secao, u.valor
+        FROM nc, unnest(%(inserir_secoes)s::int[], %(inserir_valores)s::numeric[]) AS u(id_secao, valor)
+    )
+    SELECT id FROM nc
+"""
+
+class NcAlteradaError(Exception):
+    """A NC (ou as suas distribuições) mudou no banco depois de o formulário ter sido aberto."""
+
+
+def _normalizar_distribuicoes(linhas):
+    return {int(d['id']): (int(d['id_secao']), round(float(d['valor_alocado']), 2)) for d in linhas or []}
+
+def diff_distribuicoes(originais, atuais):
+    """
+    Compara as distribuições gravadas com as do formulário.
+    originais: [{'id', 'id_secao', 'valor_alocado'}]; atuais: [(id_ou_None, id_secao, valor)].
+    Devolve (ids_a_remover, [(id, id_secao, valor)] a alterar, [(id_secao, valor)] a inserir).
+    TÉCNICO: Cada linha do formulário fica primeiro com a distribuição gravada da mesma seção
+    (só o valor muda): trocar as seções de duas linhas troca os valores em vez de trocar o
+    id_secao no lugar, que violaria a unicidade (id_nc, id_secao) a meio do UPDATE. Só as
+    linhas cuja seção não existia mudam de seção (pelo id), e só depois de apagadas as removidas.
+    """
+    gravadas = _normalizar_distribuicoes(originais)
+    por_secao = {secao: id_dist for id_dist, (secao, _) in gravadas.items()}
+    atuais = [(id_dist, int(id_secao), round(float(valor), 2)) for id_dist, id_secao, valor in atuais]
+    usadas, pendentes, alterar, inserir = set(), [], [], []
+    for id_dist, id_secao, valor in atuais:
+        id_mesma_secao = por_secao.get(id_secao)
+        if id_mesma_secao is not None and id_mesma_secao not in usadas:
+            usadas.add(id_mesma_secao)
+            if gravadas[id_mesma_secao][1] != valor: alterar.append((id_mesma_secao, id_secao, valor))
+        else:
+            pendentes.append((id_dist, id_secao, valor))
+    for id_dist, id_secao, valor in pendentes:
+        if id_dist in gravadas and id_dist not in usadas:
+            usadas.add(id_dist)
+            alterar.append((id_dist, id_secao, valor))
+        else:
+            inserir.append((id_secao, valor))
+    return [i for i in gravadas if i not in usadas], alterar, inserir
+
+def atualizar_nc(params, originais, atuais):
+    """
+    Grava a edição de uma NC (params: campos do cabeçalho + 'id_nc') e das suas distribuições.
+    originais: as distribuições com que o formulário foi aberto; atuais: as do formulário.
+    Levanta NcAlteradaError se a NC já não existir ou se as distribuições tiverem mudado
+    entretanto, e RuntimeError se alguma instrução não afetar as linhas esperadas (nada é gravado).
+    """
+    with database.transacao() as cur:
+        cur.execute(SQL_BLOQUEAR_NC, params)
+        if cur.rowcount != 1:
+            raise NcAlteradaError("A NC já não existe (foi excluída por outro utilizador).")
+        cur.execute(SQL_DISTRIBUICOES_BLOQUEADAS, params)
+        gravadas = cur.fetchall()
+        if _normalizar_distribuicoes(gravadas) != _normalizar_distribuicoes(originais):
+            raise NcAlteradaError("As distribuições desta NC foram alteradas por outro utilizador.")
+
+        remover, alterar, inserir = diff_distribuicoes(gravadas, atuais)
+        params = dict(params, remover_ids=remover,
+                      alterar_ids=[a[0] for a in alterar], alterar_secoes=[a[1] for a in alterar],
+                      alterar_valores=[a[2] for a in alterar],
+                      inserir_secoes=[i[0] for i in inserir], inserir_valores=[i[1] for i in inserir])
+        # Ordem: apagar antes de alterar/inserir, para as seções libertadas poderem ser reutilizadas.
+        passos = [(SQL_ATUALIZAR_NC, 1), (SQL_REMOVER_DISTRIBUICOES, len(remover)),
+                  (SQL_ALTERAR_DISTRIBUICOES, len(alterar)), (SQL_INSERIR_DISTRIBUICOES, len(inserir))]
+        for sql, esperadas in passos:
+            if not esperadas: continue
+            cur.execute(sql, params)
+            if cur.rowcount != esperadas:
+                raise RuntimeError(f"Gravação da NC {params['id_nc']} cancelada: {cur.rowcount} linha(s) "
+                                   f"afetada(s) em vez de {esperadas}.")
+
+def montar_sql_ncs(filtros="", apos_chave=False, limitar=False):
+    """
+    Monta a consulta da lista de NCs.
+    Ordem dos parâmetros: os dos filtros; se apos_chave, (chave, chave); se limitar, (limite,).
+    """
+    return SQL_NCS_COM_DISTRIBUICOES.format(
+        filtros=filtros,
+        # O '>=' interno só serve para o índice/plano; o corte exato é feito depois do DISTINCT ON.
+        inicio_pagina=" AND TRIM(numero_nc) >= %s" if apos_chave else "",
+        posicao=" AND u.chave_nc > %s" if apos_chave else "",
+        limite="LIMIT %s" if limitar else "",
+    )
+
+# --- IMPORTAÇÃO EM LOTE ---
+RE_NUMERO_NC = re.compile(r'^\d{4}NC\d{6}$')
+MAX_PDFS_POR_ZIP = 500
+MAX_BYTES_PDF_NO_ZIP = 20 * 1024 * 1024  # PDFs do SIAFI têm poucas centenas de KB
+
+# Para database.execute_batch: o '%s' de VALUES recebe todas as linhas do lote.
+SQL_INSERIR_NCS_LOTE = """INSERT INTO notas_de_credito 
+                          (numero_nc, data_recebimento, data_validade_empenho, valor_inicial, ptres, natureza_despesa, fonte, pi, ug_gestora, observacao) 
+                          VALUES %s"""
+
+def converter_valor_siafi(valor_txt):
+    """'1.500,00' -> 1500.0 (None se o texto não for um valor)."""
+    if not valor_txt: return None
+    v = str(valor_txt).replace("R$", "").strip()
+    if "," in v: v = v.replace(".", "").replace(",", ".")
+    try: return float(v)
+    except ValueError: return None
+
+def validar_dados_siafi(dados):
+    """Devolve a lista de problemas que impedem gravar a NC extraída (lista vazia = válida)."""
+    if not dados: return ["Nenhum dado extraído do PDF."]
+    erros = []
+    if not RE_NUMERO_NC.match(dados.get('numero_nc') or ""):
+        erros.append("Número da NC não reconhecido.")
+    if not dados.get('data_recebimento'):
+        erros.append("Data de emissão em falta.")
+    valor = converter_valor_siafi(dados.get('valor_inicial'))
+    if valor is None or valor <= 0:
+        erros.append("Valor inicial inválido.")
+    for campo, rotulo in (('ptres', 'PTRES'), ('nd', 'ND'), ('fonte', 'Fonte'), ('pi', 'PI'), ('ug_gestora', 'UG Gestora')):
+        if not dados.get(campo): erros.append(f"{rotulo} em falta.")
+    return erros
+
+def ler_pdf_siafi(origem, nome="", aguardar_vaga=False):
+    """
+    Devolve um TrabalhoPdf com os dados do PDF ('origem' = bytes ou caminho).
+    Se o mesmo conteúdo (SHA-256) já foi lido por esta versão do parser, o trabalho chega
+    já concluído com os dados da cache_pdfs; caso contrário vai para o pdf_pool e o
+    resultado é guardado na cache quando terminar.
+    """
+    if isinstance(origem, str):
+        with open(origem, "rb") as f: origem = f.read()
+    chave = cache_pdfs.hash_conteudo(origem)
+    cache = cache_pdfs.get_cache()
+    dados = cache.obter(chave, VERSAO_PARSER_SIAFI)
+    if dados is not None:
+        return pdf_pool.trabalho_concluido(dados, nome=nome)
+
+    trabalho = pdf_pool.submeter(extrair_dados_siafi, origem, nome=nome, aguardar_vaga=aguardar_vaga)
+    # Só guarda leituras bem-sucedidas: um PDF ilegível volta a ser tentado no próximo upload.
+    trabalho.ao_terminar(lambda t: t.dados and cache.guardar(chave, VERSAO_PARSER_SIAFI, t.dados))
+    return trabalho
+
+def numeros_nc_existentes(numeros):
+    """Dos números de NC indicados, devolve o conjunto dos que já estão cadastrados."""
+    if not numeros: return set()
+    res = database.execute_query(
+        "SELECT TRIM(numero_nc) AS numero_nc FROM notas_de_credito WHERE TRIM(numero_nc) = ANY(%s)", (list(numeros),))
+    return {r['numero_nc'] for r in res or []}
+
+def expandir_ficheiros_lote(ficheiros):
+    """
+    Transforma os ficheiros enviados [(nome, bytes)] na lista [(nome, bytes)] de PDFs a ler:
+    PDFs soltos seguem tal como estão; os ZIPs são abertos em memória e dão um item por PDF.
+    Devolve também os avisos (ZIPs inválidos, PDFs ignorados por tamanho/limite).
+    """
+    itens, avisos = [], []
+    for nome, conteudo in ficheiros:
+        if not nome.lower().endswith(".zip"):
+            itens.append((nome, conteudo))
+            continue
+        try:
+            with zipfile.ZipFile(io.BytesIO(conteudo)) as zf:
+                membros = [m for m in zf.infolist() if not m.is_dir() and m.filename.lower().endswith(".pdf")]
+                if len(membros) > MAX_PDFS_POR_ZIP:
+                    avisos.append((nome, f"O ZIP tem {len(membros)} PDFs; apenas os primeiros {MAX_PDFS_POR_ZIP} foram lidos."))
+                for m in membros[:MAX_PDFS_POR_ZIP]:
+                    nome_pdf = f"{nome}/{m.filename}"
+                    if m.file_size > MAX_BYTES_PDF_NO_ZIP:
+                        avisos.append((nome_pdf, "PDF demasiado grande; ignorado."))
+                        continue
+                    itens.append((nome_pdf, zf.read(m)))
+        except zipfile.BadZipFile:
+            avisos.append((nome, "Ficheiro ZIP inválido ou corrompido."))
+    return itens, avisos
+
 class NcsView(ft.Column):
     """
     Representa o conteúdo da aba Notas de Crédito (CRUD).
     (v1.6) Modal "Quick View" exibe todos os dados.
     """
+
+    # Tempo de silêncio (segundos) após a última tecla antes de pesquisar no banco.
+    DEBOUNCE_PESQUISA_S = 0.4
+    # NCs por página na tabela (None = modo antigo, carrega todas as NCs de uma vez).
+    TAMANHO_PAGINA_NCS = 50
     
-    def __init__(self, page, on_data_changed=None, error_modal=None):
+    # Tabelas cujas alterações recarregam esta view quando está à vista (notificacoes.py) ou ao voltar a ela (main.py).
+    tabelas_dependentes = frozenset(database.DEPENDENCIAS_VIEWS["ncs_com_saldos"])
+
+    def __init__(self, page, error_modal=None):
         super().__init__()
         self.page = page
         self.id_sendo_editado = None
         self.id_nc_para_recolhimento = None
-        self.on_data_changed_callback = on_data_changed
         self.error_modal = error_modal
         
         self.secoes_cache = {} 
+
+        # Controlo da pesquisa em tempo real: só a carga mais recente é desenhada.
+        self._carga_lock = threading.Lock()
+        self._geracao_carga = 0
+        self._timer_pesquisa = None
+        self._cancelamento_carga = None
+
+        # Paginação por keyset: cada entrada é a chave (numero_nc, data) onde a página começa.
+        self._inicios_paginas = [None]
+        self._chave_fim_pagina = None
+        self._total_ncs = 0
+
+        # Importação: "unica" (um PDF -> modal) ou "lote" (vários PDFs/ZIPs -> grelha de revisão).
+        self.modo_importacao = "unica"
+        self._lote_lock = threading.Lock()
+        self._lote_pendentes = set()
+        self._lote_total = 0
+        self._lote_ficheiros = []
+        self._lote_registos = []
         
         self.alignment = ft.MainAxisAlignment.START
         self.spacing = 20
         
         self.progress_ring = ft.ProgressRing(visible=True, width=32, height=32)
+        self.txt_estado_importacao = ft.Text("", size=12, italic=True, color="grey700", visible=False)
         
         self.file_picker_import = ft.FilePicker(
             on_result=self.on_file_picker_result,
             on_upload=self.on_upload_progress 
         )
         
+        self.txt_paginacao = ft.Text("", size=12, color="grey700")
+        self.btn_pagina_anterior = ft.IconButton(icon="CHEVRON_LEFT", tooltip="Página Anterior", disabled=True, on_click=lambda e: self.load_ncs_data(pagina="anterior"))
+        self.btn_pagina_seguinte = ft.IconButton(icon="CHEVRON_RIGHT", tooltip="Próxima Página", disabled=True, on_click=lambda e: self.load_ncs_data(pagina="seguinte"))
+
         self.tabela_ncs = ft.DataTable(
             columns=[
                 ft.DataColumn(ft.Text("Número NC", weight=ft.FontWeight.BOLD)),
@@ -231,6 +531,46 @@ class NcsView(ft.Column):
             ],
             actions_alignment=ft.MainAxisAlignment.END,
         )
+        # --- Modal de revisão da importação em lote ---
+        self.lote_resumo = ft.Text("")
+        self.lote_tabela = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Gravar", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Ficheiro", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Número NC", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Valor", weight=ft.FontWeight.BOLD), numeric=True),
+                ft.DataColumn(ft.Text("PI", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("ND", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("PTRES", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Fonte", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("UG", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Emissão", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Prazo", weight=ft.FontWeight.BOLD)),
+                ft.DataColumn(ft.Text("Validação", weight=ft.FontWeight.BOLD)),
+            ],
+            rows=[],
+            border=ft.border.all(1, "grey200"),
+            border_radius=8,
+        )
+        self.modal_lote_loading_ring = ft.ProgressRing(visible=False, width=24, height=24)
+        self.modal_lote_btn_salvar = ft.ElevatedButton("Gravar Selecionadas", icon="SAVE", on_click=self.save_lote)
+        self.lote_modal = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Revisão da Importação em Lote"),
+            content=ft.Column(
+                [self.lote_resumo, ft.Row([self.lote_tabela], scroll=ft.ScrollMode.ADAPTIVE)],
+                height=500,
+                width=1100,
+                scroll=ft.ScrollMode.ADAPTIVE
+            ),
+            actions=[
+                self.modal_lote_loading_ring,
+                ft.TextButton("Cancelar", on_click=self.close_lote_modal),
+                self.modal_lote_btn_salvar,
+            ],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+
         self.confirm_delete_nc_dialog = ft.AlertDialog(modal=True, title=ft.Text("Confirmar Exclusão de Nota de Crédito"), content=ft.Text("Atenção!\nTem a certeza de que deseja excluir esta Nota de Crédito?\nTodas as Notas de Empenho e Recolhimentos vinculados também serão excluídos.\nEsta ação não pode ser desfeita."), actions=[ft.TextButton("Cancelar", on_click=lambda e: self.close_confirm_delete_nc(None)), ft.ElevatedButton("Excluir NC", color="white", bgcolor="red", on_click=self.confirm_delete_nc),], actions_alignment=ft.MainAxisAlignment.END,)
 
         # --- Filtros (Sem alteração) ---
@@ -264,7 +604,14 @@ class NcsView(ft.Column):
                                             icon="UPLOAD_FILE",
                                             tooltip="Adicionar NC a partir de um PDF do SIAFI",
                                             on_click=self.open_file_picker
-                                        )
+                                        ),
+                                        ft.OutlinedButton(
+                                            "Importar Lote (SIAFI)",
+                                            icon="DRIVE_FOLDER_UPLOAD",
+                                            tooltip="Importar várias NCs de uma vez (vários PDFs ou um ZIP)",
+                                            on_click=self.open_file_picker_lote
+                                        ),
+                                        self.txt_estado_importacao,
                                     ],
                                     spacing=10
                                 )
@@ -311,6 +658,11 @@ class NcsView(ft.Column):
                         ft.Container(
                             content=self.tabela_ncs,
                             #expand=True
+                        ),
+                        ft.Row(
+                            [self.btn_pagina_anterior, self.txt_paginacao, self.btn_pagina_seguinte],
+                            alignment=ft.MainAxisAlignment.CENTER,
+                            visible=self.TAMANHO_PAGINA_NCS is not None
                         )
                     ],
                     #expand=True
@@ -327,6 +679,7 @@ class NcsView(ft.Column):
         self.page.overlay.append(self.history_modal)
         self.page.overlay.append(self.recolhimento_modal)
         self.page.overlay.append(self.confirm_delete_nc_dialog)
+        self.page.overlay.append(self.lote_modal)
         self.page.overlay.append(self.quick_view_modal) # (v1.5) Adiciona o novo modal
         self.page.overlay.append(self.file_picker_import) 
         self.page.overlay.append(self.date_picker_recebimento) 
@@ -339,10 +692,40 @@ class NcsView(ft.Column):
         self.on_mount = self.on_view_mount
 
     def filtrar_ncs_em_tempo_real(self, e):
-        # Chama o seu método de carregamento já existente
-        # Ele deve usar o valor de self.txt_busca.value para filtrar
-        self.load_ncs_data()
+        """
+        Debounce da pesquisa: cada tecla reinicia o temporizador e cancela a consulta em curso.
+        Só quando o utilizador pára de escrever durante DEBOUNCE_PESQUISA_S é que a tabela é recarregada.
+        """
+        with self._carga_lock:
+            if self._timer_pesquisa:
+                self._timer_pesquisa.cancel()
+            if self._cancelamento_carga:
+                self._cancelamento_carga.cancelar()
+            self._geracao_carga += 1 # Descarta o resultado de qualquer carga ainda em curso
+            self._timer_pesquisa = threading.Timer(self.DEBOUNCE_PESQUISA_S, self.load_ncs_data)
+            self._timer_pesquisa.daemon = True
+            self._timer_pesquisa.start()
+
+    def _iniciar_carga(self):
+        """Regista uma nova carga da tabela, que substitui (e cancela no servidor) a anterior."""
+        with self._carga_lock:
+            if self._timer_pesquisa:
+                self._timer_pesquisa.cancel()
+                self._timer_pesquisa = None
+            if self._cancelamento_carga:
+                self._cancelamento_carga.cancelar()
+            self._geracao_carga += 1
+            self._cancelamento_carga = database.Cancelamento()
+            return self._geracao_carga, self._cancelamento_carga
+
+    def _carga_atual(self, geracao):
+        return geracao == self._geracao_carga
         
+    def pode_descartar(self):
+        """main.py não descarta a view (por inatividade) enquanto há um lote a enviar."""
+        with self._lote_lock:
+            return not self._lote_pendentes
+
     def on_view_mount(self, e):
         print("NcsView: Controlo montado. A carregar dados...")
         self.load_secoes_cache() 
@@ -355,45 +738,27 @@ class NcsView(ft.Column):
         try:
             nc_id = nc_obj.get('id_nc')
 
-            # 1. Busca detalhamento das SEÇÕES com saldo corrigido (Alocado - Empenhado - Recolhido)
-            sql_sec = """
-                SELECT s.nome, d.valor_alocado, 
-                       COALESCE((SELECT SUM(valor_empenhado) FROM notas_de_empenho WHERE id_distribuicao = d.id), 0) as emp,
-                       COALESCE((SELECT SUM(valor_recolhido) FROM recolhimentos_de_saldo WHERE id_distribuicao = d.id), 0) as rec
-                FROM distribuicao_nc_secoes d
-                JOIN secoes s ON s.id = d.id_secao
-                WHERE d.id_nc = %s
-            """
-            fatias = database.execute_query(sql_sec, (nc_id,))
-            
+            # TÉCNICO: Seções, NEs e recolhimentos vêm numa única consulta agregada,
+            # guardada na cache de extratos até a NC (ou uma NE/recolhimento dela) mudar.
+            extrato = extratos.obter_extrato(nc_id)
+
+            # 1. SEÇÕES com saldo corrigido (Alocado - Empenhado - Recolhido)
             txt_dist = ""
-            for f in fatias:
-                # CÁLCULO DO SALDO REAL (Ponto 3 resolvido)
-                saldo_real = f['valor_alocado'] - f['emp'] - f['rec']
-                txt_dist += f"• {f['nome']}: {self.formatar_moeda(f['valor_alocado'])} (Saldo Real: {self.formatar_moeda(saldo_real)})\n"
-
-            # 2. Busca o histórico de EMPENHOS (NEs)
-            sql_nes = "SELECT numero_ne, valor_empenhado, data_empenho FROM notas_de_empenho n JOIN distribuicao_nc_secoes d ON n.id_distribuicao = d.id WHERE d.id_nc = %s ORDER BY data_empenho DESC"
-            nes_list = database.execute_query(sql_nes, (nc_id,))
-            
+            for f in extrato['fatias']:
+                txt_dist += f"• {f['nome']}: {self.formatar_moeda(f['valor_alocado'])} (Saldo Real: {self.formatar_moeda(f['saldo_real'])})\n"
+
+            # 2. Histórico de EMPENHOS (NEs)
             txt_nes = ""
-            if nes_list:
-                for ne in nes_list:
-                    dt = ne['data_empenho'].strftime('%d/%m/%Y') if ne['data_empenho'] else "N/A"
-                    txt_nes += f"• {ne['numero_ne']} - {self.formatar_moeda(ne['valor_empenhado'])} ({dt})\n"
-            else:
+            for ne in extrato['nes']:
+                txt_nes += f"• {ne['numero_ne']} - {self.formatar_moeda(ne['valor_empenhado'])} ({ne['data_fmt'] or 'N/A'})\n"
+            if not txt_nes:
                 txt_nes = "Nenhum empenho registrado."
 
-            # 3. Busca o histórico de RECOLHIMENTOS
-            sql_rec = "SELECT valor_recolhido, data_recolhimento FROM recolhimentos_de_saldo WHERE id_nc = %s ORDER BY data_recolhimento DESC"
-            rec_list = database.execute_query(sql_rec, (nc_id,))
-
+            # 3. Histórico de RECOLHIMENTOS
             txt_rec = ""
-            if rec_list:
-                for r in rec_list:
-                    dt = r['data_recolhimento'].strftime('%d/%m/%Y') if r['data_recolhimento'] else "N/A"
-                    txt_rec += f"• Devolução: {self.formatar_moeda(r['valor_recolhido'])} ({dt})\n"
-            else:
+            for r in extrato['recolhimentos']:
+                txt_rec += f"• Devolução: {self.formatar_moeda(r['valor_recolhido'])} ({r['data_fmt'] or 'N/A'})\n"
+            if not txt_rec:
                 txt_rec = "Nenhum recolhimento registrado."
 
             # 4. Montagem do Texto no Modal
@@ -480,6 +845,14 @@ class NcsView(ft.Column):
         self.modal_txt_data_validade.update()
 
     def open_file_picker(self, e):
+        self.modo_importacao = "unica"
+        self._abrir_seletor_ficheiros(allow_multiple=False, allowed_extensions=["pdf"])
+
+    def open_file_picker_lote(self, e):
+        self.modo_importacao = "lote"
+        self._abrir_seletor_ficheiros(allow_multiple=True, allowed_extensions=["pdf", "zip"])
+
+    def _abrir_seletor_ficheiros(self, allow_multiple, allowed_extensions):
         try:
             if self.file_picker_import and self.page:
                 if self.file_picker_import not in self.page.overlay:
@@ -488,8 +861,8 @@ class NcsView(ft.Column):
                     self.page.update() 
                 
                 self.file_picker_import.pick_files(
-                    allow_multiple=False,
-                    allowed_extensions=["pdf"]
+                    allow_multiple=allow_multiple,
+                    allowed_extensions=allowed_extensions
                 )
                 
                 self.page.update() 
@@ -502,14 +875,9 @@ class NcsView(ft.Column):
             self.show_error(f"Erro ao tentar abrir diálogo: {ex}")
     
     def load_secoes_cache(self):
-        """Busca o cache de seções diretamente do PostgreSQL 17 local."""
-        print("NcsView: A carregar cache de seções do banco local...")
+        """Aponta o cache de seções para os dados de referência partilhados (referencias.py)."""
         try:
-            # TÉCNICO: Consulta SQL direta substituindo o supabase.table
-            resposta = database.execute_query("SELECT id, nome FROM secoes ORDER BY nome")
-            if resposta:
-                self.secoes_cache = {secao['id']: secao['nome'] for secao in resposta}
-                print(f"NcsView: {len(self.secoes_cache)} seções carregadas no cache.")
+            self.secoes_cache = referencias.secoes()
         except Exception as ex:
             traceback.print_exc()
             self.handle_db_error(ex, "carregar cache de seções")
@@ -537,20 +905,17 @@ class NcsView(ft.Column):
             
             if pi_selecionado is None:
                 # Busca PIs Únicos
-                pis = database.execute_query("SELECT DISTINCT pi FROM notas_de_credito ORDER BY pi")
                 self.filtro_pi.options = [ft.dropdown.Option(text="Todos os PIs", key="")]
-                for row in pis:
-                    if row['pi']: self.filtro_pi.options.append(ft.dropdown.Option(text=row['pi'], key=row['pi']))
+                for pi in referencias.pis():
+                    if pi: self.filtro_pi.options.append(ft.dropdown.Option(text=pi, key=pi))
                 
                 # Busca NDs Únicas
-                nds = database.execute_query("SELECT DISTINCT natureza_despesa FROM notas_de_credito ORDER BY natureza_despesa")
                 self.filtro_nd.options = [ft.dropdown.Option(text="Todas as NDs", key="")]
-                for row in nds:
-                    if row['natureza_despesa']: self.filtro_nd.options.append(ft.dropdown.Option(text=row['natureza_despesa'], key=row['natureza_despesa']))
+                for nd in referencias.nds():
+                    if nd: self.filtro_nd.options.append(ft.dropdown.Option(text=nd, key=nd))
             else:
                 # Busca NDs vinculadas ao PI (Filtro dependente)
-                sql = "SELECT DISTINCT natureza_despesa FROM notas_de_credito WHERE pi = %s ORDER BY natureza_despesa"
-                nds = database.execute_query(sql, (pi_selecionado,))
+                nds = database.execute_preparada(CONSULTA_NDS_DO_PI, (pi_selecionado,), cache=True)
                 self.filtro_nd.options = [ft.dropdown.Option(text="Todas as NDs", key="")]
                 for row in nds:
                     self.filtro_nd.options.append(ft.dropdown.Option(text=row['natureza_despesa'], key=row['natureza_despesa']))
@@ -582,49 +947,86 @@ class NcsView(ft.Column):
     def load_ncs_data_wrapper(self, e): 
         self.load_ncs_data()
         
-    def load_ncs_data(self):
-        """Carrega a tabela eliminando duplicatas por espaços e corrigindo filtros."""
+    def _montar_filtros_ncs(self):
+        """Traduz os filtros da tela em cláusulas SQL (aplicadas sobre ncs_com_saldos)."""
+        filtros = ""
+        params = []
+
+        # 1. Filtro de Pesquisa (Texto)
+        if self.filtro_pesquisa_nc.value:
+            filtros += " AND numero_nc ILIKE %s"
+            params.append(f"%{self.filtro_pesquisa_nc.value}%")
+
+        # 2. Filtros Dropdown (Corrigido: ignora se for vazio ou string "None")
+        if self.filtro_status.value and self.filtro_status.value not in ["", "None"]:
+            filtros += " AND status_calculado = %s"; params.append(self.filtro_status.value)
+
+        if self.filtro_pi.value and self.filtro_pi.value not in ["", "None"]:
+            filtros += " AND pi = %s"; params.append(self.filtro_pi.value)
+
+        if self.filtro_nd.value and self.filtro_nd.value not in ["", "None"]:
+            filtros += " AND natureza_despesa = %s"; params.append(self.filtro_nd.value)
+
+        return filtros, params
+
+    def load_ncs_data(self, pagina="primeira"):
+        """
+        Carrega a tabela eliminando duplicatas por espaços e corrigindo filtros.
+        pagina: "primeira" (filtros mudaram), "seguinte", "anterior" ou "atual".
+        """
+        geracao, cancelamento = self._iniciar_carga()
         self.progress_ring.visible = True
         self.page.update()
         try:
-            # TÉCNICO: Usamos TRIM para ignorar espaços e garantir que NCs iguais sejam unificadas
-            sql = "SELECT DISTINCT ON (TRIM(numero_nc)) * FROM ncs_com_saldos WHERE 1=1"
-            params = []
-
-            # 1. Filtro de Pesquisa (Texto)
-            if self.filtro_pesquisa_nc.value:
-                sql += " AND numero_nc ILIKE %s"
-                params.append(f"%{self.filtro_pesquisa_nc.value}%")
+            filtros, params = self._montar_filtros_ncs()
+            tamanho = self.TAMANHO_PAGINA_NCS
+
+            # Define a chave onde a página pedida começa (keyset)
+            inicios = list(self._inicios_paginas)
+            if pagina == "primeira" or tamanho is None:
+                inicios = [None]
+            elif pagina == "seguinte" and self._chave_fim_pagina:
+                inicios.append(self._chave_fim_pagina)
+            elif pagina == "anterior" and len(inicios) > 1:
+                inicios.pop()
+            inicio = inicios[-1]
+
+            # O total é recontado a cada carga, numa consulta à parte: vem da cache enquanto
+            # ninguém escrever nas tabelas da view, por isso só vai ao banco depois de uma gravação.
+            total = self._total_ncs
+            if tamanho is not None:
+                res_total = database.execute_query(SQL_TOTAL_NCS.format(filtros=filtros), tuple(params), cancelamento=cancelamento,
+                                                   cache=True, tabelas={"ncs_com_saldos"})
+                total = res_total[0]['total'] if res_total else 0
+
+            sql = montar_sql_ncs(filtros, apos_chave=inicio is not None, limitar=tamanho is not None)
+            if inicio is not None:
+                params += [inicio, inicio]
+            if tamanho is not None:
+                params.append(tamanho + 1) # +1 só para saber se existe página seguinte
+
+            # TÉCNICO: Uma única ida ao banco. As distribuições de cada NC chegam já agregadas
+            # (json_agg) na coluna 'distribuicao_nc_secoes', em vez de uma consulta extra por NC.
+            # Voltar a uma página/filtro já visto sai da cache até haver uma escrita nas tabelas da view.
+            resposta = database.execute_query(sql, tuple(params), cancelamento=cancelamento,
+                                              cache=True, tabelas={"ncs_com_saldos", "distribuicao_nc_secoes"})
+
+            # Uma carga mais recente já foi pedida: este resultado está desatualizado.
+            if not self._carga_atual(geracao): return
             
-            # 2. Filtros Dropdown (Corrigido: ignora se for vazio ou string "None")
-            if self.filtro_status.value and self.filtro_status.value not in ["", "None"]:
-                sql += " AND status_calculado = %s"; params.append(self.filtro_status.value)
-                
-            if self.filtro_pi.value and self.filtro_pi.value not in ["", "None"]:
-                sql += " AND pi = %s"; params.append(self.filtro_pi.value)
-                
-            if self.filtro_nd.value and self.filtro_nd.value not in ["", "None"]:
-                sql += " AND natureza_despesa = %s"; params.append(self.filtro_nd.value)
+            resposta = resposta or []
+            ha_seguinte = tamanho is not None and len(resposta) > tamanho
+            if ha_seguinte:
+                resposta = resposta[:tamanho]
 
-            # OBRIGATÓRIO: O ORDER BY deve seguir o TRIM do DISTINCT
-            sql += " ORDER BY TRIM(numero_nc) ASC, data_recebimento DESC"
-            
-            resposta = database.execute_query(sql, tuple(params))
-            
-            self.tabela_ncs.rows.clear()
+            novas_linhas = []
             if resposta:
                 for nc in resposta:
-                    # CORREÇÃO VITAL: Usar 'id_nc' (que é o que a View retorna agora)
-                    actual_id = nc.get('id_nc') 
-                    
-                    # Busca as seções vinculadas usando o ID correto
-                    dist_sql = "SELECT * FROM distribuicao_nc_secoes WHERE id_nc = %s"
-                    nc['distribuicao_nc_secoes'] = database.execute_query(dist_sql, (actual_id,))
-
-                    self.tabela_ncs.rows.append(
+                    novas_linhas.append(
                         ft.DataRow(cells=[
                             # Passamos o objeto 'nc' completo, que agora tem as seções dentro
-                            ft.DataCell(ft.TextButton(text=nc['numero_nc'], on_click=lambda e, o=nc: self.open_quick_view_modal(e, o))),
+                            ft.DataCell(ft.TextButton(text=nc['numero_nc'], on_click=lambda e, o=nc: self.open_quick_view_modal(e, o),
+                                                      on_hover=lambda e, i=nc['id_nc']: e.data == "true" and extratos.pre_carregar([i], prioridade=True))),
                             ft.DataCell(ft.Text(nc.get('pi', ''))),
                             ft.DataCell(ft.Text(nc.get('natureza_despesa', ''))),
                             ft.DataCell(ft.Text(self.formatar_moeda(nc.get('valor_total_nc')))),
@@ -637,13 +1039,35 @@ class NcsView(ft.Column):
                         ])
                     )
             else:
-                self.tabela_ncs.rows.append(ft.DataRow(cells=[ft.DataCell(ft.Text("Nenhuma NC encontrada.", italic=True)), *[ft.DataCell(ft.Text(""))]*5]))
+                novas_linhas.append(ft.DataRow(cells=[ft.DataCell(ft.Text("Nenhuma NC encontrada.", italic=True)), *[ft.DataCell(ft.Text(""))]*5]))
+
+            with self._carga_lock:
+                if not self._carga_atual(geracao): return
+                self.tabela_ncs.rows = novas_linhas
+                self._inicios_paginas = inicios
+                self._chave_fim_pagina = resposta[-1]['chave_nc'] if ha_seguinte else None
+                self._total_ncs = total
+                self._atualizar_paginacao()
+            # Aquece em segundo plano os extratos do Quick View das NCs agora visíveis.
+            extratos.pre_carregar([nc['id_nc'] for nc in resposta])
+        except database.ConsultaCancelada:
+            pass # Substituída por uma pesquisa mais recente
         except Exception as ex:
-            self.handle_db_error(ex, "carregar NCs")
+            if self._carga_atual(geracao): self.handle_db_error(ex, "carregar NCs")
         finally:
-            self.progress_ring.visible = False
-            self.page.update()
+            if self._carga_atual(geracao):
+                self.progress_ring.visible = False
+                self.page.update()
         
+    def _atualizar_paginacao(self):
+        """Atualiza o texto 'Página X de Y' e o estado dos botões de navegação."""
+        if self.TAMANHO_PAGINA_NCS is None: return
+        pagina_atual = len(self._inicios_paginas)
+        total_paginas = max(1, -(-self._total_ncs // self.TAMANHO_PAGINA_NCS))
+        self.txt_paginacao.value = f"Página {pagina_atual} de {total_paginas} ({self._total_ncs} NCs)"
+        self.btn_pagina_anterior.disabled = pagina_atual <= 1
+        self.btn_pagina_seguinte.disabled = self._chave_fim_pagina is None
+
     def open_add_modal(self, e):
         print("A abrir modal de ADIÇÃO...")
         self.id_sendo_editado = None 
@@ -717,7 +1141,8 @@ class NcsView(ft.Column):
                 self.add_distribuicao_row(
                     e=None, 
                     secao_id=dist.get('id_secao'), 
-                    valor=dist.get('valor_alocado')
+                    valor=dist.get('valor_alocado'),
+                    id_distribuicao=dist.get('id')
                 )
         else:
             # Caso não existam seções (NCs legadas), abre uma linha padrão vazia
@@ -733,6 +1158,7 @@ class NcsView(ft.Column):
         self.id_sendo_editado = None 
         self.page.update()
 
+    @notificacoes.da_sessao
     def save_nc(self, e):
         """Salva NC e Distribuições garantindo que a soma não ultrapasse o total."""
         try:
@@ -752,7 +1178,12 @@ class NcsView(ft.Column):
                 
                 if id_secao and v_float > 0:
                     soma_distribuicoes += v_float
-                    distribuicoes_para_salvar.append((id_secao, v_float))
+                    distribuicoes_para_salvar.append((row.data, id_secao, v_float))
+
+            secoes = [int(d[1]) for d in distribuicoes_para_salvar]
+            if len(set(secoes)) != len(secoes):
+                self.show_error("Erro: Cada seção só pode aparecer uma vez nas distribuições da NC.")
+                return
 
             # TRAVA DE SEGURANÇA
             if round(soma_distribuicoes, 2) > round(val_ini_total, 2):
@@ -769,35 +1200,31 @@ class NcsView(ft.Column):
             )
 
             # 3. Transação Única: Garante que ou salva tudo ou não salva nada
+            campos = ('numero_nc', 'data_recebimento', 'data_validade', 'valor_inicial', 'ptres',
+                      'nd', 'fonte', 'pi', 'ug_gestora', 'observacao')
+            params = dict(zip(campos, dados_nc))
             if self.id_sendo_editado is None:
-                # Nova NC
-                sql_ins = """INSERT INTO notas_de_credito 
-                             (numero_nc, data_recebimento, data_validade_empenho, valor_inicial, ptres, natureza_despesa, fonte, pi, ug_gestora, observacao) 
-                             VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) RETURNING id"""
-                res = database.execute_query(sql_ins, dados_nc)
+                # Nova NC: cabeçalho e distribuições numa só instrução (uma ida ao banco)
+                params.update(inserir_secoes=[int(d[1]) for d in distribuicoes_para_salvar],
+                              inserir_valores=[d[2] for d in distribuicoes_para_salvar])
+                res = database.execute_query(SQL_INSERIR_NC_DISTRIBUICOES, params)
                 nc_id = res[0]['id']
-                queries = []
             else:
-                # Edição: Limpa distribuições antigas e atualiza a NC
+                # Edição: só as distribuições que mudaram são escritas (as outras mantêm o id e as NEs)
                 nc_id = self.id_sendo_editado
-                queries = [
-                    ("UPDATE notas_de_credito SET numero_nc=%s, data_recebimento=%s, data_validade_empenho=%s, valor_inicial=%s, ptres=%s, natureza_despesa=%s, fonte=%s, pi=%s, ug_gestora=%s, observacao=%s WHERE id=%s", 
-                     dados_nc + (nc_id,)),
-                    ("DELETE FROM distribuicao_nc_secoes WHERE id_nc = %s", (nc_id,))
-                ]
-
-            # Adiciona as novas distribuições à transação
-            for sid, v_alocado in distribuicoes_para_salvar:
-                queries.append(("INSERT INTO distribuicao_nc_secoes (id_nc, id_secao, valor_alocado) VALUES (%s,%s,%s)", 
-                                (nc_id, sid, v_alocado)))
-
-            if queries:
-                database.execute_transaction(queries)
+                params['id_nc'] = nc_id
+                try:
+                    atualizar_nc(params, (self.nc_em_edicao or {}).get('distribuicao_nc_secoes'),
+                                 distribuicoes_para_salvar)
+                except NcAlteradaError as ex:
+                    self.show_error(f"{ex}\nNada foi gravado: feche o formulário e abra a NC novamente.")
+                    self.load_ncs_data(pagina="atual")
+                    return
+            extratos.invalidar_nc(nc_id)
 
             self.show_success_snackbar("Nota de Crédito e distribuições salvas com sucesso!")
             self.close_modal(None)
             self.load_ncs_data()
-            if self.on_data_changed_callback: self.on_data_changed_callback(None)
 
         except Exception as ex:
             self.handle_db_error(ex, "salvar NC")
@@ -893,6 +1320,7 @@ class NcsView(ft.Column):
         self.id_nc_para_recolhimento = None 
         self.page.update()
 
+    @notificacoes.da_sessao
     def save_recolhimento(self, e):
         """Salva o recolhimento apenas se houver saldo suficiente na cota."""
         if not self.id_nc_para_recolhimento: return
@@ -912,31 +1340,21 @@ class NcsView(ft.Column):
                 return
 
             # --- VALIDAÇÃO DE SALDO (CRÍTICA) ---
-            # Calcula quanto a seção tem AGORA: (Alocado - Empenhado - Recolhido)
-            sql_saldo = """
-                SELECT d.valor_alocado - 
-                       COALESCE((SELECT SUM(valor_empenhado) FROM notas_de_empenho WHERE id_distribuicao = d.id), 0) -
-                       COALESCE((SELECT SUM(valor_recolhido) FROM recolhimentos_de_saldo WHERE id_distribuicao = d.id), 0) as saldo_real
-                FROM distribuicao_nc_secoes d
-                WHERE d.id = %s
-            """
-            res = database.execute_query(sql_saldo, (id_distribuicao,))
-            saldo_atual = float(res[0]['saldo_real']) if res else 0.0
-
-            if valor_recolhimento > round(saldo_atual, 2):
-                self.show_error(f"Saldo insuficiente na cota selecionada!\nSaldo Atual: {self.formatar_moeda(saldo_atual)}\nTentativa: {self.formatar_moeda(valor_recolhimento)}")
+            # TÉCNICO: Validação e gravação atómicas (cota bloqueada), numa única ida ao banco.
+            try:
+                _, novo_saldo = saldos.recolher_saldo(
+                    self.id_nc_para_recolhimento, id_distribuicao, valor_recolhimento,
+                    self.modal_rec_data.value, self.modal_rec_descricao.value
+                )
+            except saldos.SaldoInsuficienteError as ex:
+                self.show_error(f"Saldo insuficiente na cota selecionada!\nSaldo Atual: {self.formatar_moeda(ex.saldo_disponivel)}\nTentativa: {self.formatar_moeda(valor_recolhimento)}")
                 return
             # ------------------------------------
-
-            sql = "INSERT INTO recolhimentos_de_saldo (id_nc, id_distribuicao, data_recolhimento, valor_recolhido, descricao) VALUES (%s, %s, %s, %s, %s)"
-            params = (self.id_nc_para_recolhimento, id_distribuicao, self.modal_rec_data.value, valor_recolhimento, self.modal_rec_descricao.value)
-            
-            database.execute_query(sql, params)
+            extratos.invalidar_nc(self.id_nc_para_recolhimento)
             
-            self.show_success_snackbar("Saldo recolhido com sucesso!")
+            self.show_success_snackbar(f"Saldo recolhido com sucesso! Novo saldo da cota: {self.formatar_moeda(novo_saldo)}")
             self.close_recolhimento_modal(None)
-            self.load_ncs_data()
-            if self.on_data_changed_callback: self.on_data_changed_callback(None)
+            self.load_ncs_data(pagina="atual")
             
         except Exception as ex:
             self.handle_db_error(ex, "salvar recolhimento")
@@ -957,6 +1375,7 @@ class NcsView(ft.Column):
         self.confirm_delete_nc_dialog.open = False
         self.page.update()
 
+    @notificacoes.da_sessao
     def confirm_delete_nc(self, e):
         """Exclui a NC e define o utilizador para o log de auditoria."""
         id_para_excluir = self.confirm_delete_nc_dialog.data
@@ -964,34 +1383,48 @@ class NcsView(ft.Column):
         try:
             database.registrar_log(user_atual.get('id'), "EXCLUIR_NC", "notas_de_credito", id_para_excluir, "NC removida")
             database.execute_query("DELETE FROM notas_de_credito WHERE id = %s", (id_para_excluir,))
+            extratos.invalidar_nc(id_para_excluir)
             self.show_success_snackbar("NC excluída com sucesso.")
             self.close_confirm_delete_nc(None)
             self.load_ncs_data() # ATUALIZA A TABELA IMEDIATAMENTE
-            if self.on_data_changed_callback: self.on_data_changed_callback(None)
         except Exception as ex:
             self.handle_db_error(ex, "excluir NC")
             
     def on_file_picker_result(self, e: ft.ControlEvent):
         if not e.files: return
-        file_name = e.files[0].name
+        ficheiros = e.files if self.modo_importacao == "lote" else e.files[:1]
         try:
-            upload_url = self.page.get_upload_url(file_name, 120) 
             # Deixe sem o parâmetro method="POST" para usar o padrão do servidor interno
-            self.file_picker_import.upload([ft.FilePickerUploadFile(file_name, upload_url)])
+            uploads = [ft.FilePickerUploadFile(f.name, self.page.get_upload_url(f.name, 120)) for f in ficheiros]
+            if self.modo_importacao == "lote":
+                with self._lote_lock:
+                    self._lote_pendentes = {f.name for f in ficheiros}
+                    self._lote_total = len(ficheiros)
+                    self._lote_ficheiros = []
+                    self._lote_registos = []
+                self._mostrar_estado_importacao(f"A enviar lote: 0/{len(ficheiros)} ficheiros")
+            self.file_picker_import.upload(uploads)
             self.progress_ring.visible = True
             self.page.update()
         except Exception as ex: self.show_error(f"Erro: {ex}")
 
     def on_upload_progress(self, e: ft.ControlEvent):
         """Acompanha o progresso do upload (Versão Segura)."""
+        if self.modo_importacao == "lote":
+            if e.error:
+                self._registar_upload_lote(e.file_name, erro=e.error)
+            elif e.progress >= 1.0:
+                self._registar_upload_lote(e.file_name, caminho=os.path.join("uploads", e.file_name))
+            return
+
         if e.error:
             print(f"on_upload_progress: ERRO: {e.error}")
             self.show_error(f"Erro durante o upload: {e.error}")
-            self.progress_ring.visible = False
-            self.page.update()
+            self._mostrar_estado_importacao(None)
             return
             
         if e.progress < 1.0:
+            self._mostrar_estado_importacao(f"A enviar {e.file_name}... {int(e.progress * 100)}%")
             return
 
         print("on_upload_progress: Upload 100% concluído.")
@@ -1005,100 +1438,191 @@ class NcsView(ft.Column):
             if not os.path.exists(file_path_no_servidor):
                 print(f"Erro: O caminho '{file_path_no_servidor}' não existe no servidor.")
                 self.show_error(f"Erro: Ficheiro não encontrado no servidor após upload.")
+                self._mostrar_estado_importacao(None)
                 return
 
-            dados_extraidos = self._parse_siafi_pdf(file_path_no_servidor) 
-            
-            if dados_extraidos:
-                print("Dados extraídos com sucesso.")
-                self.preencher_modal_com_dados(dados_extraidos)
-            else:
-                self.show_error("Não foi possível extrair dados do PDF. Verifique o console.")
+            # TÉCNICO: O upload é lido uma única vez para memória e apagado de 'uploads/'; o parser
+            # recebe os bytes. A leitura do PDF corre num processo do pdf_pool, o evento Flet
+            # termina já e o modal é preenchido em _on_pdf_processado quando o trabalho acabar.
+            conteudo = retencao.ler_e_apagar(file_path_no_servidor)
+            trabalho = ler_pdf_siafi(conteudo, nome=file_name)
+            self._mostrar_estado_importacao(f"A ler {file_name}...")
+            trabalho.ao_terminar(self._on_pdf_processado)
                 
         except Exception as ex:
             print(f"Erro ao processar o PDF pós-upload: {ex}")
             traceback.print_exc()
             self.show_error(f"Erro ao ler o ficheiro PDF: {ex}")
-        
-        finally: 
-            self.progress_ring.visible = False
-            self.page.update()
+            self._mostrar_estado_importacao(None)
 
-    def _parse_siafi_pdf(self, file_path_or_object): 
-        """
-        Versão Adaptada v2.0: Suporte ao novo layout SIAFI (Rótulos Empilhados).
-        Processa o texto extraído para capturar dados orçamentários e prazos.
-        """
-        texto_completo = ""
+    def _on_pdf_processado(self, trabalho):
+        """Chamado (numa thread de apoio) quando o pdf_pool termina a leitura de um PDF."""
         try:
-            with pdfplumber.open(file_path_or_object) as pdf:
-                # x_tolerance=5 ajuda a manter palavras de colunas diferentes separadas
-                texto_completo = pdf.pages[0].extract_text(layout=True, x_tolerance=5)
-        except Exception as e:
-            print(f"Erro na leitura física do PDF: {e}")
-            return None
-
-        if not texto_completo: return None
-        
-        dados_nc = {}
-
-        # --- FUNÇÕES AUXILIARES DE TRATAMENTO ---
-        def limpar(txt): return re.sub(r'\s+', ' ', txt.strip()) if txt else ""
-
-        def formatar_data_br_para_iso(data_str):
-            if not data_str: return None
-            # Tenta 04/02/2026 -> 2026-02-04
-            match = re.search(r'(\d{2})/(\d{2})/(\d{4})', data_str)
-            if match: return f"{match.group(3)}-{match.group(2)}-{match.group(1)}"
-            return None
-
-        # --- 1. CAPTURA DO NÚMERO DA NC (ANO + NÚMERO) ---
-        ano = re.search(r'Ano:\s+(\d{4})', texto_completo)
-        num = re.search(r'crédito:\s+(\d+)', texto_completo)
-        if ano and num:
-            dados_nc['numero_nc'] = f"{ano.group(1)}NC{num.group(1).zfill(6)}"
-        
-        # --- 2. CAPTURA DA DATA DE EMISSÃO ---
-        data_emissao = re.search(r'Emissão:\s+(\d{2}/\d{2}/\d{4})', texto_completo)
-        if data_emissao:
-            dados_nc['data_recebimento'] = formatar_data_br_para_iso(data_emissao.group(1))
-
-        # --- 3. CAPTURA DA TABELA FINANCEIRA (ORIGEM/DESTINO) ---
-        # Padrão: Index PTRES(6) Fonte(10) ND(6) UG(6) PI(S+) Valor
-        # Usamos [\S\s]+? para lidar com quebras de linha entre os cabeçalhos e os dados
-        padrao_tabela = r'(\d+)\s+(\d{6})\s+(\d{10})\s+(\d{6})\s+(\d{6}|\d{3}\*{3})\s+(\S+)\s+([\d.,]+)'
-        match_fin = re.search(padrao_tabela, texto_completo)
-        
-        if match_fin:
-            dados_nc['ptres'] = match_fin.group(2)
-            dados_nc['fonte'] = match_fin.group(3)
-            dados_nc['nd']    = match_fin.group(4)
-            dados_nc['ug_gestora'] = match_fin.group(5).replace('*', '0') # Ajuste para UGs censuradas
-            dados_nc['pi']    = match_fin.group(6)
-            dados_nc['valor_inicial'] = match_fin.group(7)
-
-        # --- 4. OBSERVAÇÃO E PRAZO DE EMPENHO ---
-        obs_match = re.search(r'Descrição:(.*?)(?:Itens de Contabilização|$)', texto_completo, re.DOTALL | re.IGNORECASE)
-        if obs_match:
-            texto_obs = limpar(obs_match.group(1))
-            dados_nc['observacao'] = texto_obs
-            
-            # Busca Prazo no formato: 27 FEV 26
-            meses_map = {'JAN': '01', 'FEV': '02', 'MAR': '03', 'ABR': '04', 'MAI': '05', 'JUN': '06', 
-                         'JUL': '07', 'AGO': '08', 'SET': '09', 'OUT': '10', 'NOV': '11', 'DEZ': '12'}
-            
-            prazo_regex = r'PRAZO DE EMPENHO\s+(\d{1,2})\s+([A-Z]{3})\s+(\d{2,4})'
-            m_prazo = re.search(prazo_regex, texto_obs, re.IGNORECASE)
-            
-            if m_prazo:
-                dia = m_prazo.group(1).zfill(2)
-                mes = meses_map.get(m_prazo.group(2).upper())
-                ano_p = m_prazo.group(3)
-                ano_full = f"20{ano_p}" if len(ano_p) == 2 else ano_p
-                if mes:
-                    dados_nc['data_validade'] = f"{ano_full}-{mes}-{dia}"
+            if trabalho.erro:
+                print(f"Erro ao processar o PDF '{trabalho.nome}': {trabalho.erro}")
+                self.show_error(f"Erro ao ler o ficheiro PDF: {trabalho.erro}")
+            elif trabalho.dados:
+                print("Dados extraídos com sucesso.")
+                self.preencher_modal_com_dados(trabalho.dados)
+                # Avisa logo no modal se a NC já existe, antes de o utilizador tentar gravar.
+                numero = (trabalho.dados.get('numero_nc') or "").upper()
+                if numero and numero in numeros_nc_existentes([numero]):
+                    self.modal_txt_numero_nc.error_text = "Esta NC já está cadastrada no sistema."
+                    self.page.update()
+            else:
+                self.show_error("Não foi possível extrair dados do PDF. Verifique o console.")
+        finally:
+            self._mostrar_estado_importacao(None)
+
+    def _registar_upload_lote(self, file_name, caminho=None, erro=None):
+        """Conta os ficheiros do lote que terminaram o upload; o último arranca o processamento."""
+        with self._lote_lock:
+            if file_name not in self._lote_pendentes: return  # evento repetido
+            self._lote_pendentes.discard(file_name)
+            if erro:
+                self._lote_registos.append({"ficheiro": file_name, "dados": {}, "erros": [f"Falha no upload: {erro}"]})
+            elif not os.path.exists(caminho):
+                self._lote_registos.append({"ficheiro": file_name, "dados": {}, "erros": ["Ficheiro não encontrado no servidor após upload."]})
+            else:
+                self._lote_ficheiros.append((file_name, retencao.ler_e_apagar(caminho)))
+            recebidos = self._lote_total - len(self._lote_pendentes)
+            terminou = not self._lote_pendentes
+            ficheiros, registos = list(self._lote_ficheiros), list(self._lote_registos)
+
+        self._mostrar_estado_importacao(f"A enviar lote: {recebidos}/{self._lote_total} ficheiros")
+        if terminou:
+            # TÉCNICO: Esperar pelos PDFs bloqueia; corre numa thread para não prender o evento Flet.
+            threading.Thread(target=self._processar_lote, args=(ficheiros, registos), daemon=True).start()
+
+    def _processar_lote(self, ficheiros, registos):
+        """Lê todos os PDFs do lote em paralelo (pdf_pool), valida e abre a grelha de revisão."""
+        try:
+            itens, avisos = expandir_ficheiros_lote(ficheiros)
+            for nome, aviso in avisos:
+                registos.append({"ficheiro": nome, "dados": {}, "erros": [aviso]})
+
+            self._mostrar_estado_importacao(f"A ler PDFs do lote: 0/{len(itens)}")
+            trabalhos = []
+            for nome, origem in itens:
+                try:
+                    # Com dezenas de PDFs a fila do pool enche: aqui espera-se por vaga em vez de falhar.
+                    trabalhos.append(ler_pdf_siafi(origem, nome=nome, aguardar_vaga=True))
+                except Exception as ex:
+                    registos.append({"ficheiro": nome, "dados": {}, "erros": [str(ex)]})
+
+            for i, trabalho in enumerate(trabalhos, start=1):
+                try:
+                    dados = trabalho.resultado()
+                    registos.append({"ficheiro": trabalho.nome, "dados": dados or {}, "erros": validar_dados_siafi(dados)})
+                except Exception as ex:
+                    registos.append({"ficheiro": trabalho.nome, "dados": {}, "erros": [f"Erro ao ler o PDF: {ex}"]})
+                self._mostrar_estado_importacao(f"A ler PDFs do lote: {i}/{len(trabalhos)}")
+
+            self._marcar_duplicadas_lote(registos)
+            self.open_lote_modal(registos)
+        except Exception as ex:
+            print(f"Erro ao processar o lote: {ex}")
+            traceback.print_exc()
+            self.handle_db_error(ex, "processar o lote de PDFs")
+        finally:
+            self._mostrar_estado_importacao(None)
+
+    def _marcar_duplicadas_lote(self, registos):
+        """Marca NCs repetidas dentro do lote e NCs que já existem no banco."""
+        validos = [r for r in registos if not r["erros"]]
+        existentes = numeros_nc_existentes({r["dados"]["numero_nc"] for r in validos})
+        vistos = set()
+        for r in validos:
+            numero = r["dados"]["numero_nc"]
+            if numero in existentes:
+                r["erros"].append("NC já cadastrada no sistema.")
+            elif numero in vistos:
+                r["erros"].append("NC repetida neste lote.")
+            vistos.add(numero)
+
+    def open_lote_modal(self, registos):
+        self._lote_registos = sorted(registos, key=lambda r: (bool(r["erros"]), r["ficheiro"]))
+        linhas = []
+        for registo in self._lote_registos:
+            d, erros = registo["dados"], registo["erros"]
+            valor = converter_valor_siafi(d.get('valor_inicial'))
+            linhas.append(ft.DataRow(cells=[
+                ft.DataCell(ft.Checkbox(value=not erros, disabled=bool(erros), on_change=self._atualizar_resumo_lote)),
+                ft.DataCell(ft.Text(registo["ficheiro"], size=12)),
+                ft.DataCell(ft.Text(d.get('numero_nc', "-"))),
+                ft.DataCell(ft.Text(self.formatar_moeda(valor) if valor is not None else "-")),
+                ft.DataCell(ft.Text(d.get('pi', "-"))),
+                ft.DataCell(ft.Text(d.get('nd', "-"))),
+                ft.DataCell(ft.Text(d.get('ptres', "-"))),
+                ft.DataCell(ft.Text(d.get('fonte', "-"))),
+                ft.DataCell(ft.Text(d.get('ug_gestora', "-"))),
+                ft.DataCell(ft.Text(d.get('data_recebimento') or "-")),
+                ft.DataCell(ft.Text(d.get('data_validade') or "-")),
+                ft.DataCell(ft.Text(" ".join(erros) if erros else "OK", color="red" if erros else "green", size=12)),
+            ]))
+        self.lote_tabela.rows = linhas
+        self.modal_lote_loading_ring.visible = False
+        self._atualizar_resumo_lote(None, atualizar_pagina=False)
+        self.lote_modal.open = True
+        self.page.update()
 
-        return dados_nc
+    def _lote_selecionados(self):
+        return [r for r, linha in zip(self._lote_registos, self.lote_tabela.rows)
+                if linha.cells[0].content.value and not r["erros"]]
+
+    def _atualizar_resumo_lote(self, e, atualizar_pagina=True):
+        com_erro = sum(1 for r in self._lote_registos if r["erros"])
+        selecionados = len(self._lote_selecionados())
+        self.lote_resumo.value = (f"{len(self._lote_registos)} ficheiro(s) lido(s): {com_erro} com erro(s), "
+                                  f"{selecionados} selecionado(s) para gravar.")
+        self.modal_lote_btn_salvar.disabled = selecionados == 0
+        if atualizar_pagina: self.page.update()
+
+    def close_lote_modal(self, e):
+        self.lote_modal.open = False
+        self._lote_registos = []
+        self.lote_tabela.rows = []
+        self.page.update()
+
+    @notificacoes.da_sessao
+    def save_lote(self, e):
+        """Grava todas as NCs selecionadas numa única transação (ou grava todas ou nenhuma)."""
+        selecionados = self._lote_selecionados()
+        if not selecionados: return
+        self.modal_lote_loading_ring.visible = True
+        self.modal_lote_btn_salvar.disabled = True
+        self.page.update()
+        try:
+            linhas = []
+            for r in selecionados:
+                d = r["dados"]
+                linhas.append((
+                    d['numero_nc'], d['data_recebimento'], d.get('data_validade'), converter_valor_siafi(d['valor_inicial']),
+                    d['ptres'], d['nd'], d['fonte'], d['pi'], d['ug_gestora'], d.get('observacao', "")
+                ))
+            database.execute_batch(SQL_INSERIR_NCS_LOTE, linhas)
+
+            user = self.page.session.get("user")
+            numeros = ", ".join(r["dados"]['numero_nc'] for r in selecionados)
+            database.registrar_log(user['id'] if user else None, "IMPORTAR_LOTE_NC", "notas_de_credito", None,
+                                   f"{len(selecionados)} NC(s) importada(s): {numeros}")
+
+            self.show_success_snackbar(f"{len(selecionados)} Nota(s) de Crédito importada(s) com sucesso!")
+            self.close_lote_modal(None)
+            self.load_ncs_data()
+        except Exception as ex:
+            self.handle_db_error(ex, "gravar o lote de NCs")
+        finally:
+            self.modal_lote_loading_ring.visible = False
+            self.modal_lote_btn_salvar.disabled = False
+            self.page.update()
+
+    def _mostrar_estado_importacao(self, mensagem):
+        """Mostra (ou esconde, com None) o estado da importação ao lado dos botões."""
+        self.txt_estado_importacao.value = mensagem or ""
+        self.txt_estado_importacao.visible = bool(mensagem)
+        self.progress_ring.visible = bool(mensagem)
+        self.page.update()
 
     def preencher_modal_com_dados(self, dados_nc):
         self.open_add_modal(None)
@@ -1136,8 +1660,11 @@ class NcsView(ft.Column):
         if dados_nc.get('observacao'):
             self.modal_txt_observacao.value = dados_nc['observacao']
 
-    def add_distribuicao_row(self, e=None, secao_id=None, valor=None):
-        """Cria uma linha com: [Dropdown Seção] [Campo Valor] [Botão Lixo]"""
+    def add_distribuicao_row(self, e=None, secao_id=None, valor=None, id_distribuicao=None):
+        """
+        Cria uma linha com: [Dropdown Seção] [Campo Valor] [Botão Lixo]
+        Na edição, a linha guarda em 'data' o id da distribuição gravada (None = nova).
+        """
         
         # 1. Cria o seletor de seção usando as seções que já temos no cache
         dd_secao = ft.Dropdown(
@@ -1165,7 +1692,7 @@ class NcsView(ft.Column):
         )
 
         # Junta tudo numa linha (Row)
-        row_container = ft.Row([dd_secao, txt_valor, btn_remove], alignment="start")
+        row_container = ft.Row([dd_secao, txt_valor, btn_remove], alignment="start", data=id_distribuicao)
         
         # Adiciona à nossa lista vertical
         self.distribuicoes_list.controls.append(row_container)
@@ -1180,8 +1707,8 @@ class NcsView(ft.Column):
         self.page.update()
                  
 # --- Função de Nível Superior (Obrigatória) ---
-def create_ncs_view(page: ft.Page, on_data_changed=None, error_modal=None): 
+def create_ncs_view(page: ft.Page, error_modal=None): 
     """
     Exporta a nossa NcsView como um controlo Flet padrão.
     """
-    return NcsView(page, on_data_changed=on_data_changed, error_modal=error_modal)
\ No newline at end of file
+    return NcsView(page, error_modal=error_modal)
\ No newline at end of file
@@ -7,17 +7,28 @@ from datetime import datetime
 import traceback 
 # TÉCNICO: Importa o banco local PostgreSQL 17
 import database 
+import extratos
+import saldos
+import referencias
+import notificacoes
+
+# TÉCNICO: Consultas de filtros repetidas a cada carga, preparadas uma vez por conexão.
+CONSULTA_PIS = database.preparar("SELECT DISTINCT pi FROM ncs_com_saldos ORDER BY pi", "pis_ncs_com_saldos", tabelas={"ncs_com_saldos"})
+CONSULTA_NDS = database.preparar("SELECT DISTINCT natureza_despesa FROM ncs_com_saldos ORDER BY natureza_despesa", "nds_ncs_com_saldos", tabelas={"ncs_com_saldos"})
 
 class NesView(ft.Column):
     """
     Representa o conteúdo da aba Notas de Empenho (CRUD).
     (v1.3) Corrige filtro e scroll.
     """
-    def __init__(self, page, on_data_changed=None, error_modal=None):
+    # Tabelas cujas alterações recarregam esta view quando está à vista (notificacoes.py) ou ao voltar a ela (main.py).
+    tabelas_dependentes = frozenset(database.DEPENDENCIAS_VIEWS["ncs_com_saldos"])
+
+    def __init__(self, page, error_modal=None):
         super().__init__()
         self.page = page
         self.id_ne_sendo_editada = None
-        self.on_data_changed_callback = on_data_changed
+        self.id_dist_original = None
         self.error_modal = error_modal 
         
         self.saldos_ncs_ativas = {}
@@ -255,11 +266,9 @@ class NesView(ft.Column):
     def load_secoes_filter(self):
         """Carrega todas as seções disponíveis para o filtro macro."""
         try:
-            sql = "SELECT id, nome FROM secoes ORDER BY nome"
-            res = database.execute_query(sql)
             self.filtro_secao.options = [ft.dropdown.Option(text="Todas as Seções", key="")]
-            for r in res:
-                self.filtro_secao.options.append(ft.dropdown.Option(text=r['nome'], key=str(r['id'])))
+            for id_secao, nome in referencias.secoes().items():
+                self.filtro_secao.options.append(ft.dropdown.Option(text=nome, key=str(id_secao)))
         except Exception as ex:
             print(f"Erro ao carregar seções: {ex}")
 
@@ -367,7 +376,7 @@ class NesView(ft.Column):
                 
             sql += " ORDER BY numero_nc"
             
-            resposta_ncs = database.execute_query(sql, tuple(params))
+            resposta_ncs = database.execute_query(sql, tuple(params), cache=True, tabelas={"ncs_com_saldos"})
             
             self.filtro_nc_vinculada.options = [ft.dropdown.Option(text="Todas as NCs", key="")]
             # Reseta a seleção atual se ela não existir mais na lista filtrada
@@ -388,13 +397,13 @@ class NesView(ft.Column):
         """Carrega PIs e NDs únicos presentes na view."""
         try:
             # PIs
-            pis = database.execute_query("SELECT DISTINCT pi FROM ncs_com_saldos ORDER BY pi")
+            pis = database.execute_preparada(CONSULTA_PIS, cache=True)
             self.filtro_pi.options = [ft.dropdown.Option(text="Todos os PIs", key="")]
             for row in pis:
                 if row['pi']: self.filtro_pi.options.append(ft.dropdown.Option(text=row['pi'], key=row['pi']))
             
             # NDs
-            nds = database.execute_query("SELECT DISTINCT natureza_despesa FROM ncs_com_saldos ORDER BY natureza_despesa")
+            nds = database.execute_preparada(CONSULTA_NDS, cache=True)
             self.filtro_nd.options = [ft.dropdown.Option(text="Todas as NDs", key="")]
             for row in nds:
                 if row['natureza_despesa']: self.filtro_nd.options.append(ft.dropdown.Option(text=row['natureza_despesa'], key=row['natureza_despesa']))
@@ -554,6 +563,7 @@ class NesView(ft.Column):
         print(f"A abrir modal de EDIÇÃO para NE: {ne['numero_ne']}")
         self.carregar_ncs_para_dropdown_modal() 
         self.id_ne_sendo_editada = ne['id']
+        self.id_dist_original = ne['id_distribuicao']
         self.modal_form.title = ft.Text(f"Editar NE: {ne['numero_ne']}")
         self.modal_form_btn_salvar.text = "Atualizar"
         self.modal_form_btn_salvar.icon = "UPDATE"
@@ -576,6 +586,7 @@ class NesView(ft.Column):
         self.id_ne_sendo_editada = None 
         self.page.update()
 
+    @notificacoes.da_sessao
     def save_ne(self, e):
         """Grava a NE validando se há saldo disponível na cota da seção."""
         try:
@@ -589,43 +600,34 @@ class NesView(ft.Column):
             valor_novo_empenho = float(v_raw.replace(".", "").replace(",", "."))
             numero_ne_completo = f"2026NE{self.modal_txt_numero_ne.value.strip()}"
 
-            # 2. Validação de Saldo (Gargalo 4)
-            # Busca o saldo atual da fatia na View
-            sql_check = "SELECT saldo_disponivel FROM ncs_com_saldos WHERE id_dist_row = %s"
-            res = database.execute_query(sql_check, (id_dist,))
-            saldo_atual = float(res[0]['saldo_disponivel']) if res else 0
-
-            # Se for edição, devolvemos o valor antigo ao saldo para validar o novo valor
-            if self.id_ne_sendo_editada:
-                res_ant = database.execute_query("SELECT valor_empenhado FROM notas_de_empenho WHERE id = %s", (self.id_ne_sendo_editada,))
-                valor_antigo = float(res_ant[0]['valor_empenhado']) if res_ant else 0
-                saldo_atual += valor_antigo
-
-            if valor_novo_empenho > round(saldo_atual, 2):
-                self.show_error_snackbar(f"Saldo Insuficiente! Disponível na seção: R$ {saldo_atual:,.2f}")
+            # 2. Validação de Saldo + Gravação (Gargalo 4)
+            # TÉCNICO: Uma só transação e ida ao banco: a cota fica bloqueada enquanto o saldo
+            # é calculado e a NE gravada, por isso dois empenhos simultâneos não passam ambos.
+            # Na edição, o valor antigo da NE volta ao saldo antes de validar o novo.
+            try:
+                saldos.empenhar(
+                    id_dist, numero_ne_completo, valor_novo_empenho,
+                    self.modal_txt_data_empenho.value, self.modal_txt_descricao.value,
+                    id_ne=self.id_ne_sendo_editada
+                )
+            except saldos.SaldoInsuficienteError as ex:
+                self.show_error_snackbar(f"Saldo Insuficiente! Disponível na seção: R$ {ex.saldo_disponivel:,.2f}")
+                return
+            except saldos.NeNaoEncontradaError:
+                self.show_error_snackbar("Esta NE foi excluída por outro utilizador. Nada foi gravado.")
+                self.close_modal(None)
+                self.load_nes_data()
                 return
 
-            # 3. Definição da variável 'dados' (Resolve o NameError)
-            dados = (
-                numero_ne_completo,
-                valor_novo_empenho,
-                id_dist,
-                self.modal_txt_data_empenho.value,
-                self.modal_txt_descricao.value
-            )
-
-            # 4. Execução no Banco
             if self.id_ne_sendo_editada:
-                sql = "UPDATE notas_de_empenho SET numero_ne=%s, valor_empenhado=%s, id_distribuicao=%s, data_empenho=%s, descricao=%s WHERE id=%s"
-                database.execute_query(sql, dados + (self.id_ne_sendo_editada,))
+                # A NE pode ter mudado de cota: os extratos das duas NCs ficam desatualizados.
+                extratos.invalidar_distribuicoes(id_dist, self.id_dist_original)
             else:
-                sql = "INSERT INTO notas_de_empenho (numero_ne, valor_empenhado, id_distribuicao, data_empenho, descricao) VALUES (%s,%s,%s,%s,%s)"
-                database.execute_query(sql, dados)
+                extratos.invalidar_distribuicoes(id_dist)
 
             self.show_success_snackbar("Nota de Empenho salva com sucesso!")
             self.close_modal(None)
             self.load_nes_data()
-            if self.on_data_changed_callback: self.on_data_changed_callback(None)
 
         except Exception as ex:
             self.handle_db_error(ex, "salvar NE")
@@ -642,12 +644,14 @@ class NesView(ft.Column):
         self.confirm_delete_dialog.open = False
         self.page.update()
 
+    @notificacoes.da_sessao
     def confirm_delete(self, e):
         """Exclui o empenho permanentemente do banco local (Sem Supabase)."""
         id_para_excluir = self.confirm_delete_dialog.data
         try:
             # Executa a exclusão direta no PostgreSQL local
-            database.execute_query("DELETE FROM notas_de_empenho WHERE id = %s", (id_para_excluir,))
+            res = database.execute_query("DELETE FROM notas_de_empenho WHERE id = %s RETURNING id_distribuicao", (id_para_excluir,))
+            extratos.invalidar_distribuicoes(*[r['id_distribuicao'] for r in res or []])
             
             # Feedback e atualização
             self.show_success_snackbar("Nota de Empenho excluída com sucesso.")
@@ -655,8 +659,6 @@ class NesView(ft.Column):
             self.load_nes_data()
             
             # Atualiza o Dashboard e a aba de NCs para liberar o saldo
-            if self.on_data_changed_callback: 
-                self.on_data_changed_callback(None)
                 
         except Exception as ex:
             self.handle_db_error(ex, "excluir NE")
@@ -672,8 +674,8 @@ class NesView(ft.Column):
         self.page.snack_bar.open = True
         self.page.update()
 
-def create_nes_view(page: ft.Page, on_data_changed=None, error_modal=None): 
+def create_nes_view(page: ft.Page, error_modal=None): 
     """
     Exporta a nossa NesView como um controlo Flet padrão.
     """
-    return NesView(page, on_data_changed=on_data_changed, error_modal=error_modal)
\ No newline at end of file
+    return NesView(page, error_modal=error_modal)
\ No newline at end of file
@@ -5,7 +5,32 @@ import traceback
 import io        
 import os        
 import uuid      
+from openpyxl import Workbook
 import database # TÉCNICO: Motor PostgreSQL 17 local
+import referencias
+
+# TÉCNICO: Consultas de filtros repetidas a cada carga, preparadas uma vez por conexão.
+CONSULTA_PIS = database.preparar("SELECT DISTINCT pi FROM ncs_com_saldos ORDER BY pi", "pis_ncs_com_saldos", tabelas={"ncs_com_saldos"})
+CONSULTA_NDS = database.preparar("SELECT DISTINCT natureza_despesa FROM ncs_com_saldos ORDER BY natureza_despesa", "nds_ncs_com_saldos", tabelas={"ncs_com_saldos"})
+CONSULTA_NDS_DO_PI = database.preparar("SELECT DISTINCT natureza_despesa FROM ncs_com_saldos WHERE pi = %s ORDER BY natureza_despesa", "nds_do_pi_ncs_com_saldos",
+                                       tabelas={"ncs_com_saldos"})
+
+# PDF Geral: uma linha por NC, com as suas seções já agregadas pelo PostgreSQL (json_agg).
+# TÉCNICO: O Python deixa de receber (e de agrupar num dicionário) uma linha por seção.
+# Os filtros são os mesmos do Excel e aplicam-se às linhas da view antes do agrupamento.
+SQL_RELATORIO_GERAL_POR_NC = """
+    SELECT id_nc, MAX(numero_nc) AS numero_nc, MAX(pi) AS pi, MAX(natureza_despesa) AS natureza_despesa,
+           MAX(valor_total_nc) AS valor_total_nc, MAX(saldo_disponivel_nc) AS saldo_disponivel_nc,
+           MAX(data_validade_empenho) AS data_validade_empenho, MAX(observacao) AS observacao,
+           MAX(status_calculado) AS status_calculado,
+           COALESCE(SUM(saldo_disponivel), 0) AS saldo_secoes,
+           json_agg(json_build_object('nome', nome_secao, 'val', valor_inicial, 'sal', saldo_disponivel)
+                    ORDER BY nome_secao) AS secoes
+    FROM ncs_com_saldos
+    WHERE 1=1 {filtros}
+    GROUP BY id_nc
+    ORDER BY MAX(data_recebimento) DESC, id_nc
+"""
 
 # Importações do ReportLab permanecem as mesmas para manter o layout dos PDFs
 from reportlab.lib.pagesizes import letter, landscape
@@ -21,6 +46,9 @@ class RelatoriosView(ft.Column):
     (v1.3) Adiciona scroll vertical.
     """
     
+    # Tabelas cujas alterações recarregam esta view quando está à vista (notificacoes.py) ou ao voltar a ela (main.py).
+    tabelas_dependentes = frozenset(database.DEPENDENCIAS_VIEWS["ncs_com_saldos"])
+
     def __init__(self, page, error_modal=None):
         super().__init__()
         self.page = page
@@ -226,21 +254,20 @@ class RelatoriosView(ft.Column):
             if pi_selecionado is None:
                 print("Relatórios: A carregar PIs e NDs do banco local...")
                 # TÉCNICO: SELECT DISTINCT nativo do Postgres
-                pis = database.execute_query("SELECT DISTINCT pi FROM ncs_com_saldos ORDER BY pi")
+                pis = database.execute_preparada(CONSULTA_PIS, cache=True)
                 self.filtro_pi.options = [ft.dropdown.Option(text="Todos os PIs", key=None)]
                 if pis:
                     for row in pis:
                         if row['pi']: self.filtro_pi.options.append(ft.dropdown.Option(text=row['pi'], key=row['pi']))
                 
-                nds = database.execute_query("SELECT DISTINCT natureza_despesa FROM ncs_com_saldos ORDER BY natureza_despesa")
+                nds = database.execute_preparada(CONSULTA_NDS, cache=True)
                 self.filtro_nd.options = [ft.dropdown.Option(text="Todas as NDs", key=None)]
                 if nds:
                     for row in nds:
                         if row['natureza_despesa']: self.filtro_nd.options.append(ft.dropdown.Option(text=row['natureza_despesa'], key=row['natureza_despesa']))
             else:
                 # Filtro dependente (NDs por PI)
-                sql = "SELECT DISTINCT natureza_despesa FROM ncs_com_saldos WHERE pi = %s ORDER BY natureza_despesa"
-                nds = database.execute_query(sql, (pi_selecionado,))
+                nds = database.execute_preparada(CONSULTA_NDS_DO_PI, (pi_selecionado,), cache=True)
                 self.filtro_nd.options = [ft.dropdown.Option(text="Todas as NDs", key=None)]
                 if nds:
                     for row in nds:
@@ -265,31 +292,39 @@ class RelatoriosView(ft.Column):
         self.load_filter_options(pi_selecionado=None)
         if self.page: self.page.update() 
         
-    def fetch_report_data_geral(self, e): 
-        """Busca dados no PostgreSQL 17 para o Relatório Geral."""
+    def fetch_report_data_geral(self, e, por_nc=False): 
+        """
+        Busca dados no PostgreSQL 17 para o Relatório Geral.
+        TÉCNICO: Devolve um gerador de lotes (database.execute_stream, cada lote uma
+        database.Tabela de tuplas), não a lista completa; o Excel e o PDF consomem-no lote a lote.
+        Com por_nc=True cada linha é uma NC com as suas seções (SQL_RELATORIO_GERAL_POR_NC).
+        """
         print("Relatórios: A buscar dados filtrados localmente...")
         try:
-            # TÉCNICO: Uso da view ncs_com_saldos para dados já calculados
-            sql = "SELECT * FROM ncs_com_saldos WHERE 1=1"
+            filtros = ""
             params = []
 
             if self.filtro_data_inicio.value:
-                sql += " AND data_recebimento >= %s"; params.append(self.filtro_data_inicio.value)
+                filtros += " AND data_recebimento >= %s"; params.append(self.filtro_data_inicio.value)
             if self.filtro_data_fim.value:
-                sql += " AND data_recebimento <= %s"; params.append(self.filtro_data_fim.value)
+                filtros += " AND data_recebimento <= %s"; params.append(self.filtro_data_fim.value)
             if self.filtro_status.value:
-                sql += " AND status_calculado = %s"; params.append(self.filtro_status.value)
+                filtros += " AND status_calculado = %s"; params.append(self.filtro_status.value)
             if self.filtro_pi.value:
-                sql += " AND pi = %s"; params.append(self.filtro_pi.value)
+                filtros += " AND pi = %s"; params.append(self.filtro_pi.value)
             if self.filtro_nd.value:
-                sql += " AND natureza_despesa = %s"; params.append(self.filtro_nd.value)
+                filtros += " AND natureza_despesa = %s"; params.append(self.filtro_nd.value)
 
-            sql += " ORDER BY data_recebimento DESC"
-            dados = database.execute_query(sql, tuple(params))
+            if por_nc:
+                sql = SQL_RELATORIO_GERAL_POR_NC.format(filtros=filtros)
+            else:
+                # TÉCNICO: Uso da view ncs_com_saldos para dados já calculados
+                sql = "SELECT * FROM ncs_com_saldos WHERE 1=1" + filtros + " ORDER BY data_recebimento DESC"
+            lotes = database.execute_stream(sql, tuple(params), tuplas=True)
+            primeiro_lote = next(lotes, None)
             
-            if dados: 
-                print(f"Relatórios: {len(dados)} registros encontrados.") 
-                return dados
+            if primeiro_lote: 
+                return self._lotes_desde(primeiro_lote, lotes)
             else: 
                 self.page.snack_bar = ft.SnackBar(ft.Text("Nenhum registro encontrado com estes filtros."), bgcolor="orange")
                 self.page.snack_bar.open = True
@@ -299,6 +334,12 @@ class RelatoriosView(ft.Column):
             self.handle_db_error(ex, "buscar dados do Relatório Geral") 
             return None
             
+    @staticmethod
+    def _lotes_desde(primeiro_lote, lotes):
+        # Gerador (e não itertools.chain) para que close() chegue ao cursor e devolva a conexão.
+        yield primeiro_lote
+        yield from lotes
+
     def fetch_report_data_extrato(self, nc_id):
         """Busca o histórico completo de uma NC, incluindo SEÇÕES e seus saldos."""
         if not nc_id: return None
@@ -357,16 +398,15 @@ class RelatoriosView(ft.Column):
         """Preenche o seletor de extrato com NCs do banco local."""
         print("Relatórios: A carregar lista de NCs para extrato...")
         try:
-            sql = "SELECT id, numero_nc FROM notas_de_credito ORDER BY numero_nc ASC"
-            resposta_ncs = database.execute_query(sql)
+            resposta_ncs = referencias.ncs()  # (id, numero_nc), partilhado pelo processo
 
             self.dropdown_nc_extrato.options = []
             if not resposta_ncs:
                  self.dropdown_nc_extrato.options.append(ft.dropdown.Option(text="Nenhuma NC encontrada", disabled=True))
             else:
-                for nc in resposta_ncs:
+                for id_nc, numero_nc in resposta_ncs:
                     self.dropdown_nc_extrato.options.append(
-                        ft.dropdown.Option(key=str(nc['id']), text=nc['numero_nc'])
+                        ft.dropdown.Option(key=str(id_nc), text=numero_nc)
                     )
 
             if self.page: self.update() 
@@ -386,8 +426,6 @@ class RelatoriosView(ft.Column):
             self.dados_relatorio_para_salvar = dados_para_gerar
             self.tipo_ficheiro_a_salvar = tipo_relatorio
             
-            file_bytes = self._gerar_bytes_do_relatorio()
-            
             extensao = "xlsx" if "excel" in tipo_relatorio else "pdf"
             nome_unico = f"{nome_base}_{uuid.uuid4()}.{extensao}"
             
@@ -395,9 +433,14 @@ class RelatoriosView(ft.Column):
                 os.makedirs("assets")
             caminho_servidor = os.path.join("assets", nome_unico)
             
+            # TÉCNICO: O relatório é escrito diretamente no ficheiro (sem cópia em memória).
             print(f"A salvar ficheiro público em: {caminho_servidor}")
-            with open(caminho_servidor, "wb") as f:
-                f.write(file_bytes)
+            try:
+                with open(caminho_servidor, "wb") as f:
+                    self._gerar_relatorio(f)
+            except Exception:
+                if os.path.exists(caminho_servidor): os.remove(caminho_servidor)
+                raise
                 
             url_download = f"/{nome_unico}" # URL relativa para 'assets/'
             
@@ -413,6 +456,8 @@ class RelatoriosView(ft.Column):
             self.show_error(f"Erro ao gerar relatório: {e}")
         
         finally:
+            fechar = getattr(self.dados_relatorio_para_salvar, "close", None)
+            if fechar: fechar()  # devolve a conexão do execute_stream, mesmo sem ter lido tudo
             self.dados_relatorio_para_salvar = None
             self.tipo_ficheiro_a_salvar = None
             self.progress_ring.visible = False
@@ -429,7 +474,7 @@ class RelatoriosView(ft.Column):
             )
 
     def gerar_relatorio_geral_pdf(self, e):
-        dados = self.fetch_report_data_geral(e)
+        dados = self.fetch_report_data_geral(e, por_nc=True)
         if dados:
             self._executar_download(
                 tipo_relatorio="pdf_geral",
@@ -474,14 +519,15 @@ class RelatoriosView(ft.Column):
                 button_control_to_update=self.download_button_extrato
             )
 
-    def _gerar_bytes_do_relatorio(self):
+    def _gerar_relatorio(self, destino):
+        """Escreve o relatório pedido no ficheiro 'destino' (aberto em modo binário)."""
         tipo = self.tipo_ficheiro_a_salvar
         dados = self.dados_relatorio_para_salvar
         
         if not tipo or not dados:
             raise Exception("Dados ou tipo de relatório em falta.")
 
-        print(f"A gerar bytes PRO (v5 - Dashboard Layout) para: {tipo}")
+        print(f"A gerar relatório PRO (v5 - Dashboard Layout) para: {tipo}")
 
         # --- FUNÇÕES AUXILIARES ---
         def formatar_data_segura(valor):
@@ -559,211 +605,208 @@ class RelatoriosView(ft.Column):
         try:
             # === EXCEL GERAL (Mantido) ===
             if tipo == "excel_geral":
-                df = pd.DataFrame(dados)
-                df = df.rename(columns={ 
-                    'numero_nc': 'Número NC', 'nome_secao': 'Seção', 'pi': 'PI', 'natureza_despesa': 'ND', 
-                    'status_calculado': 'Status', 'valor_inicial': 'Valor Cota', 'saldo_disponivel': 'Saldo Cota',
-                    'valor_total_nc': 'Valor Total NC', 'saldo_disponivel_nc': 'Saldo Total NC',
-                    'data_validade_empenho': 'Prazo', 'ug_gestora': 'UG', 'data_recebimento': 'Recebimento', 'observacao': 'Obs' 
-                })
-                colunas_visiveis = ['Número NC', 'Seção', 'PI', 'ND', 'Status', 'Valor Total NC', 'Saldo Total NC', 'Valor Cota', 'Saldo Cota', 'Prazo', 'Recebimento', 'Obs']
-                for col in colunas_visiveis:
-                    if col not in df.columns: df[col] = ""
-                df = df[colunas_visiveis]
-                for col_data in ['Recebimento', 'Prazo']:
-                    if col_data in df.columns: df[col_data] = pd.to_datetime(df[col_data], errors='coerce').dt.strftime('%d/%m/%Y')
-                for col in ['Valor Total NC', 'Saldo Total NC', 'Valor Cota', 'Saldo Cota']:
-                    if col in df.columns: df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-
-                with io.BytesIO() as file_in_memory:
-                    df.to_excel(file_in_memory, index=False, engine='openpyxl')
-                    return file_in_memory.getvalue()
+                # TÉCNICO: openpyxl em modo write_only grava cada linha no ficheiro assim que é
+                # acrescentada; com os lotes do execute_stream a memória não cresce com o relatório.
+                colunas = [ # (cabeçalho, coluna da view, formato)
+                    ('Número NC', 'numero_nc', None), ('Seção', 'nome_secao', None), ('PI', 'pi', None),
+                    ('ND', 'natureza_despesa', None), ('Status', 'status_calculado', None),
+                    ('Valor Total NC', 'valor_total_nc', float), ('Saldo Total NC', 'saldo_disponivel_nc', float),
+                    ('Valor Cota', 'valor_inicial', float), ('Saldo Cota', 'saldo_disponivel', float),
+                    ('Prazo', 'data_validade_empenho', formatar_data_segura), ('Recebimento', 'data_recebimento', formatar_data_segura),
+                    ('Obs', 'observacao', None),
+                ]
+
+                def celula(item, pos, coluna, formato):
+                    valor = item[pos[coluna]] if coluna in pos else None
+                    if formato is float:
+                        try: return float(valor or 0)
+                        except (TypeError, ValueError): return 0.0
+                    if formato: return formato(valor) or None
+                    return "" if valor is None else valor
+
+                wb = Workbook(write_only=True)
+                ws = wb.create_sheet()
+                ws.append([c[0] for c in colunas])
+                for lote in dados:
+                    pos = lote.indice()
+                    for item in lote:
+                        ws.append([celula(item, pos, coluna, formato) for _, coluna, formato in colunas])
+                wb.save(destino)
 
             # === PDF GERAL (NOVO LAYOUT DE DUAS COLUNAS NO TOPO) ===
             # === PDF GERAL (ATUALIZADO V6 - Filtros de Zeros + Detalhe NC na Direita) ===
             elif tipo == "pdf_geral":
-                with io.BytesIO() as file_in_memory:
-                    doc = SimpleDocTemplate(file_in_memory, pagesize=landscape(letter), topMargin=70, bottomMargin=30, leftMargin=20, rightMargin=20)
-                    story = []
-                    
-                    styles = getSampleStyleSheet()
-                    style_title = ParagraphStyle(name='Title', parent=styles['Heading1'], alignment=TA_CENTER, fontSize=16, spaceAfter=10, textColor=colors.darkblue)
-                    
-                    # Estilos da Tabela
-                    style_center = ParagraphStyle(name='Center', parent=styles['Normal'], alignment=TA_CENTER, fontSize=9, leading=11)
-                    style_left = ParagraphStyle(name='Left', parent=styles['Normal'], alignment=TA_LEFT, fontSize=9, leading=11)
-                    style_right = ParagraphStyle(name='Right', parent=styles['Normal'], alignment=TA_RIGHT, fontSize=9, leading=11)
-                    style_header_tab = ParagraphStyle(name='TabHeader', parent=style_center, fontName='Helvetica-Bold', textColor=colors.white, fontSize=9)
-                    
-                    # Estilos do Painel de Resumo
-                    style_resumo_item = ParagraphStyle(name='ResumoItem', parent=styles['Normal'], fontSize=9, leading=12)
-                    
-                    story.append(Paragraph("Relatório Geral de Notas de Crédito", style_title))
-                    
-                    # --- CÁLCULO INTELIGENTE DOS RESUMOS ---
-                    saldo_total_geral = 0
-                    resumo_pi = {} 
-                    # Nova Estrutura Direita: { 'NomeSecao': { 'NumeroNC': valor_saldo } }
-                    resumo_secao_detalhado = {} 
-
-                    for item in dados:
-                        saldo_item = float(item.get('saldo_disponivel', 0) or 0)
-                        saldo_total_geral += saldo_item
+                # TÉCNICO: Os dados já vêm agrupados por NC (SQL_RELATORIO_GERAL_POR_NC) e o
+                # documento é escrito diretamente no ficheiro. O ReportLab ainda precisa da story
+                # completa para paginar, por isso a memória cresce com o número de NCs (uma linha
+                # da tabela por NC), mas já não com o número de seções nem com uma cópia em BytesIO.
+                doc = SimpleDocTemplate(destino, pagesize=landscape(letter), topMargin=70, bottomMargin=30, leftMargin=20, rightMargin=20)
+                story = []
+                
+                styles = getSampleStyleSheet()
+                style_title = ParagraphStyle(name='Title', parent=styles['Heading1'], alignment=TA_CENTER, fontSize=16, spaceAfter=10, textColor=colors.darkblue)
+                
+                # Estilos da Tabela
+                style_center = ParagraphStyle(name='Center', parent=styles['Normal'], alignment=TA_CENTER, fontSize=9, leading=11)
+                style_left = ParagraphStyle(name='Left', parent=styles['Normal'], alignment=TA_LEFT, fontSize=9, leading=11)
+                style_right = ParagraphStyle(name='Right', parent=styles['Normal'], alignment=TA_RIGHT, fontSize=9, leading=11)
+                style_header_tab = ParagraphStyle(name='TabHeader', parent=style_center, fontName='Helvetica-Bold', textColor=colors.white, fontSize=9)
+                
+                # Estilos do Painel de Resumo
+                style_resumo_item = ParagraphStyle(name='ResumoItem', parent=styles['Normal'], fontSize=9, leading=12)
+                
+                story.append(Paragraph("Relatório Geral de Notas de Crédito", style_title))
+                
+                # --- CÁLCULO INTELIGENTE DOS RESUMOS ---
+                saldo_total_geral = 0
+                resumo_pi = {} 
+                # Nova Estrutura Direita: { 'NomeSecao': { 'NumeroNC': valor_saldo } }
+                resumo_secao_detalhado = {} 
+
+                # --- TABELA PRINCIPAL (Mantida Igual) ---
+                header = [
+                    Paragraph('NC', style_header_tab),
+                    Paragraph('Detalhamento por Seção', style_header_tab),
+                    Paragraph('PI', style_header_tab),
+                    Paragraph('ND', style_header_tab),
+                    Paragraph('V. Total', style_header_tab),
+                    Paragraph('Saldo Total', style_header_tab),
+                    Paragraph('Prazo', style_header_tab),
+                    Paragraph('Obs', style_header_tab)
+                ]
+                table_data = [header]
+                row_styles = []
+
+                # TÉCNICO: Uma só passagem pelos lotes do execute_stream: cada NC soma aos resumos
+                # e vira logo a sua linha da tabela (o resumo é inserido antes dela no fim).
+                for lote in dados:
+                    col = lote.indice()
+                    for item in lote:
+                        nc_num = str(item[col['numero_nc']])
+                        secoes = item[col['secoes']] or []
+                        saldo_nc = float(item[col['saldo_secoes']] or 0)
+                        saldo_total_geral += saldo_nc
                         
                         # Coleta Esquerda (Origem)
-                        pi = str(item.get('pi', 'SEM PI'))
-                        nd = str(item.get('natureza_despesa', 'SEM ND'))
+                        pi = str(item[col['pi']])
+                        nd = str(item[col['natureza_despesa']])
                         if pi not in resumo_pi: resumo_pi[pi] = {}
                         if nd not in resumo_pi[pi]: resumo_pi[pi][nd] = 0
-                        resumo_pi[pi][nd] += saldo_item
+                        resumo_pi[pi][nd] += saldo_nc
                         
                         # Coleta Direita (Destino com Rastreabilidade)
-                        sec = str(item.get('nome_secao', 'GERAL'))
-                        nc_num = str(item.get('numero_nc', ''))
-                        
-                        if sec not in resumo_secao_detalhado: resumo_secao_detalhado[sec] = {}
-                        if nc_num not in resumo_secao_detalhado[sec]: resumo_secao_detalhado[sec][nc_num] = 0
-                        resumo_secao_detalhado[sec][nc_num] += saldo_item
-
-                    # --- MONTAGEM DO TEXTO (HTML) ---
-                    header_html = "<font color='#00008B' size='10'><b>{}</b></font><br/><br/>"
-
-                    # 1. Coluna Esquerda: ORIGEM (Filtrando Zeros)
-                    texto_esquerda = header_html.format("ORIGEM (Por PI e ND):")
-                    
-                    for pi_key in sorted(resumo_pi.keys()):
-                        total_pi = sum(resumo_pi[pi_key].values())
-                        
-                        # MELHORIA 1: Só exibe PI se tiver saldo positivo
-                        if total_pi > 0.00:
-                            texto_esquerda += f"<b>PI: {pi_key}</b> (Total: {self.formatar_moeda(total_pi)})<br/>"
-                            
-                            for nd_key in sorted(resumo_pi[pi_key].keys()):
-                                val_nd = resumo_pi[pi_key][nd_key]
-                                # Só exibe ND se tiver saldo
-                                if val_nd > 0.00:
-                                    texto_esquerda += f"&nbsp;&nbsp;&nbsp;• ND {nd_key}: {self.formatar_moeda(val_nd)}<br/>"
-                            
-                            texto_esquerda += "<br/><br/>" # Espaço entre PIs
-
-                    # 2. Coluna Direita: DESTINO (Com NCs Detalhadas)
-                    texto_direita = header_html.format("DESTINO (Por Seção):")
-                    
-                    # Ordena seções por valor total (do maior para o menor)
-                    lista_secoes = []
-                    for sec, ncs_dict in resumo_secao_detalhado.items():
-                        total_sec = sum(ncs_dict.values())
-                        lista_secoes.append((sec, total_sec, ncs_dict))
-                    
-                    lista_secoes.sort(key=lambda x: x[1], reverse=True)
-                    
-                    for sec_nome, sec_total, ncs_dict in lista_secoes:
-                         # Só exibe Seção se tiver saldo
-                         if sec_total > 0.00:
-                             texto_direita += f"<font size='9'><b>{sec_nome}</b></font>: {self.formatar_moeda(sec_total)}<br/>"
-                             
-                             # MELHORIA 2: Lista quais NCs compõem esse saldo
-                             # Ordena NCs por valor
-                             ncs_sorted = sorted(ncs_dict.items(), key=lambda x: x[1], reverse=True)
-                             
-                             for nc_n, nc_v in ncs_sorted:
-                                 if nc_v > 0.00:
-                                     # Indentação com seta pequena e cor cinza escuro para diferenciar
-                                     texto_direita += f"&nbsp;&nbsp;<font color='#333333' size='8'>» {nc_n}: {self.formatar_moeda(nc_v)}</font><br/>"
-                             
-                             texto_direita += "<br/>" 
-
-                    # ---------------------------------------------------
-
-                    style_destaque = ParagraphStyle(name='Destaque', parent=styles['Normal'], alignment=TA_LEFT, fontSize=12, textColor=colors.darkblue, fontName='Helvetica-Bold')
-                    story.append(Paragraph(f"Saldo Total Disponível: {self.formatar_moeda(saldo_total_geral)}", style_destaque))
-                    story.append(Spacer(1, 0.1*inch))
-
-                    # Tabela Resumo Lado a Lado
-                    col_resumo_data = [[
-                        Paragraph(texto_esquerda, style_resumo_item), 
-                        Paragraph(texto_direita, style_resumo_item)
-                    ]]
-                    t_resumo = Table(col_resumo_data, colWidths=[5.5*inch, 5.0*inch])
-                    t_resumo.setStyle(TableStyle([
-                        ('VALIGN', (0,0), (-1,-1), 'TOP'),
-                        ('LINEBEFORE', (1,0), (1,-1), 1, colors.lightgrey),
-                        ('LEFTPADDING', (1,0), (1,-1), 20),
-                    ]))
-                    story.append(t_resumo)
-                    story.append(Spacer(1, 0.2*inch))
-                    
-                    # --- TABELA PRINCIPAL (Mantida Igual) ---
-                    ncs_agrupadas = {}
-                    for item in dados:
-                        num = item['numero_nc']
-                        if num not in ncs_agrupadas:
-                            ncs_agrupadas[num] = item.copy()
-                            ncs_agrupadas[num]['lista_secoes'] = []
-                        ncs_agrupadas[num]['lista_secoes'].append({
-                            'nome': item.get('nome_secao', ''),
-                            'val': item.get('valor_inicial', 0),
-                            'sal': item.get('saldo_disponivel', 0)
-                        })
-                    
-                    lista_final = list(ncs_agrupadas.values())
-                    
-                    header = [
-                        Paragraph('NC', style_header_tab),
-                        Paragraph('Detalhamento por Seção', style_header_tab),
-                        Paragraph('PI', style_header_tab),
-                        Paragraph('ND', style_header_tab),
-                        Paragraph('V. Total', style_header_tab),
-                        Paragraph('Saldo Total', style_header_tab),
-                        Paragraph('Prazo', style_header_tab),
-                        Paragraph('Obs', style_header_tab)
-                    ]
-                    table_data = [header]
-                    row_styles = []
-                    
-                    for i, nc in enumerate(lista_final):
                         txt_sec = ""
-                        for s in nc['lista_secoes']:
+                        for s in secoes:
+                            sec = str(s['nome'])
+                            if sec not in resumo_secao_detalhado: resumo_secao_detalhado[sec] = {}
+                            if nc_num not in resumo_secao_detalhado[sec]: resumo_secao_detalhado[sec][nc_num] = 0
+                            resumo_secao_detalhado[sec][nc_num] += float(s['sal'] or 0)
                             txt_sec += f"<b>{s['nome']}</b>: {self.formatar_moeda(s['val'])} (Disp: {self.formatar_moeda(s['sal'])})<br/><br/>"
                         txt_sec = txt_sec.rstrip("<br/><br/>")
 
-                        status = nc.get('status_calculado', 'Ativa')
+                        status = item[col['status_calculado']] or 'Ativa'
                         bg = colors.white
                         if status == 'Vencida': bg = colors.Color(1, 0.9, 0.9)
                         elif status == 'Sem Saldo': bg = colors.Color(0.95, 0.95, 0.95)
                         elif status == 'Ativa': bg = colors.Color(0.92, 1, 0.92)
                         
-                        row_styles.append(('BACKGROUND', (0, i+1), (-1, i+1), bg))
+                        row_styles.append(('BACKGROUND', (0, len(table_data)), (-1, len(table_data)), bg))
                         
-                        row = [
-                            Paragraph(str(nc.get('numero_nc')), style_center),
+                        table_data.append([
+                            Paragraph(nc_num, style_center),
                             Paragraph(txt_sec, style_left),
-                            Paragraph(str(nc.get('pi')), style_center),
-                            Paragraph(str(nc.get('natureza_despesa')), style_center),
-                            Paragraph(self.formatar_moeda(nc.get('valor_total_nc')), style_right),
-                            Paragraph(self.formatar_moeda(nc.get('saldo_disponivel_nc')), style_right),
-                            Paragraph(formatar_data_segura(nc.get('data_validade_empenho')), style_center),
-                            Paragraph(str(nc.get('observacao', '')), style_left)
-                        ]
-                        table_data.append(row)
-                    
-                    col_widths = [1.2*inch, 2.5*inch, 1.1*inch, 0.7*inch, 0.9*inch, 0.9*inch, 0.8*inch, 1.9*inch]
-                    
-                    t = Table(table_data, colWidths=col_widths, repeatRows=1)
-                    t.setStyle(TableStyle([
-                        ('BACKGROUND', (0,0), (-1,0), colors.darkblue),
-                        ('TEXTCOLOR', (0,0), (-1,0), colors.white),
-                        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-                        ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
-                        ('LEFTPADDING', (0,0), (-1,-1), 5),
-                        ('RIGHTPADDING', (0,0), (-1,-1), 5),
-                        ('TOPPADDING', (0,0), (-1,-1), 5),
-                        ('BOTTOMPADDING', (0,0), (-1,-1), 5),
-                    ] + row_styles))
+                            Paragraph(pi, style_center),
+                            Paragraph(nd, style_center),
+                            Paragraph(self.formatar_moeda(item[col['valor_total_nc']]), style_right),
+                            Paragraph(self.formatar_moeda(item[col['saldo_disponivel_nc']]), style_right),
+                            Paragraph(formatar_data_segura(item[col['data_validade_empenho']]), style_center),
+                            Paragraph(str(item[col['observacao']] or ''), style_left)
+                        ])
+
+                # --- MONTAGEM DO TEXTO (HTML) ---
+                header_html = "<font color='#00008B' size='10'><b>{}</b></font><br/><br/>"
+
+                # 1. Coluna Esquerda: ORIGEM (Filtrando Zeros)
+                texto_esquerda = header_html.format("ORIGEM (Por PI e ND):")
+                
+                for pi_key in sorted(resumo_pi.keys()):
+                    total_pi = sum(resumo_pi[pi_key].values())
                     
-                    story.append(t)
-                    doc.build(story, onFirstPage=add_header_footer, onLaterPages=add_header_footer)
-                    return file_in_memory.getvalue()
+                    # MELHORIA 1: Só exibe PI se tiver saldo positivo
+                    if total_pi > 0.00:
+                        texto_esquerda += f"<b>PI: {pi_key}</b> (Total: {self.formatar_moeda(total_pi)})<br/>"
+                        
+                        for nd_key in sorted(resumo_pi[pi_key].keys()):
+                            val_nd = resumo_pi[pi_key][nd_key]
+                            # Só exibe ND se tiver saldo
+                            if val_nd > 0.00:
+                                texto_esquerda += f"&nbsp;&nbsp;&nbsp;• ND {nd_key}: {self.formatar_moeda(val_nd)}<br/>"
+                        
+                        texto_esquerda += "<br/><br/>" # Espaço entre PIs
+
+                # 2. Coluna Direita: DESTINO (Com NCs Detalhadas)
+                texto_direita = header_html.format("DESTINO (Por Seção):")
+                
+                # Ordena seções por valor total (do maior para o menor)
+                lista_secoes = []
+                for sec, ncs_dict in resumo_secao_detalhado.items():
+                    total_sec = sum(ncs_dict.values())
+                    lista_secoes.append((sec, total_sec, ncs_dict))
+                
+                lista_secoes.sort(key=lambda x: x[1], reverse=True)
+                
+                for sec_nome, sec_total, ncs_dict in lista_secoes:
+                     # Só exibe Seção se tiver saldo
+                     if sec_total > 0.00:
+                         texto_direita += f"<font size='9'><b>{sec_nome}</b></font>: {self.formatar_moeda(sec_total)}<br/>"
+                         
+                         # MELHORIA 2: Lista quais NCs compõem esse saldo
+                         # Ordena NCs por valor
+                         ncs_sorted = sorted(ncs_dict.items(), key=lambda x: x[1], reverse=True)
+                         
+                         for nc_n, nc_v in ncs_sorted:
+                             if nc_v > 0.00:
+                                 # Indentação com seta pequena e cor cinza escuro para diferenciar
+                                 texto_direita += f"&nbsp;&nbsp;<font color='#333333' size='8'>» {nc_n}: {self.formatar_moeda(nc_v)}</font><br/>"
+                         
+                         texto_direita += "<br/>" 
+
+                # ---------------------------------------------------
+
+                style_destaque = ParagraphStyle(name='Destaque', parent=styles['Normal'], alignment=TA_LEFT, fontSize=12, textColor=colors.darkblue, fontName='Helvetica-Bold')
+                story.append(Paragraph(f"Saldo Total Disponível: {self.formatar_moeda(saldo_total_geral)}", style_destaque))
+                story.append(Spacer(1, 0.1*inch))
+
+                # Tabela Resumo Lado a Lado
+                col_resumo_data = [[
+                    Paragraph(texto_esquerda, style_resumo_item), 
+                    Paragraph(texto_direita, style_resumo_item)
+                ]]
+                t_resumo = Table(col_resumo_data, colWidths=[5.5*inch, 5.0*inch])
+                t_resumo.setStyle(TableStyle([
+                    ('VALIGN', (0,0), (-1,-1), 'TOP'),
+                    ('LINEBEFORE', (1,0), (1,-1), 1, colors.lightgrey),
+                    ('LEFTPADDING', (1,0), (1,-1), 20),
+                ]))
+                story.append(t_resumo)
+                story.append(Spacer(1, 0.2*inch))
+                
+                col_widths = [1.2*inch, 2.5*inch, 1.1*inch, 0.7*inch, 0.9*inch, 0.9*inch, 0.8*inch, 1.9*inch]
+                
+                t = Table(table_data, colWidths=col_widths, repeatRows=1)
+                t.setStyle(TableStyle([
+                    ('BACKGROUND', (0,0), (-1,0), colors.darkblue),
+                    ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+                    ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+                    ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
+                    ('LEFTPADDING', (0,0), (-1,-1), 5),
+                    ('RIGHTPADDING', (0,0), (-1,-1), 5),
+                    ('TOPPADDING', (0,0), (-1,-1), 5),
+                    ('BOTTOMPADDING', (0,0), (-1,-1), 5),
+                ] + row_styles))
+                
+                story.append(t)
+                doc.build(story, onFirstPage=add_header_footer, onLaterPages=add_header_footer)
 
             # === EXCEL E PDF EXTRATO (Mantidos) ===
             elif tipo == "excel_extrato":
@@ -782,7 +825,7 @@ class RelatoriosView(ft.Column):
                          pd.DataFrame(secoes_data).to_excel(writer, sheet_name='Saldos por Seção', index=False)
                          pd.DataFrame(nes_data).to_excel(writer, sheet_name='Empenhos', index=False)
                          pd.DataFrame(rec_data).to_excel(writer, sheet_name='Recolhimentos', index=False)
-                    return file_in_memory.getvalue()
+                    destino.write(file_in_memory.getvalue())
 
             elif tipo == "pdf_extrato":
                 # (Lógica inalterada - Layout Extrato Individual)
@@ -828,7 +871,7 @@ class RelatoriosView(ft.Column):
                             d_rec.append(row)
                     t_rec = Table(d_rec, colWidths=[1.0*inch, 1.5*inch, 1.2*inch, 3.8*inch]); t_rec.setStyle(TableStyle([('BACKGROUND', (0,0), (-1,0), colors.darkorange), ('TEXTCOLOR', (0,0), (-1,0), colors.white), ('GRID', (0,0), (-1,-1), 0.5, colors.grey)])); story.append(t_rec)
                     doc.build(story, onFirstPage=add_header_footer, onLaterPages=add_header_footer)
-                    return file_in_memory.getvalue()
+                    destino.write(file_in_memory.getvalue())
             else: raise Exception(f"Tipo desconhecido: {tipo}")
         except Exception as e:
             print(f"Erro ao gerar bytes: {e}")